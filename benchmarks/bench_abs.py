@@ -0,0 +1,50 @@
+"""
+Cost of `get_files` and `pprint` on deep trees with memoized absolute paths
+
+    python benchmarks/bench_abs.py
+"""
+
+import os
+import timeit
+
+import treefiles as tf
+
+
+def recursive_abs(tree):
+    """Previous implementation of `Tree.abs`, for reference"""
+    if tree.parent is None:
+        return tf.Str(os.path.abspath(tree.root))
+    return tf.Str(os.path.join(recursive_abs(tree.parent), tree.root))
+
+
+def recursive_get_files(tree):
+    all_files = [os.path.join(recursive_abs(tree), x) for x in tree.files.values()]
+    for x in tree.dirs:
+        all_files.extend(recursive_get_files(x))
+    return all_files
+
+
+def case_tree(depth=10, fanout=3, n_files=5):
+    root = tf.Tree("/data/cases")
+    level = [root]
+    for i in range(depth):
+        level = [d.dir(f"l{i}_{j}") for d in level for j in range(fanout)]
+        for d in level:
+            d.file(*[f"f{k}.vtk" for k in range(n_files)])
+    return root
+
+
+def main():
+    root = case_tree()
+    n_nodes = 1 + sum(3**i for i in range(1, 11))
+    t_ref = timeit.timeit(lambda: recursive_get_files(root), number=1)
+    t_files = timeit.timeit(root.get_files, number=1)
+    t_pprint = timeit.timeit(root.pprint, number=1)
+    print(f"{n_nodes} nodes, depth 10")
+    print(f"get_files, recursive abs: {t_ref:.3f} s")
+    print(f"get_files, cached abs:    {t_files:.3f} s")
+    print(f"pprint, cached abs:       {t_pprint:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
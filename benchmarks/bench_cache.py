@@ -0,0 +1,53 @@
+"""
+Overhead of `tf.cached` on a pipeline step: hashing the arguments, storing the
+result with its provenance and loading it back, against the step itself
+
+    python benchmarks/bench_cache.py [n_calls]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import treefiles as tf
+from treefiles.tree_cache import hash_args
+
+
+def step(mesh, params, i):
+    """Stands for an expensive step: 20 ms, 24 kB result"""
+    time.sleep(0.02)
+    return mesh[:1000] * params["k"].value + i
+
+
+def timed(func, *a):
+    t0 = time.perf_counter()
+    func(*a)
+    return time.perf_counter() - t0
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    mesh = np.random.rand(10**6, 3)  # 24 MB argument
+    params = tf.Params(tf.Param("k", 0.5), tf.Param("nu", 0.3))
+
+    dt = timed(hash_args, mesh, params)
+    print(f"{'hash 24 MB argument':>22}: {dt * 1000:8.2f} ms")
+
+    for key in (None, ["params", "i"]):
+        print(f"key={key}")
+        with tf.TmpDir() as tmp:
+            cached = tf.cached(tmp.path("ct"), key=key, max_entries=n // 2)(step)
+            cases = [
+                ("step", range(n), step),
+                ("cached, misses", range(n), cached),
+                ("cached, hits", range(n // 2, n), cached),
+            ]
+            for name, calls, func in cases:
+                dt = timed(lambda: [func(mesh, params, i) for i in calls])
+                print(f"{name:>22}: {dt / len(calls) * 1000:8.2f} ms per call")
+            print(f"{'':>22}  {cached.cache}, {len(cached.cache)} kept")
+
+
+if __name__ == "__main__":
+    main()
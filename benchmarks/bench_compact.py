@@ -0,0 +1,55 @@
+"""
+Memory used by a `Tree` and by its `CompactTree` copy
+
+    python benchmarks/bench_compact.py [n_files ...]
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+
+import treefiles as tf
+
+
+def results_tree(n_files: int, per_case: int = 100):
+    """Simulation outputs: case dirs holding a result dir of frames"""
+    root = tf.Tree("/scratch/results")
+    for i in range(n_files // per_case):
+        case = root.dir(f"case_{i:06d}")
+        case.file("params.json", mesh="mesh.vtk")
+        case.dir("frames").file(*[f"frame_{j:05d}.vtk" for j in range(per_case - 2)])
+    return root
+
+
+def measure(n_files: int):
+    gc.collect()
+    tracemalloc.start()
+    tree = results_tree(n_files)
+    tree_bytes = tracemalloc.get_traced_memory()[0]
+
+    t0 = time.perf_counter()
+    c = tree.compact()
+    t_build = time.perf_counter() - t0
+    del tree
+    gc.collect()
+    compact_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    mb = 1024**2
+    print(
+        f"{n_files:>8} files: Tree {tree_bytes / mb:8.1f} MB | "
+        f"CompactTree {compact_bytes / mb:8.1f} MB "
+        f"({tree_bytes / compact_bytes:.1f}x smaller, built in {t_build:.2f} s)"
+    )
+    return c
+
+
+def main():
+    sizes = [int(x) for x in sys.argv[1:]] or [10**5, 10**6]
+    for n in sizes:
+        measure(n)
+
+
+if __name__ == "__main__":
+    main()
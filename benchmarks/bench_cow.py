@@ -0,0 +1,79 @@
+"""
+Per-case trees formatted from one template, deep and copy-on-write copies, then
+read (`get_files`, `dump`) while fresh
+
+    python benchmarks/bench_cow.py [n_cases]
+"""
+
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import treefiles as tf
+
+
+def template(root="/scratch/study"):
+    """A case of about 1000 nodes"""
+    t = tf.Tree(os.path.join(root, "case_{:05d}"))
+    t.file("params.json", log="run.log")
+    mesh = t.dir("mesh").file(heart="heart.vtk", torso="torso.vtk")
+    for i in range(20):
+        step = t.dir(f"step_{i:02d}").file("state.npz")
+        step.dir("frames").file(*[f"frame_{j:03d}.vtk" for j in range(40)])
+    return t
+
+
+def measure(name, func, n_cases):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    cases = [func(i) for i in range(n_cases)]
+    dt = time.perf_counter() - t0
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    t0 = time.perf_counter()
+    paths = [c.heart for c in cases]
+    dt_lookup = time.perf_counter() - t0
+    print(
+        f"{name:>15}: {dt:6.2f} s, {size / 1024**2:7.1f} MB for {n_cases} cases "
+        f"| one lookup per case {dt_lookup:6.3f} s"
+    )
+    return paths
+
+
+def measure_reads(name, t, cow, n_cases, first=0):
+    copies = [t.f(i, cow=cow) for i in range(first, first + n_cases)]
+    t0 = time.perf_counter()
+    n = sum(len(c.get_files()) for c in copies)
+    dt_files = time.perf_counter() - t0
+    # Directories not created yet
+    copies = [t.f(i, cow=cow) for i in range(first + n_cases, first + 2 * n_cases)]
+    t0 = time.perf_counter()
+    for c in copies:
+        c.dump()
+    dt_dump = time.perf_counter() - t0
+    print(
+        f"{name:>15}: get_files {dt_files:6.3f} s ({n} files) "
+        f"| dump {dt_dump:6.3f} s for {n_cases} fresh copies"
+    )
+
+
+def main():
+    n_cases = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    t = template()
+    t.heart  # index of the template
+    a = measure("copy-on-write", lambda i: t.f(i, cow=True), n_cases)
+    b = measure("deep copy", lambda i: t.f(i), min(n_cases, 1000))
+    assert a[: len(b)] == b
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t = template(tmp)
+        measure_reads("copy-on-write", t, True, 100)
+        measure_reads("deep copy", t, False, 100, first=200)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Dumping a 20k-directory tree, with a simulated metadata latency
+
+    python benchmarks/bench_dump.py [latency_ms]
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import treefiles as tf
+from treefiles import tree_fs
+
+
+def recursive_dump(tree):
+    """Previous implementation of `Tree.dump`, for reference"""
+    for d in tree.dirs:
+        recursive_dump(d)
+    for d in tree.ndirs.values():
+        recursive_dump(d)
+    os.makedirs(tree.abs(), exist_ok=True)
+
+
+@contextmanager
+def latency(seconds: float, names=("mkdir", "stat")):
+    """Counts `os` calls and delays each of them, as a network filesystem"""
+    calls = {"n": 0}
+    funcs = {x: getattr(os, x) for x in names}
+
+    def slow(func):
+        def wrapper(*a, **k):
+            calls["n"] += 1
+            time.sleep(seconds)
+            return func(*a, **k)
+
+        return wrapper
+
+    for name, func in funcs.items():
+        setattr(os, name, slow(func))
+    try:
+        yield calls
+    finally:
+        for name, func in funcs.items():
+            setattr(os, name, func)
+
+
+def experiment(root, n_cases=1000):
+    t = tf.Tree(root)
+    for i in range(n_cases):
+        case = t.dir(f"case_{i:04d}")
+        case.dir("mesh", "logs", "params")
+        res = case.dir("results")
+        res.dir(*[f"step_{j}" for j in range(15)])
+    return t
+
+
+def main():
+    lat = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.0005
+    with tf.TmpDir() as tmp:
+        runs = [
+            ("recursive makedirs", recursive_dump),
+            ("dump", lambda t: tree_fs.dump(t)),
+            ("dump, 32 threads", lambda t: tree_fs.dump(t, workers=32)),
+        ]
+        for i, (name, func) in enumerate(runs):
+            t = experiment(tmp.path(f"exp_{i}"))
+            t.abs()
+            with latency(lat) as calls:
+                t0 = time.perf_counter()
+                func(t)
+                dt = time.perf_counter() - t0
+            print(f"{name:>20}: {dt:6.2f} s, {calls['n']} mkdir/stat calls")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Creating the directories of many samples formatted from one template
+
+    python benchmarks/bench_expand.py [n_samples]
+"""
+
+import sys
+import time
+
+import treefiles as tf
+
+
+def template(root):
+    t = tf.Tree(root)
+    t.dir("inputs").file("params.json")
+    t.dir("mesh").file(heart="heart.vtk")
+    out = t.dir("outputs")
+    out.dir(*[f"step_{j}" for j in range(5)])
+    return t
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tf.TmpDir() as tmp:
+        runs = [
+            ("f(i).dump() loop", lambda t: [t.f(i).dump() for i in range(n)]),
+            ("expand().dump()", lambda t: t.expand(range(n)).dump()),
+            ("expand, 16 threads", lambda t: t.expand(range(n)).dump(workers=16)),
+        ]
+        for k, (name, func) in enumerate(runs):
+            t = template(tmp.path(f"run_{k}", "sample_{:05d}"))
+            t0 = time.perf_counter()
+            func(t)
+            t1 = time.perf_counter()
+            if k == 0:
+                files = [x for i in range(n) for x in t.f(i).get_files()]
+            else:
+                files = t.expand(range(n)).get_files()
+            t2 = time.perf_counter()
+            print(f"{name:>20}: dump {t1 - t0:6.2f} s | get_files {t2 - t1:6.3f} s")
+            assert len(files) == 2 * n
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Queries on a directory of frames: glob and `Str.re` against `Tree.frame_index`
+
+    python benchmarks/bench_frames.py [n_frames]
+"""
+
+import os
+import sys
+import time
+
+import treefiles as tf
+
+
+def timed(name, func, n_calls):
+    t0 = time.perf_counter()
+    for _ in range(n_calls):
+        res = func()
+    dt = (time.perf_counter() - t0) / n_calls
+    print(f"{name:>35}: {dt * 1000:9.3f} ms per call")
+    return res
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10**5
+    with tf.TmpDir() as tmp:
+        d = tf.Tree(tmp.path("frames")).dump()
+        for i in range(n):
+            open(d.path(f"frame_{i:05d}.vtk"), "w").close()
+        # Indexes of a directory changed in the last seconds are not cached
+        old = time.time_ns() - 10 * 10**9
+        os.utime(d.abs(), ns=(old, old))
+
+        a = timed("glob()[i:j]", lambda: d.glob("frame_*.vtk")[100:200], 3)
+        timed("frame_index() build", lambda: tf.FrameIndex.build(d.abs()), 3)
+        idx = d.frame_index(pattern="*.vtk")
+        b = timed(
+            "frame_index()[i:j]", lambda: d.frame_index(pattern="*.vtk")[100:200], 100
+        )
+        assert a == b
+
+        target = n // 2 + 0.4
+        a = timed(
+            "nearest, Str.re on glob",
+            lambda: min(
+                d.glob("frame_*.vtk"), key=lambda x: abs(x.re("frame").idx - target)
+            ),
+            3,
+        )
+        b = timed("nearest, frame_index", lambda: idx.nearest(target), 1000)
+        assert a == b
+        timed("last 10, frame_index", lambda: idx.last(10), 1000)
+        timed("range, frame_index", lambda: idx.range(1000, 1100), 1000)
+
+
+if __name__ == "__main__":
+    main()
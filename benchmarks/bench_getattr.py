@@ -0,0 +1,62 @@
+"""
+Attribute lookup cost on deep and wide trees: alias index vs linear search
+
+    python benchmarks/bench_getattr.py
+"""
+
+import os
+import timeit
+
+import treefiles as tf
+
+
+def scan_lookup(tree, att):
+    """Previous implementation of `Tree.__getattr__`, for reference"""
+    if att in tree.files:
+        if tree.files[att] is None:
+            return
+        return tf.Str(os.path.join(tree.abs(), tree.files[att]))
+    for d in tree.dirs:
+        if d.root == att:
+            return d
+    for d in tree.dirs:
+        found = scan_lookup(d, att)
+        if found is not None:
+            return found
+    for alias, d in tree.ndirs.items():
+        if alias == att:
+            return d
+    for d in tree.ndirs.values():
+        found = scan_lookup(d, att)
+        if found is not None:
+            return found
+
+
+def wide_tree(n_dirs=500, n_files=100):
+    root = tf.Tree("/data/wide")
+    for i in range(n_dirs):
+        root.dir(f"d{i}").file(*[f"f{i}_{j}.vtk" for j in range(n_files)])
+    return root, f"f{n_dirs - 1}_{n_files - 1}"
+
+
+def deep_tree(depth=200, n_files=10):
+    root = o = tf.Tree("/data/deep")
+    for i in range(depth):
+        o = o.dir(f"d{i}").file(*[f"f{i}_{j}.vtk" for j in range(n_files)])
+    return root, f"f{depth - 1}_{n_files - 1}"
+
+
+def main():
+    for name, (root, att) in [("wide", wide_tree()), ("deep", deep_tree())]:
+        n = 20
+        t_scan = timeit.timeit(lambda: scan_lookup(root, att), number=n) / n
+        t_build = timeit.timeit(root._build_alias_index, number=1)
+        t_index = timeit.timeit(lambda: getattr(root, att), number=10 * n) / (10 * n)
+        print(
+            f"{name:>5}: linear search {t_scan * 1e6:10.1f} us/lookup | "
+            f"index build {t_build * 1e3:.1f} ms, lookup {t_index * 1e6:.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
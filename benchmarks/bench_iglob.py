@@ -0,0 +1,49 @@
+"""
+Time to the first result and peak memory of `glob` and `get_files` against their
+lazy variants, on a directory of frames
+
+    python benchmarks/bench_iglob.py [n_frames]
+"""
+
+import sys
+import time
+import tracemalloc
+
+import treefiles as tf
+from bench_walk import wide_tree
+
+
+def measure(name, func):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    it = iter(func())
+    next(it)
+    first = time.perf_counter() - t0
+    n = 1 + sum(1 for _ in it)
+    total = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(
+        f"{name:>25}: first {first * 1000:8.2f} ms | all {total:6.2f} s | "
+        f"peak {peak / 1024**2:6.1f} MB | {n} paths"
+    )
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10**5
+    with tf.TmpDir() as tmp:
+        frames = tf.Tree(tmp.path("frames")).dump()
+        for i in range(n):
+            open(frames.path(f"frame_{i:07d}.vtk"), "w").close()
+
+        measure("glob", lambda: frames.glob("*.vtk"))
+        measure("iglob", lambda: frames.iglob("*.vtk"))
+        measure("iglob(sort=True)", lambda: frames.iglob("*.vtk", sort=True))
+
+    tree = wide_tree(n)
+    measure("get_files", tree.get_files)
+    measure("iter_files", tree.iter_files)
+
+
+if __name__ == "__main__":
+    main()
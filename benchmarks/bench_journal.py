@@ -0,0 +1,50 @@
+"""
+Crash-safe registration of container outputs: saving `infos.tree` regularly
+against the journal
+
+    python benchmarks/bench_journal.py [n_files]
+"""
+
+import sys
+import time
+
+import treefiles as tf
+
+
+def register(ct, n, save_every=None):
+    t0 = time.perf_counter()
+    for i in range(n):
+        ct / f"case_{i % 10}/frame_{i:06d}.vtk"
+        if save_every and (i + 1) % save_every == 0:
+            ct.to_file("infos")  # previous way to persist registrations
+    return time.perf_counter() - t0
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with tf.TmpDir() as tmp:
+        ct = tf.Container(tmp.path("saved"))
+        ct._journal = None
+        dt = register(ct, n, save_every=100)
+        print(f"{'infos.tree every 100':>25}: {dt:6.2f} s for {n} files")
+
+        ct = tf.Container(tmp.path("journal"))
+        ct.compact_every = n + 1
+        dt = register(ct, n)
+        ct._journal.flush()
+        print(f"{'journal':>25}: {dt:6.2f} s for {n} files")
+
+        t0 = time.perf_counter()
+        ct = tf.Container(tmp.path("journal"))
+        assert len(ct.get_files()) == n
+        print(f"{'open, journal replayed':>25}: {time.perf_counter() - t0:6.2f} s")
+
+        ct.compact()
+        t0 = time.perf_counter()
+        ct = tf.Container(tmp.path("journal"))
+        assert len(ct.get_files()) == n
+        print(f"{'open, after compaction':>25}: {time.perf_counter() - t0:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
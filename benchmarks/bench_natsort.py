@@ -0,0 +1,45 @@
+"""
+Natural sort of simulation outputs, against the previous implementation
+
+    python benchmarks/bench_natsort.py [n_names]
+"""
+
+import random
+import re
+import sys
+import time
+
+import treefiles as tf
+
+
+def legacy_natural_sort(l):
+    convert = lambda text: int(text) if text.isdigit() else text.lower()
+    alphanum_key = lambda key: [convert(c) for c in re.split(r"(\d+)", key)]
+    return sorted(l, key=alphanum_key)
+
+
+def timed(func, *a):
+    t0 = time.perf_counter()
+    res = func(*a)
+    return res, time.perf_counter() - t0
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10**6
+    rng = random.Random(0)
+    cases = {
+        "frame_<int>.vtk": [f"frame_{i}.vtk" for i in range(n)],
+        "case_<int>/step_<int>.vtk": [
+            f"case_{i % 1000}/step_{i // 1000}.vtk" for i in range(n)
+        ],
+    }
+    for name, names in cases.items():
+        rng.shuffle(names)
+        old, t_old = timed(legacy_natural_sort, names)
+        new, t_new = timed(tf.natural_sort, names)
+        assert old == new
+        print(f"{name:>26}: {n} names, {t_old:6.2f} s -> {t_new:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
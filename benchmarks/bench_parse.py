@@ -0,0 +1,77 @@
+"""
+Loading a large `.tree` manifest, parsed or from its compiled `.treec` version
+
+    python benchmarks/bench_parse.py [n_lines ...]
+"""
+
+import os
+import sys
+import time
+
+import treefiles as tf
+from treefiles.tree_format import parse_lines, set_parents
+
+
+def quadratic_set_parents(lines):
+    """Previous implementation of `set_parents`, for reference"""
+    di = lines[1].indent
+    for i, x in enumerate(lines):
+        k = 0
+        for j, y in enumerate(lines[i::-1]):
+            if x.indent == y.indent + di:
+                k = i - j
+                break
+        x.parent_line = k
+
+
+def manifest(n_lines: int, per_case: int = 50):
+    """Simulation cases holding frames, with comments and environment variables"""
+    lines = [". ${TF_BENCH_ROOT}  # generated manifest"]
+    for i in range(n_lines // per_case):
+        lines.append(f"  . case_{i:06d}")
+        lines.append(f"    - params: params_{i}.json")
+        lines.append(f"    . frames: results/frames")
+        for j in range(per_case - 3):
+            lines.append(f"      - f{j}: frame_{j:05d}.vtk")
+    return lines
+
+
+def main():
+    os.environ["TF_BENCH_ROOT"] = "/scratch/results"
+    sizes = [int(x) for x in sys.argv[1:]] or [10**4, 10**5]
+    for n in sizes:
+        lines = manifest(n)
+        t0 = time.perf_counter()
+        parsed = parse_lines(lines)
+        t1 = time.perf_counter()
+        set_parents(parsed)
+        t2 = time.perf_counter()
+        tf.Tree.from_str(lines)
+        t3 = time.perf_counter()
+        print(
+            f"{len(lines):>8} lines: parse {t1 - t0:6.3f} s | set_parents {t2 - t1:6.3f} s "
+            f"| from_str {t3 - t2:6.3f} s"
+        )
+        with tf.TmpDir() as tmp:
+            fname = tmp.path("manifest.tree")
+            with open(fname, "w") as f:
+                f.write("\n".join(lines))
+            t0 = time.perf_counter()
+            tf.Tree.from_file(fname)
+            t1 = time.perf_counter()
+            tf.Tree.from_file(fname, compiled=True)
+            t2 = time.perf_counter()
+            tf.Tree.from_file(fname, compiled=True)
+            t3 = time.perf_counter()
+            print(
+                f"{'':>15} from_file {t1 - t0:6.3f} s | compiling {t2 - t1:6.3f} s "
+                f"| compiled {t3 - t2:6.3f} s"
+            )
+        if n <= 10**4:
+            t0 = time.perf_counter()
+            quadratic_set_parents(parsed)
+            print(f"{'':>15} previous set_parents {time.perf_counter() - t0:6.3f} s")
+
+
+if __name__ == "__main__":
+    main()
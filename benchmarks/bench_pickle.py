@@ -0,0 +1,53 @@
+"""
+Pickling large trees, as done when shipping them to pool workers
+
+    python benchmarks/bench_pickle.py [n_files ...]
+"""
+
+import pickle
+import sys
+import time
+from multiprocessing import Pool
+
+import treefiles as tf
+from bench_compact import results_tree
+
+
+def n_files(tree):
+    return len(tree.get_file_keys())
+
+
+def timed(func, *a):
+    t0 = time.perf_counter()
+    res = func(*a)
+    return res, time.perf_counter() - t0
+
+
+def main():
+    sizes = [int(x) for x in sys.argv[1:]] or [10**5, 10**6]
+    for n in sizes:
+        tree = results_tree(n)
+        print(f"{n} files")
+
+        data, t_dump = timed(pickle.dumps, tree, 5)
+        x, t_load = timed(pickle.loads, data)
+        assert n_files(x) == n_files(tree)
+        print(
+            f"{'pickle':>20}: {len(data) / 1024**2:6.1f} MB | "
+            f"dumps {t_dump:5.2f} s | loads {t_load:5.2f} s"
+        )
+
+        data, t_dump = timed(lambda: pickle.dumps(tree.to_dict(), 5))
+        _, t_load = timed(lambda: tf.Tree.from_dict(pickle.loads(data)))
+        print(
+            f"{'to_dict/from_dict':>20}: {len(data) / 1024**2:6.1f} MB | "
+            f"dumps {t_dump:5.2f} s | loads {t_load:5.2f} s"
+        )
+
+        with Pool(4) as pool:
+            res, dt = timed(pool.map, n_files, [tree] * 8)
+        print(f"{'8 pool tasks':>20}: {dt:5.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Pruning a results tree of 100k declared entries, with a simulated metadata latency
+
+    python benchmarks/bench_prune.py [latency_ms]
+"""
+
+import os
+import sys
+import time
+
+import treefiles as tf
+from bench_dump import latency
+
+
+def stat_prune(tree):
+    """Previous implementation of `Tree.prune`: one stat per entry, for reference"""
+    c = tf.Tree(tree.abs())
+    for d in tree.dirs:
+        if os.path.isdir(d.abs()):
+            stat_prune(d).copy_init_(c.dir(d.root))
+    for al, f in tree.files.items():
+        if os.path.isfile(tree.path(f)):
+            c.file(**{al: f})
+    return c
+
+
+def results(root, n_cases=500, n_frames=200):
+    """Half of the cases ran, each writing half of its frames"""
+    t = tf.Tree(root)
+    for i in range(n_cases):
+        case = t.dir(f"case_{i:04d}")
+        case.file("params.json", "log.txt")
+        case.dir("frames").file(*[f"frame_{j:04d}.vtk" for j in range(n_frames)])
+        if i % 2 == 0:
+            case.frames.dump()
+            for f in case.get_files()[: n_frames // 2]:
+                open(f, "w").close()
+    return t
+
+
+def main():
+    lat = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.0002
+    with tf.TmpDir() as tmp:
+        t = results(tmp.path("results"))
+        n = len(t.get_files())
+        runs = [
+            ("stat per entry", stat_prune),
+            ("prune", lambda x: x.prune()),
+            ("prune, 32 threads", lambda x: x.prune(workers=32)),
+        ]
+        for name, func in runs:
+            with latency(lat, ("stat", "scandir")) as calls:
+                t0 = time.perf_counter()
+                p = func(t)
+                dt = time.perf_counter() - t0
+            kept = len(p.get_files())
+            print(
+                f"{name:>20}: {dt:6.2f} s, {calls['n']} stat/scandir calls, "
+                f"{kept}/{n} files kept"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Frame indices of many output paths: `Str.re` per path against `Str.re_many`
+
+    python benchmarks/bench_re.py [n_paths]
+"""
+
+import re
+import sys
+import time
+
+import numpy as np
+
+import treefiles as tf
+
+
+def legacy_re(self, pat):
+    """Previous `Str.re`, compiled on each call"""
+    m = re.search(rf"(.+)?{pat}_(\d+)(.+)?", self)
+    if m:
+        a, b, c = m[1], f"{pat}_{m[2]}", m[3]
+        return tf.tree.StrReResult(int(m[2]), a, b, c)
+
+
+def timed(func, repeat=3):
+    """Result and best time of a few runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        res = func()
+        best = min(best, time.perf_counter() - t0)
+    return res, best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10**6
+    paths = [tf.Str(f"/scratch/case_{i % 100}/frame_{i:07d}.vtk") for i in range(n)]
+
+    old, t_old = timed(lambda: np.array([legacy_re(x, "frame").idx for x in paths]))
+    cur, t_cur = timed(lambda: np.array([x.re("frame").idx for x in paths]))
+    new, t_new = timed(lambda: tf.Str.re_many(paths, "frame").idx)
+    assert (old == new).all() and (cur == new).all()
+    print(f"{n} paths")
+    print(f"{'Str.re, compiled per call':>30}: {t_old:6.2f} s")
+    print(f"{'Str.re, cached pattern':>30}: {t_cur:6.2f} s")
+    print(f"{'Str.re_many':>30}: {t_new:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Registration of container outputs with `/` and `register_many`, against the
+previous registration walking the tree and dumping the directory for each file
+
+    python benchmarks/bench_register.py [n_files]
+"""
+
+import os
+import sys
+import time
+
+import treefiles as tf
+
+
+def legacy_register(self, other):
+    ds = other.split(os.path.sep)
+    aze = os.path.splitext(ds[-1])[0]
+    if hasattr(self, aze) and getattr(self, aze) == self.path(other):
+        return False
+    o = self
+    for x in ds[:-1]:
+        d = next((d for d in reversed(o.dirs) if d.root == x), None)
+        o = o.dir(x) if d is None else d
+    o.dump()
+    o.file(ds[-1])
+    return True
+
+
+def timed(name, func, n):
+    with tf.TmpDir() as tmp:
+        ct = tf.Container(tmp.path("ct"))
+        ct.compact_every = n + 1
+        t0 = time.perf_counter()
+        func(ct)
+        dt = time.perf_counter() - t0
+        assert len(ct.get_files()) == n
+    print(f"{name:>20}: {dt:6.2f} s | {n / dt:8.0f} files/s")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10**5
+    paths = [f"case_{i % 100:03d}/step_{i % 7}/frame_{i:06d}.vtk" for i in range(n)]
+
+    def legacy(ct):
+        for x in paths:
+            if legacy_register(ct, x):
+                ct._log([x])
+
+    def truediv(ct):
+        for x in paths:
+            ct / x
+
+    timed("previous /", legacy, n)
+    timed("/", truediv, n)
+    timed("register_many", lambda ct: ct.register_many(paths), n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Parameter sweep writing the same mesh and config into many containers: plain
+copies against a shared `BlobStore`, filled with `put` or with `dedup` once written
+
+    python benchmarks/bench_store.py [n_containers] [mesh_mb]
+"""
+
+import os
+import shutil
+import sys
+import time
+
+import treefiles as tf
+
+
+def disk_usage(path):
+    """Bytes allocated under `path`, hard links counted once"""
+    seen, total = set(), 0
+    for root, _, files in os.walk(path):
+        for x in files:
+            st = os.lstat(os.path.join(root, x))
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_blocks * 512
+    return total
+
+
+def sweep(tmp, n, src, how):
+    store = tf.BlobStore(tmp.path(".objects")) if how != "copy" else None
+    t0 = time.perf_counter()
+    for i in range(n):
+        ct = tf.Container(tmp.path(f"case_{i:03d}"), store=store)
+        if how == "copy":
+            shutil.copyfile(src, ct / "mesh/heart.vtk")
+        elif how == "put":
+            ct.put(src, "mesh/heart.vtk")
+        else:
+            shutil.copyfile(src, ct / "mesh/heart.vtk")
+            ct.dedup(ct.heart)
+        tf.dump_str(ct / "params.txt", f"stiffness={i}")
+        ct.save()
+    return time.perf_counter() - t0
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    mb = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    for how in ("copy", "put", "dedup"):
+        with tf.TmpDir() as tmp:
+            src = tmp.path("heart.vtk")
+            with open(src, "wb") as f:
+                f.write(os.urandom(mb * 2**20))
+            os.utime(src, (time.time() - 60,) * 2)  # an old template
+            dt = sweep(tmp, n, src, how)
+            du = disk_usage(tmp.abs()) - os.stat(src).st_blocks * 512
+            print(f"{how:>6}: {dt:6.2f} s | {du / 2**20:8.1f} MB on disk")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Traversals of large trees: methods built on `Tree.walk` against the previous
+recursive versions
+
+    python benchmarks/bench_walk.py [n_nodes]
+"""
+
+import sys
+import time
+
+import treefiles as tf
+
+
+def wide_tree(n_nodes: int):
+    """Case dirs of 10 step dirs, each holding 2 files"""
+    root = tf.Tree("/scratch/study")
+    for i in range(n_nodes // 11):
+        case = tf.Tree(f"case_{i:06d}", parent=root)
+        root.dirs.append(case)
+        for j in range(10):
+            step = tf.Tree(f"step_{j:02d}", parent=case)
+            step.files.update(state="state.npz", log="run.log")
+            case.ndirs[f"s{j}"] = step
+    return root
+
+
+def deep_tree(depth: int):
+    """Chain of directories holding one file each"""
+    root = node = tf.Tree("/scratch/deep")
+    for i in range(depth):
+        child = tf.Tree(f"d{i % 10}", parent=node)
+        child.files[f"f{i}"] = "x.txt"
+        node.dirs.append(child)
+        node = child
+    return root
+
+
+# Previous recursive versions
+
+
+def get_files(self):
+    all_files = []
+    for x in self.files.values():
+        all_files.append(self.path(x))
+    for x in self.dirs:
+        all_files.extend(get_files(x))
+    for x in self.ndirs.values():
+        all_files.extend(get_files(x))
+    return all_files
+
+
+def get_file_keys(self):
+    all_files = list(self.files.keys())
+    for x in self.dirs:
+        all_files.extend(get_file_keys(x))
+    for x in self.ndirs.values():
+        all_files.extend(get_file_keys(x))
+    return all_files
+
+
+def to_dict(self):
+    return dict(
+        name=self._name,
+        dirs=[to_dict(x) for x in self.dirs],
+        ndirs={al: to_dict(x) for al, x in self.ndirs.items()},
+        files={al: x for al, x in self.files.items()},
+    )
+
+
+def from_dict(d, parent=None):
+    c = tf.Tree(d["name"])
+    c.parent = parent
+    c.files = d.get("files", [])
+    c.dirs = [from_dict(x, c) for x in d.get("dirs", [])]
+    c.ndirs = {al: from_dict(x, c) for al, x in d.get("ndirs", {}).items()}
+    return c
+
+
+def copy(self, parent=None):
+    c = tf.Tree()
+    c.dirs = [copy(x, c) for x in self.dirs]
+    c.ndirs = {k: copy(x, c) for k, x in self.ndirs.items()}
+    c.files = dict(self.files)
+    c.parent = parent
+    c.root = self.root
+    return c
+
+
+def timed(func, *a):
+    t0 = time.perf_counter()
+    try:
+        func(*a)
+    except RecursionError:
+        return "RecursionError"
+    return f"{time.perf_counter() - t0:6.3f} s"
+
+
+def main():
+    n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 10**5
+    d = wide_tree(n_nodes).to_dict()
+    for name, tree in [
+        (f"{n_nodes} nodes", wide_tree(n_nodes)),
+        ("depth 5000", deep_tree(5000)),
+    ]:
+        print(name)
+        if name.startswith("depth"):
+            d = tree.to_dict()
+        cases = [
+            ("get_files", get_files, tf.Tree.get_files),
+            ("get_file_keys", get_file_keys, tf.Tree.get_file_keys),
+            ("to_dict", to_dict, tf.Tree.to_dict),
+            ("from_dict", lambda _: from_dict(d), lambda _: tf.Tree.from_dict(d)),
+            ("copy", copy, tf.Tree.copy),
+        ]
+        for case, old, new in cases:
+            print(f"{case:>15}: recursive {timed(old, tree)} | walk {timed(new, tree)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Throughput of processes registering files in one container, each logging to its
+shard of the journal, and time of the merge by the owner
+
+    python benchmarks/bench_writers.py [n_files]
+"""
+
+import sys
+import time
+
+import treefiles as tf
+from treefiles.tree_journal import Journal
+
+
+def register(args):
+    ct, k, n = args
+    for i in range(k * n, (k + 1) * n):
+        ct / f"w_{k}/f_{i}.txt"
+    ct.save()
+
+
+def append(args):
+    fname, k, n = args
+    journal = Journal(fname)
+    for i in range(k * n, (k + 1) * n):
+        journal.append("f", f"w_{k}/f_{i}.txt")
+    journal.flush()
+
+
+def run(pool, func, args):
+    t0 = time.perf_counter()
+    pool.map(func, args)
+    return time.perf_counter() - t0
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10**5
+    for n_procs in (1, 4, 16, 32):
+        with tf.TmpDir() as tmp, tf.NestablePool(n_procs) as pool:
+            ct = tf.Container(tmp.path("ct"))
+            m = n // n_procs
+            dt = run(pool, register, [(ct, k, m) for k in range(n_procs)])
+            t0 = time.perf_counter()
+            ct.save()
+            merge = time.perf_counter() - t0
+            assert len(ct.get_files()) == m * n_procs
+
+            fname = tmp.path("journal/infos.journal")
+            tf.Tree(tmp.path("journal")).dump()
+            Journal(fname)  # owned by this process
+            dt_log = run(pool, append, [(fname, k, m) for k in range(n_procs)])
+            print(
+                f"{n_procs:>3} processes: registration {m * n_procs / dt:8.0f} files/s"
+                f" | journal only {m * n_procs / dt_log:8.0f} records/s"
+                f" | merge and save {merge:5.2f} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 import pickle
+import random
+import re
 import shutil
 import unittest
 
@@ -76,5 +78,48 @@ class TestFiles(unittest.TestCase):
         self.assertEqual(aa.sibling("oui"), aa)
 
 
+def legacy_natural_sort(l):
+    """Previous `natural_sort`, lists as keys"""
+    convert = lambda text: int(text) if text.isdigit() else text.lower()
+    alphanum_key = lambda key: [convert(c) for c in re.split(r"(\d+)", key)]
+    return sorted(l, key=alphanum_key)
+
+
+class TestNaturalSort(unittest.TestCase):
+    def test_same_as_legacy(self):
+        rng = random.Random(0)
+        cases = [
+            [f"frame_{rng.randrange(200)}.vtk" for _ in range(300)],
+            [f"frame_{rng.randrange(200):03d}.vtk" for _ in range(300)],
+            [
+                f"case_{rng.randrange(5)}/step_{rng.randrange(20)}.npz"
+                for _ in range(300)
+            ],
+            [f"{rng.choice('aAbB_')}{rng.randrange(30)}" for _ in range(300)],
+            ["f_1.vtk", "f_1.vtk.bak", "f_.vtk", "f_10.vtk"],
+            ["a1a", "a11a", "a2a"],
+            ["x", "x", "x10"],
+        ]
+        for names in cases:
+            self.assertEqual(tf.natural_sort(names), legacy_natural_sort(names))
+            self.assertEqual(
+                tf.natural_sort(reversed(names)), legacy_natural_sort(names[::-1])
+            )
+
+    def test_key_and_inplace(self):
+        names = ["frame_10.vtk", "frame_2.vtk", "frame_1.vtk"]
+        self.assertEqual(
+            tf.natural_sort(names), ["frame_1.vtk", "frame_2.vtk", "frame_10.vtk"]
+        )
+        items = [(x, i) for i, x in enumerate(names)]
+        self.assertEqual(
+            [i for _, i in tf.natural_sort(items, key=lambda x: x[0])], [2, 1, 0]
+        )
+        # Keys always start with text, numbers never compare with text
+        self.assertEqual(tf.natural_sort(["1a", "a1", "a"]), ["1a", "a", "a1"])
+        tf.natural_sort_(names)
+        self.assertEqual(names, ["frame_1.vtk", "frame_2.vtk", "frame_10.vtk"])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,475 @@
+import os
+import pickle
+import random
+import sys
+import tempfile
+import unittest
+
+import treefiles as tf
+
+
+def scan_lookup(tree, att):
+    """Reference implementation: linear search of `Tree.__getattr__`"""
+    if att in tree.files:
+        if tree.files[att] is None:
+            return
+        return os.path.join(tree.abs(), tree.files[att])
+    for d in tree.dirs:
+        if d.root == att:
+            return d
+    for d in tree.dirs:
+        found = scan_lookup(d, att)
+        if found is not None:
+            return found
+    for alias, d in tree.ndirs.items():
+        if alias == att:
+            return d
+    for d in tree.ndirs.values():
+        found = scan_lookup(d, att)
+        if found is not None:
+            return found
+
+
+def random_tree(seed, n=200):
+    rng = random.Random(seed)
+    names = [f"n{i}" for i in range(15)]
+    root = tf.Tree("/data/root")
+    nodes = [root]
+    for _ in range(n):
+        node = rng.choice(nodes)
+        r = rng.random()
+        if r < 0.3:
+            nodes.append(node.dir(rng.choice(names)))
+        elif r < 0.4:
+            nodes.append(node.dir(**{rng.choice(names): rng.choice(names)}))
+        elif r < 0.9:
+            node.file(**{rng.choice(names): f"{rng.choice(names)}.vtk"})
+        else:
+            node.file(**{rng.choice(names): None})
+    return root, nodes
+
+
+def deep_tree(depth):
+    """Chain of directories holding one file each"""
+    lines = [". /data"]
+    for i in range(depth):
+        lines.append(f"{' ' * 2 * (i + 1)}. d{i % 10}")
+        lines.append(f"{' ' * 2 * (i + 2)}- f{i}: x.txt")
+    return tf.Tree.from_str(lines)
+
+
+class TestAliasIndex(unittest.TestCase):
+    def check(self, nodes):
+        for node in nodes:
+            for att in [f"n{i}" for i in range(15)]:
+                expected = scan_lookup(node, att)
+                if expected is None and node.parent is None and att not in node.files:
+                    with self.assertRaises(AttributeError):
+                        getattr(node, att)
+                    continue
+                found = getattr(node, att)
+                if isinstance(expected, tf.Tree):
+                    self.assertIs(found, expected)
+                else:
+                    self.assertEqual(found, expected)
+
+    def test_lookup_order(self):
+        for seed in range(5):
+            _, nodes = random_tree(seed)
+            self.check(nodes)
+
+    def test_incremental_updates(self):
+        for seed in range(5):
+            rng = random.Random(seed)
+            root, nodes = random_tree(seed)
+            self.check(nodes)
+            for _ in range(30):
+                node = rng.choice(nodes)
+                r = rng.random()
+                if r < 0.3:
+                    nodes.append(node.dir(f"n{rng.randrange(15)}"))
+                elif r < 0.4:
+                    nodes.append(node.dir(**{f"n{rng.randrange(15)}": "x"}))
+                elif r < 0.5 and node.parent is not None:
+                    node.root = f"n{rng.randrange(15)}"
+                else:
+                    node.file(**{f"n{rng.randrange(15)}": rng.choice(["a.txt", None])})
+                self.check(nodes)
+
+    def test_copy_and_from_dict(self):
+        root, _ = random_tree(2)
+        for other in (root.copy(), tf.Tree.from_dict(root.to_dict())):
+            for att in [f"n{i}" for i in range(15)]:
+                expected = scan_lookup(root, att)
+                found = scan_lookup(other, att) if expected is not None else None
+                if isinstance(expected, tf.Tree):
+                    self.assertEqual(getattr(other, att).abs(), found.abs())
+                elif expected is not None:
+                    self.assertEqual(getattr(other, att), found)
+
+    def test_inplace_change(self):
+        root = tf.Tree("/data")
+        root.dir("a").file("x.txt")
+        self.assertEqual(root.x, "/data/a/x.txt")
+        del root.a.files["x"]
+        root.dir("b").files["x"] = "x.vtk"
+        self.assertEqual(root.x, "/data/b/x.vtk")
+
+    def test_inplace_containers(self):
+        root = tf.Tree("/data")
+        a = root.dir("a")
+        a.file("x.txt")
+        root.dir(b="b").file("y.txt")
+        self.assertEqual(root.x, "/data/a/x.txt")
+        root.files["x"] = "z.txt"
+        self.assertEqual(root.x, "/data/z.txt")
+        self.assertIs(root.a, a)
+        self.assertEqual(root.y, "/data/b/y.txt")
+        root.dirs.remove(a)
+        del root.files["x"]
+        with self.assertRaises(AttributeError):
+            root.a
+        with self.assertRaises(AttributeError):
+            root.x
+        root.ndirs.clear()
+        with self.assertRaises(AttributeError):
+            root.b
+        with self.assertRaises(AttributeError):
+            root.y
+        root.dir("c").dir("d")
+        self.assertEqual(root.d.abs(), "/data/c/d")
+        d = tf.Tree("d", parent=root)
+        root.dirs.insert(0, d)
+        self.assertIs(root.d, d)
+
+    def test_replaced_named_dir(self):
+        t = tf.Tree("/r")
+        t.file("out.x")
+        t.dir(out="old").file("mesh.vtk")
+        self.assertEqual(t.mesh, "/r/old/mesh.vtk")
+        t.dir(out="new")
+        with self.assertRaises(AttributeError):
+            t.mesh
+
+
+class TestAbsCache(unittest.TestCase):
+    def test_rename_and_reparent(self):
+        root = tf.Tree("/data/root")
+        leaf = root.dir("a").dir("b").file("x.txt")
+        self.assertEqual(leaf.abs(), "/data/root/a/b")
+        self.assertEqual(root.x, "/data/root/a/b/x.txt")
+
+        root.root = "/other"
+        self.assertEqual(leaf.abs(), "/other/a/b")
+        root.a.root = "c"
+        self.assertEqual(root.x, "/other/c/b/x.txt")
+
+        leaf.parent = tf.Tree("/moved")
+        self.assertEqual(leaf.abs(), "/moved/b")
+        self.assertEqual(root.c.abs(), "/other/c")
+
+    def test_copy(self):
+        root = tf.Tree("/data/{}")
+        root.dir("a").dir("b")
+        self.assertEqual(root.b.abs(), "/data/{}/a/b")
+        c = root.f(3)
+        self.assertEqual(c.b.abs(), "/data/3/a/b")
+        self.assertEqual(root.b.abs(), "/data/{}/a/b")
+
+    def test_relative_root(self):
+        root = tf.Tree("rel")
+        child = root.dir("a")
+        with tf.TmpDir() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp.abs())
+            try:
+                self.assertEqual(child.abs(), os.path.join(os.getcwd(), "rel", "a"))
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(child.abs(), os.path.join(cwd, "rel", "a"))
+
+
+class TestCompactTree(unittest.TestCase):
+    def test_read_api(self):
+        for seed in range(5):
+            root, nodes = random_tree(seed)
+            for node in nodes[::2]:
+                node.file(
+                    **{al: "set.txt" for al, f in node.files.items() if f is None}
+                )
+            c = root.compact()
+            self.assertEqual(c.abs(), root.abs())
+            self.assertEqual(c.get_file_keys(), root.get_file_keys())
+            self.assertEqual(c.pprint(comment="hello"), root.pprint(comment="hello"))
+            self.assertEqual(c.to_dict(), root.to_dict())
+            self.assertEqual(c.to_tree().to_dict(), root.to_dict())
+            self.assertEqual(c.get_files(), root.get_files())
+            for att in [f"n{i}" for i in range(15)]:
+                expected = scan_lookup(root, att)
+                if expected is None and att not in root.files:
+                    with self.assertRaises(AttributeError):
+                        getattr(c, att)
+                elif isinstance(expected, tf.Tree):
+                    self.assertEqual(getattr(c, att).abs(), expected.abs())
+                else:
+                    self.assertEqual(getattr(c, att), expected)
+
+    def test_views(self):
+        root = tf.Tree("/data")
+        root.dir("a").file("x.txt", y="z.vtk").dir(b="c")
+        c = root.compact()
+        self.assertEqual(c.a.files, {"x": "x.txt", "y": "z.vtk"})
+        self.assertEqual(c.b.abs(), "/data/a/c")
+        self.assertEqual(c.b.parent.path("x.txt"), c.x)
+        self.assertEqual([d.root for d in c.dirs], ["a"])
+        self.assertEqual(list(c.a.ndirs), ["b"])
+
+    def test_unset_files(self):
+        c = tf.Tree("/r").file("a.x", b=None).compact()
+        self.assertEqual(c.get_files(), ["/r/a.x"])
+        self.assertEqual(c.get_file_keys(), ["a", "b"])
+
+
+class TestCopyOnWrite(unittest.TestCase):
+    names = [f"n{i}" for i in range(15)]
+
+    def lookups(self, tree):
+        res = {}
+        for att in self.names:
+            try:
+                x = getattr(tree, att)
+            except AttributeError:
+                x = AttributeError
+            res[att] = x.abs() if isinstance(x, tf.Tree) else x
+        return res
+
+    def check_same(self, c, expected):
+        self.assertEqual(self.lookups(c), self.lookups(expected))
+        self.assertEqual(c.to_dict(), expected.to_dict())
+
+    def test_lookups(self):
+        for seed in range(5):
+            root, nodes = random_tree(seed)
+            root.root = "/data/case_{}"
+            c = root.f(3, cow=True)
+            expected = root.f(3)
+            self.assertEqual(self.lookups(c), self.lookups(expected))
+            self.assertNotIn("files", c.__dict__)  # looked up in the source
+            self.assertEqual(c.to_dict(), expected.to_dict())
+            self.assertIs(c.dirs[0].parent, c)
+
+            # Sub trees and copies of copies
+            for node in nodes[1:20]:
+                self.check_same(node.copy(cow=True), node.copy())
+                self.check_same(
+                    node.copy(cow=True).copy(root="/x", cow=True), node.copy(root="/x")
+                )
+
+    def test_source_changes(self):
+        for seed in range(5):
+            root, nodes = random_tree(seed)
+            copies = [(root.copy(cow=True), root.copy())]
+            copies += [(n.copy(cow=True), n.copy()) for n in nodes[1:10]]
+            _ = copies[0][0].dirs[0].n3, copies[1][0].n5  # partly materialized
+            rng = random.Random(seed)
+            for _ in range(30):
+                node = rng.choice(nodes)
+                r = rng.random()
+                if r < 0.4:
+                    nodes.append(node.dir(rng.choice(self.names)))
+                elif r < 0.8:
+                    node.file(**{rng.choice(self.names): "changed.vtk"})
+                elif node.parent is not None:
+                    node.root = rng.choice(self.names)
+            for c, expected in copies:
+                self.check_same(c, expected)
+
+    def test_copy_changes(self):
+        for seed in range(5):
+            root, nodes = random_tree(seed)
+            before = root.copy()
+            c, expected = root.copy(cow=True), root.copy()
+            rng = random.Random(seed)
+            for _ in range(20):
+                att = rng.choice(self.names)
+                x, y = getattr(c, att, None), getattr(expected, att, None)
+                if isinstance(x, tf.Tree):
+                    x.file(new="new.vtk")
+                    y.file(new="new.vtk")
+                    if x.parent is not None and rng.random() < 0.3:
+                        x.root = y.root = f"{att}_renamed"
+                self.check_same(c, expected)
+            self.check_same(root, before)
+
+    def test_reads(self):
+        root, nodes = random_tree(0)
+        for node in nodes:
+            node.file(**{al: "set.txt" for al, f in node.files.items() if f is None})
+        root.root = "/data/case_{}"
+        c, expected = root.f(3, cow=True), root.f(3)
+        self.assertEqual(c.get_files(), expected.get_files())
+        self.assertEqual(c.get_file_keys(), expected.get_file_keys())
+        self.assertEqual(c.pprint(), expected.pprint())
+        self.assertEqual(repr(c), repr(expected))
+        self.assertEqual(tf.tree_fs.dir_levels(c), tf.tree_fs.dir_levels(expected))
+        self.assertNotIn("files", c.__dict__)  # nothing copied
+
+    def test_deep_copy_changed(self):
+        c = deep_tree(5000).copy(cow=True)
+        node = c
+        for _ in range(5000):
+            node = node._clone_of(node._cow_data().dirs[0])
+        node.file("y.txt")  # copies every level
+        self.assertEqual(c.y, node.path("y.txt"))
+
+
+class TestPickle(unittest.TestCase):
+    def test_round_trip(self):
+        for seed in range(5):
+            root, nodes = random_tree(seed)
+            for node in [root] + nodes[1:10]:
+                x = pickle.loads(pickle.dumps(node))
+                self.assertEqual(x.abs(), node.abs())
+                self.assertIsNone(x.parent)
+                self.assertEqual(x.to_dict()["dirs"], node.to_dict()["dirs"])
+                self.assertEqual(x.to_dict()["ndirs"], node.to_dict()["ndirs"])
+                self.assertEqual(x.files, node.files)
+                for att in [f"n{i}" for i in range(15)]:
+                    expected = getattr(node.copy(root=node.abs()), att, None)
+                    got = getattr(x, att, None)
+                    if isinstance(expected, tf.Tree):
+                        self.assertEqual(got.abs(), expected.abs())
+                    else:
+                        self.assertEqual(got, expected)
+
+    def test_deep_and_cow(self):
+        t = deep_tree(5000)
+        self.assertGreater(5000, sys.getrecursionlimit())
+        expected = t.f4999
+        for x in (t, t.copy(root="/other", cow=True)):
+            y = pickle.loads(pickle.dumps(x, protocol=5))
+            self.assertEqual(y.f4999, x.abs() + expected[len(t.abs()) :])
+        self.assertNotIn("files", x.__dict__)  # not materialized
+
+    def test_previous_format(self):
+        x = tf.Tree.__new__(tf.Tree)
+        x.__setstate__({"_name": "/data/old"})
+        self.assertEqual(x.abs(), "/data/old")
+        self.assertEqual(x.dir("a").abs(), "/data/old/a")
+
+
+class TestStrRe(unittest.TestCase):
+    def test_re_many(self):
+        paths = [
+            "/res/frame_12.vtk",
+            "/res/mesh.vtk",
+            "frame_3",
+            "/res/case_2/frame_007/out.txt",
+        ]
+        res = tf.Str.re_many(paths, "frame")
+        self.assertEqual(len(res), 4)
+        self.assertEqual(res.found.tolist(), [True, False, True, True])
+        self.assertEqual(res.idx.tolist(), [12, -1, 3, 7])
+        self.assertEqual(res.preffix.tolist(), ["/res/", None, None, "/res/case_2/"])
+        self.assertEqual(res.suffix.tolist(), [".vtk", None, None, "/out.txt"])
+        for i, x in enumerate(paths):
+            self.assertEqual(res[i], tf.Str(x).re("frame"))
+        self.assertEqual(res[3] / "a", tf.Str("/res/case_2/frame_007/out.txt/a"))
+        self.assertEqual(len(tf.Str.re_many([], "frame")), 0)
+        # Paths holding new lines are matched one by one
+        paths = ["a\nframe_1", "frame_2", ""]
+        res = tf.Str.re_many(paths, "frame")
+        for i, x in enumerate(paths):
+            self.assertEqual(res[i], tf.Str(x).re("frame"))
+
+
+def recursive_files(tree):
+    """Reference implementation: recursive `Tree.get_files`"""
+    res = [tree.path(x) for x in tree.files.values() if x is not None]
+    for d in tree.dirs + list(tree.ndirs.values()):
+        res.extend(recursive_files(d))
+    return res
+
+
+def recursive_dict(tree):
+    """Reference implementation: recursive `Tree.to_dict`"""
+    return dict(
+        name=tree.root,
+        dirs=[recursive_dict(x) for x in tree.dirs],
+        ndirs={al: recursive_dict(x) for al, x in tree.ndirs.items()},
+        files=dict(tree.files),
+    )
+
+
+class TestWalk(unittest.TestCase):
+    def test_orders(self):
+        t = tf.Tree("/data")
+        t.file(a="a.txt")
+        t.dir("x").file(b="b.txt")
+        t.dir(n="y")
+        rel = lambda order, **kw: [
+            (e.path[len("/data") :], e.alias, e.depth)
+            for e in t.walk(order=order, **kw)
+        ]
+        self.assertEqual(
+            rel("pre"),
+            [
+                ("", None, 0),
+                ("/a.txt", "a", 0),
+                ("/x", None, 1),
+                ("/x/b.txt", "b", 1),
+                ("/y", "n", 1),
+            ],
+        )
+        self.assertEqual(
+            rel("post"),
+            [
+                ("/x/b.txt", "b", 1),
+                ("/x", None, 1),
+                ("/y", "n", 1),
+                ("/a.txt", "a", 0),
+                ("", None, 0),
+            ],
+        )
+        self.assertEqual(len(rel("post", include_files=False)), 3)
+        with self.assertRaises(ValueError):
+            next(t.walk(order="bfs"))
+
+    def test_same_as_recursive(self):
+        for seed in range(5):
+            root, nodes = random_tree(seed)
+            for node in [root] + nodes[1:10]:
+                self.assertEqual(node.get_files(), recursive_files(node))
+                self.assertEqual(
+                    node.get_file_keys(),
+                    [e.alias for e in node.walk() if e.is_file],
+                )
+                self.assertEqual(node.to_dict(), recursive_dict(node))
+                d = tf.Tree.from_dict(node.to_dict()).to_dict()
+                self.assertEqual(d, recursive_dict(node))
+                self.assertEqual(node.copy().to_dict(), recursive_dict(node))
+
+    def test_deep(self):
+        t = deep_tree(5000)
+        self.assertGreater(5000, sys.getrecursionlimit())
+        expected = t.f4999
+        self.assertEqual(t.get_files()[-1], expected)
+        self.assertEqual(t.get_file_keys()[-1], "f4999")
+        self.assertEqual(tf.Tree.from_dict(t.to_dict()).f4999, expected)
+        self.assertEqual(t.copy().f4999, expected)
+        self.assertEqual(next(t.walk(order="post")).path, expected)
+
+    def test_remove_empty(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            t = tf.Tree(tmp)
+            t.dir("a").dir("b").dir("c")
+            t.dir(n="named").dir("d")
+            t.dir("full").file(x="x.txt")
+            t.dump()
+            open(t.x, "w").close()
+            t.remove_empty()
+            self.assertEqual(os.listdir(tmp), ["full"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,312 @@
+import os
+import random
+import re
+import unittest
+
+import treefiles as tf
+from treefiles.tree_format import (
+    Line,
+    parse_lines,
+    set_parents,
+    get_lines,
+    split_lin,
+    IncludeCache,
+    IncludeCycleError,
+    compiled_fname,
+    load_compiled,
+)
+
+
+def legacy_parse_lines(lines, dirname=None):
+    """Reference implementation: previous parser, quadratic in the line count"""
+    _lines = []
+
+    def is_in(*x):
+        for i in x[:-1]:
+            if i in x[-1]:
+                return True
+        return False
+
+    for x in lines:
+        y = Line(len(x) - len(x.lstrip()))
+        x = x.strip()
+
+        if is_in("#", x):
+            s = x.split("#")
+            x = s[0]
+            if len(s) > 1:
+                y.comment = " ".join(s[1:]).strip()
+
+        while is_in("${", x):
+            m = re.search(r"\${(\w+)}", x)
+            d = f"{m.group(1)!r}NotFound"
+            x = x[: m.span()[0]] + os.environ.get(m.group(1), d) + x[m.span()[1] :]
+
+        if is_in(".", "-", ":", "<", x):
+            key, x = x[0], x[1:]
+            if key == ".":
+                y.entry_type = "dir"
+                y.name, y.value = split_lin(x)
+            elif key == "-":
+                y.entry_type = "file"
+                y.name, y.value = split_lin(x)
+            elif key == "<":
+                name, value = split_lin(x)
+                import_lines, _ = get_lines(value, dirname=dirname)
+                new_branch = legacy_parse_lines(import_lines)
+                for x in new_branch:
+                    x.indent += y.indent
+                if name:
+                    new_branch[0].value = name
+                _lines.extend(new_branch)
+
+        if y.entry_type:
+            _lines.append(y)
+
+    return _lines
+
+
+def legacy_set_parents(lines):
+    indents = [x.indent for x in lines]
+    assert indents[0] == 0
+    if len(indents) == 1:
+        return
+    di = indents[1]
+
+    for i, x in enumerate(lines):
+        assert x.indent % di == 0
+        k = 0
+        for j, y in enumerate(lines[i::-1]):
+            if x.indent == y.indent + di:
+                k = i - j
+                break
+        x.parent_line = k
+
+
+def legacy_pprint(tree, i=2, oie=False):
+    """Reference implementation: previous recursive `Tree.pprint`"""
+    s = ". " if i == 2 else ""
+    if i > 2 and oie and not os.path.isdir(tree.abs()):
+        return None
+    s += f"{tree.root}\n"
+    for d in tree.dirs:
+        if not oie or os.path.isdir(d.abs()):
+            s += f"{' '*i}. {legacy_pprint(d, i + 2, oie)}\n"
+    for al, d in tree.ndirs.items():
+        if not oie or os.path.isdir(d.abs()):
+            s += f"{' '*i}. {al}: {legacy_pprint(d, i + 2, oie)}\n"
+    for al, f in tree.files.items():
+        if not oie or os.path.isfile(tree.path(f)):
+            s += f"{' '*i}- {al}: {f}\n"
+    return s.strip()
+
+
+def random_manifest(seed, n=300, include=None):
+    """Lines of a `.tree` file using every feature of the format"""
+    rng = random.Random(seed)
+    lines, depth = [". /data/root # manifest root\n"], 0
+    for _ in range(n):
+        depth = rng.randint(1, depth + 1)
+        pad = " " * (2 * depth)
+        name = rng.choice(["a", "b_${TF_TEST_VAR}", "${TF_TEST_MISSING}", "'q'"])
+        r = rng.random()
+        if r < 0.3:
+            lines.append(f"{pad}. {name}\n")
+        elif r < 0.4:
+            lines.append(f'{pad}.al_{rng.randint(0, 9)} : "{name}"  # named #dir\n')
+        elif r < 0.8:
+            lines.append(f"{pad}- f{rng.randint(0, 50)}: {name}.vtk\n")
+            depth -= 1  # nothing below a file
+        elif r < 0.85 and include:
+            lines.append(f"{pad}< {include}\n")
+            depth -= 1
+        elif r < 0.9:
+            lines.append(f"{pad}# comment: - not an entry\n")
+        elif r < 0.95:
+            lines.append(rng.choice(["\n", "   \n", f"{pad}plain text.\n"]))
+        else:
+            lines.append(f"{pad}- x:y:z\n")  # neither name nor value
+        depth = max(depth, 0)
+    return lines
+
+
+class TestFormat(unittest.TestCase):
+    def setUp(self):
+        os.environ["TF_TEST_VAR"] = "v${TF_TEST_INNER}"
+        os.environ["TF_TEST_INNER"] = "1"
+
+    def check(self, lines, dirname=None):
+        expected = legacy_parse_lines(lines, dirname=dirname)
+        legacy_set_parents(expected)
+        got = parse_lines(lines, dirname=dirname)
+        set_parents(got)
+        self.assertEqual(got, expected)
+
+    def test_conformance(self):
+        for seed in range(20):
+            self.check(random_manifest(seed))
+
+    def test_includes(self):
+        with tf.TmpDir() as tmp:
+            with open(tmp.path("sub.tree"), "w") as f:
+                f.writelines(random_manifest(100, n=20))
+            for seed in range(5):
+                self.check(random_manifest(seed, include="sub"), dirname=tmp.abs())
+                self.check(random_manifest(seed, include="n: sub"), dirname=tmp.abs())
+
+    def test_irregular_indents(self):
+        # The parent is the last line indented one level less, even across
+        # less indented lines
+        lines = [". r", "  . a", "    . b", "  . c", "      - f: f.txt", "        . d"]
+        self.check(lines)
+        got = parse_lines(lines)
+        set_parents(got)
+        self.assertEqual([x.parent_line for x in got], [0, 0, 1, 0, 2, 4])
+
+    def test_from_str(self):
+        t = tf.Tree.from_str(". /data\n  . a\n    - m: m.vtk\n  . al: b\n    - n.txt")
+        self.assertEqual(t.m, "/data/a/m.vtk")
+        self.assertEqual(t.al.abs(), "/data/b")
+        self.assertEqual(t.n, "/data/b/n.txt")
+
+
+def write(fname, text):
+    with open(fname, "w") as f:
+        f.write(text)
+
+
+class TestSerialize(unittest.TestCase):
+    def random_disk_tree(self, root, seed):
+        rng = random.Random(seed)
+        t = tf.Tree(root)
+        nodes = [t]
+        for _ in range(150):
+            node, r = rng.choice(nodes), rng.random()
+            name = rng.choice(["a", "b", "c", "d/e", "..", "."])
+            if r < 0.3:
+                nodes.append(node.dir(name))
+            elif r < 0.4:
+                nodes.append(node.dir(**{f"al{rng.randint(0, 9)}": name}))
+            else:
+                node.file(**{f"f{rng.randint(0, 9)}": f"{name}.{rng.randint(0, 2)}"})
+        # Create part of it
+        for node in nodes:
+            if rng.random() < 0.6:
+                os.makedirs(node.abs(), exist_ok=True)
+                for f in node.get_files():
+                    if rng.random() < 0.5 and os.path.isdir(os.path.dirname(f)):
+                        if not os.path.isdir(f):
+                            tf.dump_str(f, "")
+        return t
+
+    def test_pprint(self):
+        with tf.TmpDir() as tmp:
+            for seed in range(10):
+                t = self.random_disk_tree(tmp.path(f"t{seed}"), seed)
+                for oie in (False, True):
+                    expected = legacy_pprint(t, oie=oie)
+                    self.assertEqual(t.pprint(oie=oie), expected)
+                    self.assertEqual("\n".join(t.iter_lines(oie=oie)), expected)
+
+    def test_to_file(self):
+        with tf.TmpDir() as tmp:
+            t = self.random_disk_tree(tmp.path("t"), 0)
+            t.to_file(tmp.path("t.tree"), comment="header\nsecond line", oie=True)
+            with open(tmp.path("t.tree")) as f:
+                text = f.read()
+            expected = legacy_pprint(t, oie=True)
+            self.assertEqual(text, f"# header\n# second line\n{expected}")
+            self.assertEqual(tf.Tree.from_file(tmp.path("t.tree")).pprint(), expected)
+
+
+class TestIncludeCache(unittest.TestCase):
+    def test_reuse(self):
+        with tf.TmpDir() as tmp:
+            os.mkdir(tmp.path("sub"))
+            write(tmp.path("sub/frames.tree"), ". frames\n  - fr: f_${TF_TEST_N}.vtk\n")
+            write(tmp.path("sub/patient.tree"), ". p\n  - m: mesh.vtk\n  < frames\n")
+            cases = "".join(
+                f"  . case_{i}\n    < p_{i}: sub/patient\n" for i in range(5)
+            )
+            write(tmp.path("main.tree"), f". /data\n{cases}")
+
+            os.environ["TF_TEST_N"] = "1"
+            cache = IncludeCache()
+            t = tf.Tree.from_file(tmp.path("main.tree"), include_cache=cache)
+            self.assertEqual((cache.parsed, cache.reused), (2, 4))
+            self.assertEqual(t.case_3.p_3.frames.fr, "/data/case_3/p_3/frames/f_1.vtk")
+            self.assertEqual(t.case_3.p_3.m, "/data/case_3/p_3/mesh.vtk")
+
+            # Across loads, until an include or a variable changes
+            tf.Tree.from_file(tmp.path("main.tree"), include_cache=cache)
+            self.assertEqual((cache.parsed, cache.reused), (2, 9))
+            t = tf.Tree.from_file(
+                tmp.path("main.tree"), include_cache=cache, TF_TEST_N=2
+            )
+            self.assertEqual((cache.parsed, cache.reused), (4, 13))
+            self.assertEqual(t.case_0.fr, "/data/case_0/p_0/frames/f_2.vtk")
+
+            write(tmp.path("sub/frames.tree"), ". frames\n  - g: g.vtk\n")
+            os.utime(tmp.path("sub/frames.tree"), ns=(0, 0))
+            t = tf.Tree.from_file(tmp.path("main.tree"), include_cache=cache)
+            self.assertEqual(cache.parsed, 6)
+            self.assertEqual(t.case_0.g, "/data/case_0/p_0/frames/g.vtk")
+
+    def test_cycle(self):
+        with tf.TmpDir() as tmp:
+            write(tmp.path("a.tree"), ". a\n  < b\n")
+            write(tmp.path("b.tree"), ". b\n  < a\n")
+            write(tmp.path("c.tree"), ". c\n  < c\n")
+            with self.assertRaises(IncludeCycleError):
+                tf.Tree.from_file(tmp.path("a.tree"))
+            with self.assertRaisesRegex(RuntimeError, "c.tree -> .*c.tree"):
+                tf.Tree.from_file(tmp.path("c.tree"))
+
+
+class TestCompiled(unittest.TestCase):
+    def test_invalidation(self):
+        with tf.TmpDir() as tmp:
+            write(tmp.path("sub.tree"), ". sub\n  - m: ${TF_TEST_MESH}.vtk\n")
+            write(tmp.path("main.tree"), ". /data\n  . a\n    < sub\n  - r: r.txt\n")
+            fname = tmp.path("main.tree")
+            load = lambda **kw: tf.Tree.from_file(fname, compiled=True, **kw)
+
+            t = load(TF_TEST_MESH="heart")
+            self.assertTrue(os.path.isfile(f"{fname}c"))
+            expected = tf.Tree.from_file(fname).to_dict()
+            self.assertEqual(t.to_dict(), expected)
+            self.assertEqual(t.m, "/data/a/sub/heart.vtk")
+
+            # Loaded without parsing
+            cache = IncludeCache()
+            self.assertEqual(load(include_cache=cache).to_dict(), expected)
+            self.assertEqual(cache.parsed, 0)
+
+            # Variable changed
+            os.environ["TF_TEST_MESH"] = "lung"
+            self.assertIsNone(load_compiled(fname, True))
+            self.assertEqual(load().m, "/data/a/sub/lung.vtk")
+            self.assertIsNotNone(load_compiled(fname, True))
+
+            # Included file changed
+            write(tmp.path("sub.tree"), ". sub\n  - n: n.vtk\n")
+            self.assertIsNone(load_compiled(fname, True))
+            self.assertEqual(load().n, "/data/a/sub/n.vtk")
+
+    def test_cache_dir(self):
+        with tf.TmpDir() as tmp:
+            write(tmp.path("main.tree"), ". root\n  - r: r.txt\n")
+            fname, cache_dir = tmp.path("main.tree"), tmp.path("cache")
+            t = tf.Tree.from_file(fname, compiled=cache_dir)
+            self.assertEqual(t.r, tmp.path("root/r.txt"))
+            self.assertTrue(os.path.isfile(compiled_fname(fname, cache_dir)))
+            self.assertFalse(os.path.exists(f"{fname}c"))
+
+            with open(compiled_fname(fname, cache_dir), "wb") as f:
+                f.write(b"corrupted")
+            t = tf.Tree.from_file(fname, compiled=cache_dir)
+            self.assertEqual(t.r, tmp.path("root/r.txt"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,850 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+import unittest
+
+import treefiles as tf
+from treefiles import tree_fs, tree_watch
+
+
+def sample_tree(root):
+    t = tf.Tree(root)
+    for i in range(3):
+        case = t.dir(f"case_{i}")
+        case.dir("mesh", "results").dir("frames")
+        case.dir(out="results")  # same directory under an alias
+    return t
+
+
+def register_files(args):
+    """Pool worker registering files in a container, given or opened"""
+    ct, k, n = args
+    if isinstance(ct, str):
+        ct = tf.Container(ct)
+    for i in range(k * n, (k + 1) * n):
+        ct / f"w_{k}/f_{i}.txt"
+    ct.save()
+    return ct._journal.is_shard
+
+
+def open_register(args):
+    """Pool worker opening a container and registering a file, then saving it
+    once called again"""
+    global _opened
+    path, x = args
+    if x is None:
+        _opened.save()
+        return _opened._journal.shards()
+    _opened = tf.Container(path)
+    _opened / x
+    return _opened._journal.is_shard
+
+
+class TestDump(unittest.TestCase):
+    def test_dump(self):
+        for workers in (None, 4):
+            with tf.TmpDir() as tmp:
+                t = sample_tree(tmp.path("exp"))
+                report = tree_fs.dump(t, workers=workers)
+                self.assertEqual(report.dirs, 1 + 3 * 4)
+                self.assertEqual(report.created, report.dirs)
+                for i in range(3):
+                    self.assertTrue(os.path.isdir(t.path(f"case_{i}/results/frames")))
+                self.assertEqual(tree_fs.dump(t, workers=workers).created, 0)
+
+    def test_clean(self):
+        for workers in (None, 4):
+            with tf.TmpDir() as tmp:
+                t = sample_tree(tmp.path("exp")).dump()
+                tf.dump_str(t.path("case_0/results/frames/f.txt"), "data")
+                os.makedirs(t.path("old/older"))
+                os.symlink(t.path("case_1"), t.path("link"))
+
+                report = tree_fs.dump(t, clean=True, workers=workers)
+                self.assertEqual(report.removed_files, 2)
+                self.assertEqual(report.removed_dirs, 1 + 3 * 4 + 2)
+                self.assertEqual(report.created, report.dirs)
+                self.assertEqual(
+                    sorted(os.listdir(t.abs())), [f"case_{i}" for i in range(3)]
+                )
+
+    def test_existing_file(self):
+        with tf.TmpDir() as tmp:
+            t = tf.Tree(tmp.path("exp"))
+            t.dir("a")
+            tf.dump_str(tmp.path("exp"), "")
+            with self.assertRaises(FileExistsError):
+                t.dump()
+
+
+class TestExpand(unittest.TestCase):
+    def test_views(self):
+        with tf.TmpDir() as tmp:
+            t = sample_tree(tmp.path("exp_{:03d}"))
+            t.case_0.file(mesh="mesh.vtk").dir("logs").file("run.log")
+            views = t.expand(range(5, 10))
+            expected = [t.f(i) for i in range(5, 10)]
+            self.assertEqual(len(views), 5)
+            self.assertEqual([x.abs() for x in views], [x.abs() for x in expected])
+            self.assertEqual(views[2].run, expected[2].run)
+            self.assertEqual(
+                views.get_files(), sum([x.get_files() for x in expected], [])
+            )
+            self.assertEqual(views.alias("mesh"), [x.mesh for x in expected])
+            self.assertEqual(views.alias("logs"), [x.logs.abs() for x in expected])
+            self.assertEqual(views.path("a", "b"), [x.path("a", "b") for x in expected])
+            self.assertEqual(views[1:3].roots, [x.abs() for x in expected[1:3]])
+
+            for workers in (None, 4):
+                report = views.dump(clean=True, workers=workers)
+                self.assertEqual(report.dirs, 5 * (1 + 3 * 4 + 1))
+                self.assertEqual(report.created, report.dirs)
+                for x in expected:
+                    self.assertTrue(os.path.isdir(x.logs.abs()))
+                    self.assertTrue(os.path.isdir(x.case_2.frames.abs()))
+            tf.dump_str(views.alias("run")[0], "log")
+            self.assertEqual(views.dump(clean=True).removed_files, 1)
+
+    def test_indices(self):
+        t = tf.Tree("/data/{name}_{i}")
+        views = t.f_many([dict(name="a", i=1), dict(name="b", i=2)])
+        self.assertEqual(views.roots, ["/data/a_1", "/data/b_2"])
+        self.assertEqual(tf.Tree("/d/{}_{}").expand([(1, 2)]).roots, ["/d/1_2"])
+
+    def test_filesystem_root(self):
+        t = tf.Tree("/")
+        t.file("a.txt").dir("b").file("c.txt")
+        views = t.expand(range(2))
+        self.assertEqual(views.get_files(), t.get_files() * 2)
+        self.assertEqual(views.alias("c"), ["/b/c.txt"] * 2)
+
+
+class TestScan(unittest.TestCase):
+    def make_files(self, root):
+        t = tf.Tree(root)
+        t.dir("a").file("x.vtk", "y.txt").dir("b").file("frame_2.vtk", "frame_10.vtk")
+        t.dir("c")
+        t.file("top.json")
+        t.dump()
+        for f in t.get_files():
+            tf.dump_str(f, "")
+        return t
+
+    def test_scan(self):
+        with tf.TmpDir() as tmp:
+            t = self.make_files(tmp.path("data"))
+            for workers in (None, 4):
+                s = tf.Tree.scan(t.abs(), workers=workers)
+                self.assertEqual(s.to_dict(), t.to_dict())
+                self.assertEqual(s.frame_10, t.path("a/b/frame_10.vtk"))
+
+            s = tf.Tree.scan(t.abs(), pattern="*.vtk")
+            self.assertEqual(s.get_file_keys(), ["x", "frame_2", "frame_10"])
+            s = tf.Tree.scan(t.abs(), max_depth=1)
+            self.assertEqual(s.a.files, {"x": "x.vtk", "y": "y.txt"})
+            self.assertEqual(s.a.dirs[0].root, "b")
+            self.assertEqual(s.a.dirs[0].files, {})
+
+    def test_symlinks(self):
+        with tf.TmpDir() as tmp:
+            t = self.make_files(tmp.path("data"))
+            os.symlink(t.path("a"), t.path("c/link"))
+            os.symlink(t.abs(), t.path("a/b/loop"))
+
+            s = tf.Tree.scan(t.abs())
+            self.assertEqual(s.link.abs(), t.path("c/link"))
+            self.assertEqual(s.link.dirs, [])
+
+            s = tf.Tree.scan(t.abs(), follow_symlinks=True)
+            self.assertEqual(s.c.link.b.abs(), t.path("c/link/b"))
+            self.assertEqual(s.c.link.b.frame_2, t.path("c/link/b/frame_2.vtk"))
+            self.assertEqual(s.a.b.loop.dirs, [])
+
+    def test_iglob(self):
+        with tf.TmpDir() as tmp:
+            t = self.make_files(tmp.path("data"))
+            t.dir("a2").file("frame_1.vtk").dump()
+            tf.dump_str(t.frame_1, "")
+            it = t.iter_files()
+            self.assertEqual(next(it), t.path("top.json"))
+            self.assertEqual([next(it)] + list(it), t.get_files()[1:])
+
+            for pattern in ("*/*.vtk", "a*/*/frame_*.vtk", "a/b/frame_2.vtk", "z*"):
+                expected = sorted(t.glob(pattern))
+                self.assertEqual(sorted(t.iglob(pattern, sort=True)), expected)
+                self.assertEqual(sorted(t.iglob(pattern)), expected)
+            # Sorted directory by directory
+            self.assertEqual(
+                list(t.iglob("*/*.vtk", sort=True)),
+                [t.path("a/x.vtk"), t.path("a2/frame_1.vtk")],
+            )
+            self.assertEqual(
+                list(tf.Str(t.abs()).iglob("*/b/*", sort=True)),
+                [t.path("a/b/frame_2.vtk"), t.path("a/b/frame_10.vtk")],
+            )
+
+
+class TestPrune(unittest.TestCase):
+    def test_prune(self):
+        for workers in (None, 4):
+            with tf.TmpDir() as tmp:
+                t = sample_tree(tmp.path("exp"))
+                t.case_0.mesh.file(m="mesh.vtk", n="other.vtk")
+                t.case_1.dir("frames").file(f="f.vtk")
+                t.case_1.file(sub="mesh/m.vtk", up="../up.txt")
+                t.case_0.mesh.dump()
+                t.case_1.mesh.dump()
+                os.symlink(t.case_0.mesh.abs(), t.case_1.path("frames"))
+                for x in (t.case_0.m, t.case_1.path("mesh/m.vtk"), t.path("up.txt")):
+                    tf.dump_str(x, "")
+
+                expected = tf.Tree.from_str(t.pprint(oie=True))
+                t.case_0.mesh.file(none=None)
+                p = t.prune(workers=workers)
+                self.assertIsNot(p, t)
+                self.assertEqual(p.pprint(), expected.pprint())
+                self.assertEqual(p.case_0.m, t.case_0.m)
+                self.assertEqual(p.case_1.frames.abs(), t.case_1.frames.abs())
+                self.assertEqual(p.get_file_keys(), ["m", "sub", "up"])
+                self.assertEqual(len(t.case_0.mesh.files), 3)  # source unchanged
+
+
+class TestFrames(unittest.TestCase):
+    def test_queries(self):
+        with tf.TmpDir() as tmp:
+            t = tf.Tree(tmp.path("res")).dump()
+            numbers = [1, 2, 5, 10, 11, 40, 40]
+            for i, k in enumerate(numbers):
+                tf.dump_str(t.path(f"frame_{k:0{i % 3 + 1}d}.vtk"), "")
+            tf.dump_str(t.path("frame_3.txt"), "")
+            tf.dump_str(t.path("mesh.vtk"), "")
+
+            idx = t.frame_index(pattern="*.vtk")
+            self.assertEqual(list(idx), t.glob("frame_*.vtk"))
+            self.assertEqual(idx.indices.tolist(), numbers)
+            self.assertEqual(idx[1:3], t.glob("frame_*.vtk")[1:3])
+            name = lambda x: os.path.basename(x)
+            self.assertEqual(
+                [name(x) for x in idx.range(2, 11)],
+                ["frame_02.vtk", "frame_005.vtk", "frame_10.vtk"],
+            )
+            self.assertEqual(len(idx.range(12)), 2)
+            self.assertEqual(
+                [name(x) for x in idx.last(2)], ["frame_040.vtk", "frame_40.vtk"]
+            )
+            self.assertEqual(idx.find(10), t.path("frame_10.vtk"))
+            self.assertIsNone(idx.find(3))
+            self.assertEqual(name(idx.nearest(3)), "frame_02.vtk")  # lowest on a tie
+            self.assertEqual(name(idx.nearest(4)), "frame_005.vtk")
+            self.assertEqual(name(idx.nearest(100)), "frame_040.vtk")
+            self.assertEqual(name(idx.nearest(-5)), "frame_1.vtk")
+            self.assertEqual(len(t.frame_index()), 8)
+            self.assertIsNone(t.frame_index("mesh").nearest(0))
+
+    def test_cache(self):
+        with tf.TmpDir() as tmp:
+            t = tf.Tree(tmp.path("res")).dump()
+            tf.dump_str(t.path("frame_1.vtk"), "")
+            old = time.time_ns() - 10 * 10**9
+            os.utime(t.abs(), ns=(old, old))
+            idx = t.frame_index()
+            self.assertIs(tf.Str(t.abs()).frame_index(), idx)
+
+            tf.dump_str(t.path("frame_2.vtk"), "")  # changes the directory mtime
+            new = t.frame_index()
+            self.assertIsNot(new, idx)
+            self.assertEqual(len(new), 2)
+            self.assertIsNot(t.frame_index(), new)  # not trusted just after a change
+            self.assertEqual(len(idx), 1)
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_refresh(self):
+        with tf.TmpDir() as tmp:
+            root = tmp.dir("data").dump()
+            tf.dump_str(root.path("a.txt"), "a")
+            os.makedirs(root.path("sub"))
+            tf.dump_str(root.path("sub/b.txt"), "b")
+
+            t = tf.Tree.scan(root.abs())
+            snap = t.snapshot()
+            self.assertEqual(len(snap.files), 2)
+            self.assertFalse(t.diff_since(snap))
+
+            tf.dump_str(root.path("sub/b.txt"), "bb")
+            tf.dump_str(root.path("c.txt"), "c")
+            os.remove(root.path("a.txt"))
+            os.makedirs(root.path("late/deeper"))
+            tf.dump_str(root.path("late/deeper/d.txt"), "d")
+
+            diff = t.diff_since(snap)
+            self.assertEqual(
+                diff.added, [root.path("c.txt"), root.path("late/deeper/d.txt")]
+            )
+            self.assertEqual(diff.removed, [root.path("a.txt")])
+            self.assertEqual(diff.modified, [root.path("sub/b.txt")])
+            with self.assertRaises(AttributeError):
+                t.d  # diff_since leaves the tree untouched
+
+            self.assertEqual(t.refresh(), diff)
+            scanned = tf.Tree.scan(root.abs())
+            self.assertEqual(sorted(t.get_files()), sorted(scanned.get_files()))
+            self.assertEqual(t.d, root.path("late/deeper/d.txt"))
+            self.assertFalse(t.refresh())
+
+            os.remove(root.path("late/deeper/d.txt"))
+            os.rmdir(root.path("late/deeper"))
+            self.assertEqual(t.refresh().removed, [root.path("late/deeper/d.txt")])
+            self.assertEqual(t.late.dirs, [])
+
+    def test_unchanged_dirs(self):
+        with tf.TmpDir() as tmp:
+            root = tmp.dir("data").dump()
+            tf.dump_str(root.path("a.txt"), "a")
+            t = tf.Tree.scan(root.abs())
+            snap = t.snapshot()
+            # Not racy anymore, the directory is not listed again
+            snap.time_ns += 10 * 10**9
+            listed = []
+            listdir = os.scandir
+            os.scandir = lambda x: listed.append(x) or listdir(x)
+            try:
+                tf.dump_str(root.path("a.txt"), "modified")
+                diff = t.diff_since(snap)
+            finally:
+                os.scandir = listdir
+            self.assertEqual(listed, [])
+            self.assertEqual(diff.modified, [root.path("a.txt")])
+
+    def test_dangling_symlink(self):
+        with tf.TmpDir() as tmp:
+            root = tmp.dir("data").dump()
+            tf.dump_str(root.path("a.txt"), "a")
+            os.symlink(root.path("missing.txt"), root.path("link.txt"))
+            t = tf.Tree.scan(root.abs())
+            snap = t.snapshot()
+            self.assertIn(root.abs(), snap.dirs)
+            tf.dump_str(root.path("b.txt"), "b")
+            diff = t.diff_since(snap)
+            self.assertEqual(diff.added, [root.path("b.txt")])
+            self.assertEqual(diff.removed, [])
+
+    def test_container(self):
+        with tf.TmpDir() as tmp:
+            with tf.Container(tmp.path("ct")) as ct:
+                tf.dump_str(ct / "res/a.txt", "a")
+                ct.snapshot()
+            tf.dump_str(tmp.path("ct/res/b.txt"), "b")
+            tf.dump_str(tmp.path("ct/infos.journal.12345"), "")  # shard of a worker
+
+            ct = tf.Container(tmp.path("ct"))
+            self.assertEqual(ct.refresh().added, [ct.path("res/b.txt")])
+            self.assertEqual(ct.b, ct.path("res/b.txt"))
+
+    def test_container_first_refresh(self):
+        with tf.TmpDir() as tmp:
+            with tf.Container(tmp.path("ct")) as ct:
+                ct / "res/a.txt"
+            ct = tf.Container(tmp.path("ct"))
+            self.assertFalse(ct.refresh())  # no snapshot yet
+            ct.save()
+            self.assertFalse(ct.refresh())
+            self.assertEqual(ct.get_file_keys(), ["a"])
+
+
+class TestJournal(unittest.TestCase):
+    def test_replay(self):
+        with tf.TmpDir() as tmp:
+            ct = tf.Container(tmp.path("ct"))
+            ct / "res/a.txt"
+            ct.res / "b.txt"
+            ct / "c.txt"
+            ct / "c.txt"  # already registered
+            ct._journal.flush()
+            del ct  # crash, not saved
+
+            self.assertFalse(os.path.exists(tmp.path("ct/infos.tree")))
+            with open(tmp.path("ct/infos.journal"), "a") as f:
+                f.write('f "torn')
+            ct = tf.Container(tmp.path("ct"))
+            self.assertEqual(ct.a, ct.path("res/a.txt"))
+            self.assertEqual(ct.b, ct.path("res/b.txt"))
+            self.assertEqual(ct._journal.count, 3)
+            ct / "d/e.txt"
+            ct._journal.flush()
+
+            ct = tf.Container(tmp.path("ct"))
+            self.assertEqual(ct.e, ct.path("d/e.txt"))
+            self.assertEqual(sorted(ct.get_file_keys()), ["a", "b", "c", "e"])
+
+    def test_short_writes(self):
+        class ShortWrites:
+            def __init__(self, f):
+                self.f = f
+
+            def write(self, data):
+                return self.f.write(bytes(data[:5]))
+
+            def __getattr__(self, name):
+                return getattr(self.f, name)
+
+        with tf.TmpDir() as tmp:
+            ct = tf.Container(tmp.path("ct"))
+            journal = ct._journal
+            journal._f = ShortWrites(journal._open())
+            ct.register_many(["res/a.txt", "res/b.txt"])
+            ct / "c.txt"
+            journal.flush()
+
+            ct = tf.Container(tmp.path("ct"))
+            self.assertEqual(sorted(ct.get_file_keys()), ["a", "b", "c"])
+
+    def test_compaction(self):
+        with tf.TmpDir() as tmp:
+            with tf.Container(tmp.path("ct")) as ct:
+                ct.compact_every = 10
+                for i in range(25):
+                    ct / f"res/f_{i}.txt"
+                self.assertEqual(ct._journal.count, 5)
+                saved = tf.Tree.from_file(ct.path("infos.tree"))
+                self.assertEqual(len(saved.get_files()), 20)
+                ct._journal.flush()
+                self.assertGreater(os.path.getsize(ct.path("infos.journal")), 0)
+            self.assertEqual(os.path.getsize(ct.path("infos.journal")), 0)
+            self.assertFalse(os.path.exists(ct.path("infos.tree.tmp")))
+
+            ct = tf.Container(tmp.path("ct"))
+            self.assertEqual(ct.f_24, ct.path("res/f_24.txt"))
+            self.assertEqual(len(ct.get_files()), 25)
+
+    def test_writers(self):
+        n_procs, n = 32, 100000 // 32
+        with tf.TmpDir() as tmp:
+            ct = tf.Container(tmp.path("ct"))
+            ct / "own.txt"
+            args = [(ct if k % 2 else ct.abs(), k, n) for k in range(n_procs)]
+            with tf.NestablePool(n_procs) as pool:
+                res = pool.map_async(register_files, args)
+                while not res.ready():
+                    ct.merge()  # while the shards are written
+                self.assertEqual(res.get(), [True] * n_procs)
+            ct.save()
+            self.assertEqual(ct._journal.shards(), [])
+
+            ct = tf.Container(tmp.path("ct"))
+            self.assertEqual(ct._journal.count, 0)
+            self.assertEqual(len(ct.get_files()), n_procs * n + 1)
+            self.assertEqual(ct.f_0, ct.path("w_0/f_0.txt"))
+            self.assertEqual(
+                getattr(ct, f"f_{32 * n - 1}"), ct.w_31.path(f"f_{32 * n - 1}.txt")
+            )
+            self.assertEqual(ct.own, ct.path("own.txt"))
+
+    def test_take_over(self):
+        with tf.TmpDir() as tmp:
+            with tf.Container(tmp.path("ct")) as ct:
+                ct / "a.txt"
+            with tf.NestablePool(1) as pool:
+                # Released on exit
+                self.assertFalse(pool.apply(open_register, [(ct.abs(), "b.txt")]))
+                pool.apply(open_register, [(ct.abs(), None)])
+                saved = tf.Tree.from_file(ct.path("infos.tree"))
+                self.assertEqual(sorted(saved.get_file_keys()), ["a", "b"])
+
+                ct = tf.Container(tmp.path("ct"))
+                self.assertTrue(pool.apply(open_register, [(ct.abs(), "c.txt")]))
+                ct / "d.txt"
+                ct.save()
+                self.assertEqual(pool.apply(open_register, [(ct.abs(), None)]), [])
+                saved = tf.Tree.from_file(ct.path("infos.tree"))
+                self.assertEqual(sorted(saved.get_file_keys()), ["a", "b", "c", "d"])
+
+    def test_owner_after_clean(self):
+        with tf.TmpDir() as tmp:
+            ct1 = tf.Container(tmp.path("ct"))
+            ct1 / "a.txt"
+            ct2 = tf.Container(tmp.path("ct"), clean=True)
+            self.assertEqual(
+                (ct1._journal.is_shard, ct2._journal.is_shard), (False, True)
+            )
+            ct1.dump(clean=True)
+            ct1 / "b.txt"
+            ct1._journal.flush()
+            self.assertGreater(os.path.getsize(ct1.path("infos.journal")), 0)
+            with tf.NestablePool(1) as pool:
+                self.assertTrue(pool.apply(open_register, [(ct1.abs(), "c.txt")]))
+
+            ct2 / "d.txt"
+            ct1.save()
+            ct2.save()
+            saved = tf.Tree.from_file(ct1.path("infos.tree"))
+            self.assertEqual(sorted(saved.get_file_keys()), ["a", "b", "c", "d"])
+
+
+class TestRegister(unittest.TestCase):
+    def test_register_many(self):
+        with tf.TmpDir() as tmp:
+            ct = tf.Container(tmp.path("ct"))
+            paths = ct.register_many(["a/x.txt", "a/y.txt", "b/c/z.txt", "a/x.txt"])
+            self.assertEqual(paths[0], ct.path("a/x.txt"))
+            self.assertEqual(paths[0], paths[-1])
+            self.assertTrue(os.path.isdir(ct.path("b/c")))
+            self.assertEqual(ct._journal.count, 3)
+            ct / "a/w.txt"
+            ct.b / "c/v.txt"
+            self.assertEqual([x.root for x in ct.dirs], ["a", "b"])
+            self.assertEqual(ct.v, ct.path("b/c/v.txt"))
+            with self.assertRaises(RuntimeError):
+                ct.register_many(["a/u.txt", "dir"])
+
+            ct.dump(clean=True)
+            ct / "a/u.txt"
+            self.assertTrue(os.path.isdir(ct.path("a")))
+            ct.save()
+
+            ct = tf.Container(tmp.path("ct"))
+            self.assertEqual(sorted(ct.get_file_keys()), ["u", "v", "w", "x", "y", "z"])
+
+    def test_removed_dirs(self):
+        with tf.TmpDir() as tmp:
+            ct = tf.Container(tmp.path("ct"))
+            ct / "a/f.txt"
+            ct.snapshot()
+            shutil.rmtree(ct.path("a"))
+            ct.refresh()
+            ct / "a/g.txt"
+            self.assertTrue(os.path.isdir(ct.path("a")))
+            self.assertEqual(ct.g, ct.path("a/g.txt"))
+
+            ct / "b/c/h.txt"
+            ct.remove_empty()
+            ct / "b/c/i.txt"
+            self.assertTrue(os.path.isdir(ct.path("b/c")))
+
+    def test_outside_paths(self):
+        with tf.TmpDir() as tmp:
+            ct = tf.Container(tmp.path("ct"))
+            for x in ("/abs/x.txt", "../x.txt", "a/../../x.txt"):
+                with self.assertRaises(RuntimeError):
+                    ct / x
+            self.assertEqual(ct.dirs, [])
+            ct / "./a//b/x.txt"
+            self.assertEqual(ct.x, ct.path("a/b/x.txt"))
+            self.assertEqual(len(ct.dirs), 1)
+
+            deep = os.sep.join(["d"] * 5000)
+            self.assertIsNone(ct._dir_node(deep, create=False))
+
+
+class TestBlobStore(unittest.TestCase):
+    def test_dedup(self):
+        with tf.TmpDir() as tmp:
+            store = tf.BlobStore(tmp.path(".objects"))
+            cts = [tf.Container(tmp.path(f"ct_{i}"), store=store) for i in range(3)]
+            for i, ct in enumerate(cts):
+                tf.dump_str(ct / "data/mesh.vtk", "mesh")
+                tf.dump_str(ct / "params.json", f"{i}")
+            self.assertEqual(cts[0].dedup(), 0)
+            self.assertEqual(cts[1].dedup(), 1)
+            self.assertEqual(cts[2].dedup(cts[2].mesh), 1)
+            self.assertEqual(cts[2].dedup(), 0)  # the mesh is linked already
+
+            self.assertTrue(os.path.samefile(cts[0].mesh, cts[2].mesh))
+            self.assertEqual(tf.load_str(cts[2].mesh), "mesh")
+            self.assertEqual(len(list(store.blobs())), 4)
+            self.assertEqual(os.stat(cts[1].mesh).st_mode & 0o222, 0)  # read-only
+
+            self.assertEqual(store.gc(), (0, 0))
+            tf.remove(cts[0].params, cts[1].params)
+            self.assertEqual(store.gc(), (2, 2))
+            self.assertEqual(len(list(store.blobs())), 2)
+
+    def test_put(self):
+        for mode in ("hardlink", "symlink", "reflink"):
+            with tf.TmpDir() as tmp:
+                src = tmp.path("template.txt")
+                tf.dump_str(src, "config")
+                store = tf.BlobStore(tmp.path(".objects"), mode=mode)
+                a = tf.Container(tmp.path("a"), store=store)
+                b = tf.Container(tmp.path("b"), store=store.root)
+                for ct in (a, b):
+                    self.assertEqual(ct.put(src, "cfg/config.txt"), ct.config)
+                    self.assertEqual(tf.load_str(ct.config), "config")
+                self.assertNotEqual(os.stat(src).st_mode & 0o222, 0)
+                self.assertEqual(os.path.islink(a.config), mode == "symlink")
+                self.assertEqual(len(list(store.blobs())), 1)
+                a.put(src, "cfg/config.txt")  # linked already
+                self.assertEqual(os.listdir(a.path("cfg")), ["config.txt"])
+
+                os.remove(a.config)
+                self.assertEqual(store.gc()[0], 0)
+                os.remove(b.config)
+                self.assertEqual(store.gc()[0], 1)
+
+    def test_link(self):
+        with tf.TmpDir() as tmp:
+            src = tmp.path("a.txt")
+            tf.dump_str(src, "a")
+            out = tmp.dir("out").dump()
+            tf.dump_str(out.path("b.txt"), "b")
+            self.assertEqual(tf.link(src, out, "b.txt"), out.path("b.txt"))
+            self.assertEqual(os.readlink(out.path("b.txt")), src)
+            for _ in range(2):  # the second time, linked already
+                tf.link(src, out, "b.txt", mode="hardlink")
+            self.assertTrue(os.path.samefile(src, out.path("b.txt")))
+            tf.link(src, out, mode="reflink")
+            self.assertEqual(tf.load_str(out.path("a.txt")), "a")
+            self.assertEqual(sorted(os.listdir(out.abs())), ["a.txt", "b.txt"])
+
+
+class TestCached(unittest.TestCase):
+    def test_cached(self):
+        import numpy as np
+
+        with tf.TmpDir() as tmp:
+            calls = []
+
+            @tf.cached(tmp.path("ct"), key=["mesh", "params"])
+            def simulate(mesh, params, scale=2, verbose=False):
+                calls.append(scale)
+                return mesh * scale * params["k"].value
+
+            mesh = np.arange(6.0).reshape(2, 3)
+            params = tf.Params(tf.Param("k", 0.5))
+            a = simulate(mesh, params)
+            b = simulate(mesh.copy(), params.copy(), verbose=True)
+            np.testing.assert_array_equal(a, b)
+            self.assertEqual(len(calls), 1)
+            simulate(mesh[:, ::-1], params)  # other data
+            simulate(mesh, tf.Params(tf.Param("k", 1)))  # other params
+            self.assertEqual(len(calls), 3)
+            self.assertEqual((simulate.cache.hits, simulate.cache.misses), (1, 3))
+
+            ct = simulate.cache.container
+            ct.save()
+            saved = tf.Tree.from_file(ct.path("infos.tree"))
+            self.assertEqual(len(saved.simulate.files), 6)  # results, provenance
+            prov = [x for x in saved.simulate.files.values() if ".prov." in x][0]
+            prov = tf.load_json(saved.simulate.path(prov))
+            self.assertTrue(prov["function"].endswith("test_cached.<locals>.simulate"))
+            self.assertEqual(prov["arguments"]["mesh"], "ndarray(2, 3) float64")
+
+            @tf.cached(tmp.path("ct"), name="simulate", key=["mesh", "params"])
+            def simulate(mesh, params, scale=2, verbose=False):
+                calls.append(scale)
+
+            np.testing.assert_array_equal(simulate(mesh, params), a)  # from disk
+            self.assertEqual(len(calls), 3)
+
+    def test_formats(self):
+        with tf.TmpDir() as tmp:
+
+            @tf.cached(tmp.path("ct"))
+            def f(x):
+                return x
+
+            for x in ["text", {"a": [1, 2.5, None]}, (1, 2), {1: "a"}, tf.Str("s")]:
+                f(x)
+                y = f(x)
+                self.assertEqual(y, x)
+                self.assertIs(type(y), type(x))
+            self.assertEqual(f.cache.hits, 5)
+            exts = sorted(x.rsplit(".", 1)[1] for x in os.listdir(tmp.path("ct/f")))
+            self.assertEqual(exts, ["json"] * 6 + ["pkl"] * 3 + ["txt"])
+
+    def test_hash_str(self):
+        import pathlib
+
+        from treefiles.tree_cache import hash_args
+
+        h = hash_args("a/b")
+        self.assertEqual(hash_args(tf.Str("a/b")), h)
+        self.assertEqual(hash_args(pathlib.PurePosixPath("a/b")), h)
+        self.assertNotEqual(hash_args(b"a/b"), h)
+        self.assertEqual(
+            hash_args({tf.Str("k"): [tf.Str("v")]}), hash_args({"k": ["v"]})
+        )
+        paths = {pathlib.PurePosixPath("b"): 1, "a": 2}
+        self.assertEqual(hash_args(paths), hash_args({"b": 1, "a": 2}))
+
+    def test_eviction(self):
+        with tf.TmpDir() as tmp:
+
+            @tf.cached(tmp.path("ct"), max_entries=3)
+            def f(i, n=100):
+                return "x" * n
+
+            for i in range(5):
+                f(i)
+            f(2)  # most recently used
+            f(5)
+            self.assertEqual(len(f.cache), 3)
+            self.assertEqual(f.cache.size, 300)
+            self.assertEqual(len(os.listdir(tmp.path("ct/f"))), 6)
+            f(2)
+            f(4)
+            self.assertEqual(f.cache.misses, 6)
+
+            f.cache.max_bytes = 250
+            f(6, n=200)
+            self.assertEqual(len(f.cache), 1)
+            f.cache.clear()
+            self.assertEqual(os.listdir(tmp.path("ct/f")), [])
+
+            ct = tf.Container(tmp.path("ct"))  # journal replayed
+            self.assertEqual(ct.get_files(), [])
+
+    def test_unregister(self):
+        with tf.TmpDir() as tmp:
+            ct = tf.Container(tmp.path("ct"))
+            ct.register_many(["a/x.txt", "a/y.txt"])
+            self.assertEqual(ct.unregister("a/x.txt", "a/z.txt"), 1)
+            ct / "a/x.txt"
+            ct.unregister("a/y.txt")
+
+            ct = tf.Container(tmp.path("ct"))
+            self.assertEqual(ct.get_file_keys(), ["x"])
+            with self.assertRaises(AttributeError):
+                ct.y
+
+            self.assertEqual(ct.unregister("b/c/x.txt"), 0)
+            self.assertEqual(len(ct.dirs), 1)
+            self.assertFalse(os.path.exists(tmp.path("ct/b")))
+
+
+class TestWatch(unittest.TestCase):
+    def later(self, *actions, delay=0.1):
+        def run():
+            for action in actions:
+                time.sleep(delay)
+                action()
+
+        th = threading.Thread(target=run)
+        th.start()
+        return th
+
+    def test_wait_for(self):
+        for use_inotify in (True, False):
+            with tf.TmpDir() as tmp:
+                t = tf.Tree(tmp.path("out"))
+                t.dir("sim").dir("res").file(a="a.vtk", b="b.vtk")
+                th = self.later(
+                    lambda: t.res.dump(),  # directory not existing when waiting
+                    lambda: tf.dump_str(t.a, "a"),
+                    lambda: tf.dump_str(t.b, "b"),
+                )
+                paths = t.wait_for(
+                    "a", "b", timeout=5, use_inotify=use_inotify, poll_interval=0.02
+                )
+                th.join()
+                self.assertEqual(paths, [t.a, t.b])
+
+                with self.assertRaises(TimeoutError):
+                    t.file(c="c.vtk").wait_for(
+                        "c", timeout=0.2, use_inotify=use_inotify
+                    )
+
+    def test_wait_for_created_while_starting(self):
+        for use_inotify in (True, False):
+            with tf.TmpDir() as tmp:
+                t = tmp.file(a="a.txt")
+                declared_files = tree_watch.declared_files
+
+                def create_then_list(tree, *args):
+                    tf.dump_str(t.a, "a")  # before the watch is set
+                    return declared_files(tree, *args)
+
+                tree_watch.declared_files = create_then_list
+                try:
+                    paths = t.wait_for("a", timeout=1, use_inotify=use_inotify)
+                finally:
+                    tree_watch.declared_files = declared_files
+                self.assertEqual(paths, [t.a])
+
+    def test_wait_for_scope(self):
+        t = tf.Tree("/data/out")
+        t.dir("a").file("x.txt")
+        t.dir("b").file("y.txt")
+        self.assertEqual(
+            tree_watch.declared_files(t, ["y"]), {"/data/out/b": {"y.txt": "y"}}
+        )
+
+    def test_overflow(self):
+        read = tree_watch.Inotify.read
+
+        def overflow(ino, timeout, stop_fd=None):
+            # Every event is dropped
+            events = read(ino, timeout, stop_fd)
+            return [(-1, tree_watch.Inotify.IN_Q_OVERFLOW, "")] if events else []
+
+        with tf.TmpDir() as tmp:
+            t = tmp.file(a="a.txt", b="b.txt")
+            tf.dump_str(t.b, "b")
+            th = self.later(lambda: tf.dump_str(t.a, "a"), lambda: os.remove(t.b))
+            tree_watch.Inotify.read = overflow
+            try:
+                events = []
+                for ev in t.watch(timeout=5, use_inotify=True):
+                    events.append((ev.kind, ev.alias))
+                    if ev.kind == "deleted":
+                        break
+            finally:
+                tree_watch.Inotify.read = read
+            th.join()
+            self.assertEqual(events[0], ("created", "a"))
+            self.assertEqual(events[-1], ("deleted", "b"))
+
+    def test_events(self):
+        for use_inotify in (True, False):
+            with tf.TmpDir() as tmp:
+                t = tmp.file(a="a.txt", b="b.txt")
+                tf.dump_str(t.b, "b")
+                th = self.later(
+                    lambda: tf.dump_str(t.a, "a"),
+                    lambda: tf.dump_str(tmp.path("other.txt"), "not declared"),
+                    lambda: os.remove(t.b),
+                )
+                events = []
+                for ev in t.watch(
+                    timeout=5, use_inotify=use_inotify, poll_interval=0.02
+                ):
+                    events.append((ev.kind, ev.alias))
+                    if ev.kind == "deleted":
+                        break
+                th.join()
+                self.assertEqual(events[0], ("created", "a"))
+                self.assertEqual(events[-1], ("deleted", "b"))
+
+    def test_awatch(self):
+        async def first_event(t):
+            async for ev in t.awatch(timeout=5):
+                return ev
+
+        with tf.TmpDir() as tmp:
+            t = tmp.file(a="a.txt")
+            th = self.later(lambda: tf.dump_str(t.a, "a"))
+            ev = asyncio.run(first_event(t))
+            th.join()
+            self.assertEqual((ev.kind, ev.path), ("created", t.a))
+
+    def test_awatch_cancelled(self):
+        async def consume(t, use_inotify):
+            async for _ in t.awatch(use_inotify=use_inotify, poll_interval=60):
+                pass
+
+        async def cancel(t, use_inotify):
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(consume(t, use_inotify), 0.2)
+
+        for use_inotify in (True, False):
+            with tf.TmpDir() as tmp:
+                t = tmp.file(a="a.txt")
+                t0 = time.monotonic()
+                asyncio.run(cancel(t, use_inotify))  # waits for the executor
+                self.assertLess(time.monotonic() - t0, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
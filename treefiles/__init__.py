@@ -1,6 +1,8 @@
 import os
 
 from treefiles.tree import Tree, jTree, fTree, Str, S, T, TS, Container
+from treefiles.tree_compact import CompactTree
+from treefiles.tree_store import BlobStore
 from treefiles.decorators import debug, timer
 from treefiles.pdf import PDFMerger
 from treefiles.logs import get_logger, stream_csv_handler, get_csv_logger
@@ -70,6 +72,8 @@ try:
 except ImportError:
     pass
 
+from treefiles.tree_cache import cached
+
 
 try:
     from tqdm import tqdm
@@ -114,6 +118,7 @@ else:
         project_vector_on_plane,
     )
     from treefiles.functions import beta_, minmax_
+    from treefiles.tree_frames import FrameIndex
 
 
 from treefiles.commons import (
@@ -138,8 +143,11 @@ from treefiles.commons import (
     copyfile,
     copyFile,
     link,
+    reflink,
     greedy_download,
     natural_sort,
+    natural_sort_,
+    natural_key,
     listdir,
     load_zip,
     dump_zip,
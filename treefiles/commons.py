@@ -16,7 +16,7 @@ import tempfile
 import time
 from contextlib import contextmanager
 from os.path import join, isfile, basename, isdir
-from typing import List, Union, Any
+from typing import List, Union, Any, Iterable, Callable
 from zipfile import ZipFile
 
 from treefiles.tree import Tree, Str, S, T, TS
@@ -32,6 +32,11 @@ except:
     YAML = False
 # `pip install PyYAML` to install yaml
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 def join(*paths: TS) -> S:
     """Wrapper of `os.path.join`"""
@@ -143,7 +148,7 @@ def curDirs(file: str, *paths: str) -> S:
 
 def removeIfExists(fname: str):
     """Remove `fname` if it exists"""
-    if os.path.exists(fname):
+    if os.path.lexists(fname):
         os.remove(fname)
 
 
@@ -180,19 +185,60 @@ def copyFile(src: str, dst: str):
     shutil.copyfile(src, dst)
 
 
-def link(in_fname: str, out_dir: T):
+def link(in_fname: str, out_dir: T, name: str = None, mode: str = "symlink"):
     """
-    Will create a sym link from `in_fname` to the directory out_dir
+    Will create a link to `in_fname` in the directory out_dir, replacing atomically
+    a file of the same name
     :param in_fname str: Filename of the file
     :param out_dir Tree: Tree instance representing the directory where to save the link
+    :param name str: name of the link, basename of `in_fname` by default
+    :param mode str: "symlink", "hardlink" or "reflink" (see `reflink`)
     :return: filename of the created link
     """
-    quick_link = out_dir.path(basename(in_fname))
-    removeIfExists(quick_link)
-    os.symlink(in_fname, quick_link)
+    quick_link = out_dir.path(name or basename(in_fname))
+    if mode == "hardlink" and _same_inode(in_fname, quick_link):
+        return quick_link  # renaming a link of the same file would be a no-op
+    tmp = f"{quick_link}.{os.getpid()}.tmp"
+    removeIfExists(tmp)
+    if mode == "symlink":
+        os.symlink(in_fname, tmp)
+    elif mode == "hardlink":
+        os.link(in_fname, tmp)
+    elif mode == "reflink":
+        reflink(in_fname, tmp)
+    else:
+        raise ValueError(f"Unknown link mode {mode!r}")
+    os.replace(tmp, quick_link)
     return quick_link
 
 
+def _same_inode(src: str, link_name: str) -> bool:
+    try:
+        return os.path.samestat(os.stat(src), os.lstat(link_name))
+    except FileNotFoundError:
+        return False
+
+
+def reflink(src: str, dst: str):
+    """
+    Copies `src` to `dst` sharing its data blocks on filesystems supporting it
+    (Btrfs, XFS), with a plain copy elsewhere
+    """
+    try:
+        import fcntl
+
+        with open(src, "rb") as f_src, open(dst, "wb") as f_dst:
+            fcntl.ioctl(f_dst.fileno(), _FICLONE, f_src.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(src, dst)
+
+
+# ioctl cloning a file on Linux
+_FICLONE = 0x40049409
+
+
 def dump_txt(fname: str, data, delimiter=" "):
     fname = ensure_ext(fname, "txt")
     with open(fname, "w") as f:
@@ -223,13 +269,64 @@ def greedy_download(*fnames: str, force: bool = False):
     return False
 
 
-def natural_sort(l: List[str]) -> List[str]:
+_NUMBERS = re.compile(r"(\d+)")
+_LEADING_NUMBER = re.compile(r"^\d+")
+_TRAILING_NUMBER = re.compile(r"\d+$")
+
+
+def natural_key(text: str) -> tuple:
+    """
+    Sort key of `natural_sort`: lowercase text and numbers alternate, text first,
+    so that two keys always compare
+    """
+    parts = _NUMBERS.split(text.lower())
+    parts[1::2] = map(int, parts[1::2])
+    return tuple(parts)
+
+
+def _numbered_order(names: List[str]):
+    """
+    Natural order of names differing only by a number (`prefix_<int>.ext`), sorted
+    with NumPy. Returns None for other names, or without NumPy.
+    """
+    if np is None or len(names) < 2:
+        return
+    n = len(_TRAILING_NUMBER.sub("", os.path.commonprefix(names)))
+    suffix = os.path.commonprefix([x[::-1] for x in names])[::-1]
+    m = len(_LEADING_NUMBER.sub("", suffix))
+    # Empty if the prefix and the suffix overlap
+    numbers = [x[n : len(x) - m] for x in names]
+    joined = "".join(numbers)
+    if not (joined.isascii() and joined.isdigit() and all(numbers)):
+        return
+    if max(map(len, numbers)) > 18:
+        return  # may not fit in int64
+    values = np.fromiter(map(int, numbers), np.int64, len(numbers))
+    return np.argsort(values, kind="stable").tolist()
+
+
+def natural_sort(l: Iterable[str], key: Callable[[Any], str] = None) -> List[str]:
     """
     Sorts a list of paths in a natural way
+
+    :param key: function returning the string an element is sorted by
+    """
+    l = list(l)
+    names = l if key is None else [key(x) for x in l]
+    order = _numbered_order(names)
+    if order is None:
+        if key is None:
+            return sorted(l, key=natural_key)
+        keys = [natural_key(x) for x in names]
+        order = sorted(range(len(l)), key=keys.__getitem__)
+    return [l[i] for i in order]
+
+
+def natural_sort_(l: List[str], key: Callable[[Any], str] = None):
+    """
+    Sorts a list of paths in a natural way, in place, see `natural_sort`
     """
-    convert = lambda text: int(text) if text.isdigit() else text.lower()
-    alphanum_key = lambda key: [convert(c) for c in re.split(r"(\d+)", key)]
-    return sorted(l, key=alphanum_key)
+    l[:] = natural_sort(l, key=key)
 
 
 def listdir(root: Union[T, str]) -> List[S]:
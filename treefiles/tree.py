@@ -1,18 +1,52 @@
+import errno
 import glob
 import logging
 import os
 import re
-import shutil
+import stat
+import weakref
+from array import array
 from dataclasses import dataclass
-from typing import TypeVar, List, Union, Optional, Callable
-
-from treefiles.tree_format import parse_lines, set_parents, get_lines
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+from typing import (
+    TypeVar,
+    List,
+    Union,
+    Optional,
+    Callable,
+    Iterator,
+    NamedTuple,
+    Iterable,
+    Tuple,
+)
+
+from treefiles.tree_format import set_parents, get_lines, IncludeCache
 
 T = TypeVar("T", bound="Tree")
 S = TypeVar("S", bound="Str")
 TS = Union[S, T, str]
 
 
+class WalkEntry(NamedTuple):
+    """
+    Directory or file met by `Tree.walk`
+
+    path: absolute path (`str`), None for a file set to None
+    node: the directory, or the directory holding the file
+    alias: alias of the file, or of the directory in `ndirs` (None in `dirs`)
+    depth: depth of the directory (of the file's directory) below the walked tree
+    is_file: whether the entry is a file
+    """
+
+    path: Optional[S]
+    node: T
+    alias: Optional[str]
+    depth: int
+    is_file: bool = False
+
+
 class Tree:
     """
     Creates a tree instance
@@ -21,17 +55,30 @@ class Tree:
     :param parent: parent tree if current tree is not the main root
     """
 
+    # Absolute paths are memoized per node as `(generation, path)`, a cached path is
+    # valid only if its generation is the current one. Renaming or moving a node
+    # with a valid path starts a new generation.
+    _path_generation = 0
+    _abs_cache = None
+    _snapshot = None
+    # Set once a copy-on-write copy exists, changes then check for clones to detach
+    _cow_used = False
+    # Copies of `dirs` and `ndirs` indexed in `_alias_index`, to notice in place
+    # changes of this level
+    _alias_containers = None
+
     def __init__(self, name: TS = None, parent: T = None):
         if name is not None:
             if isinstance(name, Tree):
                 name = name.abs()
         else:
             name = "root"
-        self.parent = parent
+        self._parent = parent
         self._name = Str(name)
         self.dirs = []
         self.ndirs = {}
         self.files = dict()
+        self._alias_index = None
 
     @classmethod
     def new(cls, file: str, *args: str, dump: bool = True, clean: bool = False) -> T:
@@ -45,11 +92,55 @@ class Tree:
         """
         Returns the absolute path of a tree root
 
-        :param path: recursion parameter
+        :param path: unused, kept for compatibility
         """
-        if self.parent is None:
-            return Str(os.path.abspath(self._name))
-        return Str(os.path.join(self.parent.abs(path), self._name))
+        gen = Tree._path_generation
+        cache = self._abs_cache
+        if cache is not None and cache[0] == gen:
+            return cache[1]
+
+        # Go up to the first parent with a valid path, then join back down
+        chain, node = [], self
+        while node is not None:
+            cache = node._abs_cache
+            if cache is not None and cache[0] == gen:
+                break
+            chain.append(node)
+            node = node._parent
+        if node is not None:
+            base, stable = cache[1], True
+        else:
+            top = chain.pop()
+            base = Str(os.path.abspath(top._name))
+            # A relative root depends on the working directory, never memoized
+            stable = os.path.isabs(top._name)
+            if stable:
+                top._abs_cache = (gen, base)
+        for node in reversed(chain):
+            base = Str(os.path.join(base, node._name))
+            if stable:
+                node._abs_cache = (gen, base)
+        return base
+
+    def _invalidate_abs(self):
+        """
+        Starts a new path generation if this node holds a valid path. Valid paths
+        are always cached for a node and all its parents at once, so a node
+        without one has no descendant with one either.
+        """
+        cache = self._abs_cache
+        if cache is not None and cache[0] == Tree._path_generation:
+            Tree._path_generation += 1
+
+    @property
+    def parent(self) -> Optional[T]:
+        return self._parent
+
+    @parent.setter
+    def parent(self, x: Optional[T]):
+        if x is not self._parent:
+            self._invalidate_abs()
+        self._parent = x
 
     @property
     def root(self) -> S:
@@ -59,7 +150,12 @@ class Tree:
     def root(self, x: TS):
         if isinstance(x, Tree):
             x = x.abs()
+        if x != self._name:
+            self._before_change(materialize=False)
+            self._invalidate_abs()
         self._name = Str(x)
+        if self.parent is not None:
+            self.parent._invalidate_alias_index()
 
     @property
     def p(self) -> T:
@@ -70,14 +166,49 @@ class Tree:
         return type(self)(os.sep.join(dirs[:-1]))
 
     def copy_init_(self, obj, parent=None):
-        obj.dirs = [x.copy(parent=obj) for x in self.dirs]
-        obj.ndirs = {k: x.copy(parent=obj) for k, x in self.ndirs.items()}
-        obj.files = dict(self.files)
+        obj._before_change()
+        for x in obj.__dict__.get("dirs", []) + list(
+            obj.__dict__.get("ndirs", {}).values()
+        ):
+            x._detach()
+        obj.dirs, obj.ndirs = [], {}
+        copies = [obj]
+        for e in self._cow_data().walk(include_files=False):
+            if e.depth == 0:
+                obj.files = dict(e.node.files)
+                continue
+            del copies[e.depth :]
+            c = type(e.node).__new__(type(e.node))
+            Tree.__init__(c, e.node.root, copies[-1])
+            c.files = dict(e.node.files)
+            if e.alias is None:
+                copies[-1].dirs.append(c)
+            else:
+                copies[-1].ndirs[e.alias] = c
+            copies.append(c)
         obj.parent = parent
         obj.root = self.root  # self.abs()
+        obj._invalidate_alias_index()
         return obj
 
-    def copy(self, root=None, parent=None):
+    def copy(self, root=None, parent=None, cow: bool = False):
+        """
+        Deep copy of the tree
+
+        :param root: new root name
+        :param parent: parent of the copy
+        :param cow: copy-on-write, the copy shares the nodes of `self` and gets its
+            own nodes level by level when they are accessed or changed, on either
+            side. Alias lookups on a copy left unchanged go through the index of
+            `self`.
+        """
+        if cow:
+            c = self._cow_copy(parent)
+            if root is not None:
+                c.root = root
+            elif parent is not None:
+                parent._invalidate_alias_index()
+            return c
         c = type(self)()
         self.copy_init_(c, parent)
         if root is not None:
@@ -91,11 +222,31 @@ class Tree:
         else:
             return cls(obj, parent)
 
-    def f(self, idx):
+    def f(self, idx, cow: bool = False):
         """
         Special copy with formatting of root
+
+        :param cow: copy-on-write, see `copy`
         """
-        return self.copy(self.abs().f(idx))
+        return self.copy(self.abs().f(idx), cow=cow)
+
+    def expand(self, indices):
+        """
+        Copies with formatting of root for many indices, as views created on access
+        with batched `dump` and `get_files`, see `treefiles.tree_views.TreeViews`
+
+        :param indices: values formatted in the root, tuples of positional arguments
+            or dicts of keyword arguments
+        """
+        from treefiles.tree_views import TreeViews
+
+        return TreeViews.expand(self, indices)
+
+    def f_many(self, indices):
+        """
+        Same as `expand`
+        """
+        return self.expand(indices)
 
     def __getattr__(self, att) -> Optional[TS]:
         """
@@ -107,28 +258,268 @@ class Tree:
             - look for files at current level
             - look for child at current level
             - look in children levels recursively
+
+        Lookups go through an alias index of the subtree, built on first access
+        and kept up to date by `dir`, `file`, `copy` and root changes. Entries found
+        are checked against the containers, which may be modified in place.
         """
-        if att in self.files:
-            if self.files[att] is None:
+        d = self.__dict__
+        if "files" not in d:
+            if "_source" not in d:
+                # Not initialized yet (e.g. while unpickling)
+                raise AttributeError(att)
+            if att in ("dirs", "ndirs", "files"):
+                # Copy-on-write copy accessed
+                self._materialize()
+                return d[att]
+
+        found = self._lookup(att)
+        if found is not None:
+            node, fname = found
+            if fname is _DIR:
+                return node
+            if fname is None:
                 return
-            return Str(os.path.join(self.abs(), self.files[att]))
-        for d in self.dirs:
-            if d.root == att:
-                return d
-        for d in self.dirs:
-            found = getattr(d, att)
-            if found is not None:
-                return found
-        for alias, d in self.ndirs.items():
-            if alias == att:
-                return d
-        for d in self.ndirs.values():
-            found = getattr(d, att)
-            if found is not None:
-                return found
+            return Str(os.path.join(node.abs(), fname))
         if self.parent is None:
             raise AttributeError(f"Attribute {att!r} not found in {self._name}")
 
+    def _lookup(self, att: str) -> Optional[tuple]:
+        """
+        Finds an alias reachable from this level
+
+        :return: `(node, _DIR)` for a directory, `(node, filename)` for a file,
+            None if not found
+        """
+        d = self.__dict__
+        if "files" not in d:
+            # Unchanged copy-on-write copy, look it up in the source
+            found = d["_source"]._lookup(att)
+            if found is None:
+                return
+            return self._clone_of(found[0]), found[1]
+
+        # Files of this level first, they may have been modified in place
+        files = d["files"]
+        if att in files:
+            return self, files[att]
+
+        index = d["_alias_index"]
+        if index is None or (d["dirs"], d["ndirs"]) != self._alias_containers:
+            index = self._build_alias_index()
+        entry = index.get(att)
+        if entry is not None and not self._alias_entry_valid(att, entry):
+            # The containers were modified in place, scan them again
+            index = self._build_alias_index()
+            entry = index.get(att)
+
+        if entry is not None:
+            node, is_file = entry
+            return (node, node.files[att]) if is_file else (node, _DIR)
+
+    def _build_alias_index(self) -> dict:
+        """
+        Maps every alias reachable from this level to its `(node, is_file)` entry,
+        following the lookup order of `__getattr__`
+        """
+        index = {al: (self, True) for al in self.files}
+        stack = [(self, frozenset())]
+        while stack:
+            node, hidden = stack.pop()
+            if isinstance(node, list):
+                # Named dirs of a level, reached once its dirs have been explored
+                for al, d in node:
+                    if al not in hidden:
+                        index.setdefault(al, (d, False))
+                continue
+            if node is not self:
+                # A file set to None stops the search in this level and below
+                nones = [al for al, f in node.files.items() if f is None]
+                if nones:
+                    hidden = hidden.union(nones)
+                for al, f in node.files.items():
+                    if f is not None and al not in hidden:
+                        index.setdefault(al, (node, True))
+            for d in node.dirs:
+                if d.root not in hidden:
+                    index.setdefault(d.root, (d, False))
+            stack.extend((d, hidden) for d in reversed(node.ndirs.values()))
+            stack.append((list(node.ndirs.items()), hidden))
+            stack.extend((d, hidden) for d in reversed(node.dirs))
+        self._alias_index = index
+        self._alias_containers = (list(self.dirs), dict(self.ndirs))
+        return index
+
+    def _alias_entry_valid(self, att: str, entry: tuple) -> bool:
+        """
+        Whether an index entry still holds the alias and is still reachable from
+        this level through the containers of its parents
+        """
+        node, is_file = entry
+        if is_file:
+            if node.files.get(att) is None:
+                return False
+        else:
+            parent = node._parent
+            if parent is None or not (
+                parent.ndirs.get(att) is node
+                or node._name == att
+                and node in parent.dirs
+            ):
+                return False
+            node = parent
+        while node is not self:
+            parent = node._parent
+            if parent is None or not (
+                node in parent.dirs or node in parent.ndirs.values()
+            ):
+                return False
+            node = parent
+        return True
+
+    def _invalidate_alias_index(self):
+        """
+        Drops the alias index of this level and of all its parents
+        """
+        node = self
+        while node is not None:
+            node.__dict__["_alias_index"] = None
+            node = node._parent
+
+    def _update_alias_index(self, entries: List[tuple]):
+        """
+        Registers new `(alias, node, is_file)` entries of this level in the existing
+        indexes of this level and its parents. An index is dropped when an entry
+        conflicts with an already indexed alias, since precedence is then ambiguous.
+        """
+        level, shadowed = self, set()
+        if self.__dict__.get("_alias_index") is not None:
+            dirs, ndirs = self._alias_containers
+            for al, node, is_file in entries:
+                if is_file:
+                    continue
+                if self.ndirs.get(al) is node:
+                    ndirs[al] = node
+                else:
+                    dirs.append(node)
+        while level is not None:
+            index = level.__dict__.get("_alias_index")
+            for al, node, is_file in entries if index is not None else ():
+                entry = (node, is_file)
+                current = index.get(al)
+                if level is self and is_file:
+                    index[al] = entry
+                elif level is self and al in self.files:
+                    continue  # files of this level come first
+                elif al in shadowed:
+                    # Hidden by a file set to None, which may hide indexed entries too
+                    if current is not None:
+                        level._alias_index = None
+                        break
+                elif current is None:
+                    index[al] = entry
+                elif current != entry:
+                    level._alias_index = None
+                    break
+            shadowed.update(
+                al
+                for al, _, _ in entries
+                if al in level.files and level.files[al] is None
+            )
+            if level.__dict__.get("_detached"):
+                break  # no longer reachable from its parent
+            level = level._parent
+
+    def _detach(self):
+        """
+        Flags a child replaced in its parent, so that its changes do not reach the
+        indexes of its former parents
+        """
+        self._detached = True
+
+    # Copy-on-write copies (`copy(cow=True)`) are created without containers and
+    # hold their `_source` node instead. Their containers are filled on first
+    # access (`_materialize`) with copies of the source children, created the same
+    # way. Sources keep their pending copies in `_cow_clones` and materialize them
+    # before any change. A materialized node implies materialized parents, so an
+    # unmaterialized copy has an unchanged subtree and can be looked up in its
+    # source.
+
+    def _cow_data(self) -> T:
+        """
+        Node holding the containers of this node: itself, or the source of a
+        pending copy-on-write copy
+        """
+        d = self.__dict__
+        return self if "files" in d else d["_source"]
+
+    def _cow_copy(self, parent: T = None) -> T:
+        source = self._cow_data()
+        c = type(self).__new__(type(self))
+        c.__dict__.update(_name=self._name, _parent=parent, _alias_index=None)
+        c.__dict__["_source"] = source
+        clones = source.__dict__.get("_cow_clones")
+        if clones is None:
+            clones = source.__dict__["_cow_clones"] = weakref.WeakSet()
+        clones.add(c)
+        Tree._cow_used = True
+        return c
+
+    def _materialize(self):
+        """
+        Gives a pending copy-on-write copy its own containers, and to its parents
+        """
+        chain, node = [], self
+        while node is not None and "files" not in node.__dict__:
+            chain.append(node)
+            node = node._parent
+        for node in reversed(chain):
+            d = node.__dict__
+            source = d["_source"]
+            clones = d.pop("_clones", {})
+            clone = lambda x: clones[x] if x in clones else x._cow_copy(node)
+            d["dirs"] = [clone(x) for x in source.dirs]
+            d["ndirs"] = {k: clone(x) for k, x in source.ndirs.items()}
+            d["files"] = dict(source.files)
+            source.__dict__["_cow_clones"].discard(node)
+
+    def _clone_of(self, node: T) -> T:
+        """
+        Copy of a node of the source subtree in this pending copy, the copies of its
+        parents being created without containers
+        """
+        chain, source = [], self.__dict__["_source"]
+        while node is not source:
+            chain.append(node)
+            node = node._parent
+        c = self
+        for x in reversed(chain):
+            clones = c.__dict__.setdefault("_clones", {})
+            if x not in clones:
+                clones[x] = x._cow_copy(c)
+            c = clones[x]
+        return c
+
+    def _before_change(self, materialize: bool = True):
+        """
+        Materializes the copy-on-write copies a change of this node would alter:
+        pending copies of this node and of its parents, then this node itself if it
+        is a pending copy (its parent only if `materialize` is False)
+        """
+        if not Tree._cow_used:
+            return
+        chain, node = [], self
+        while node is not None:
+            chain.append(node)
+            node = node._parent
+        for node in reversed(chain):
+            for c in list(node.__dict__.get("_cow_clones", ())):
+                c._materialize()
+        if materialize:
+            self._materialize()
+        elif self._parent is not None:
+            self._parent._materialize()
+
     def __repr__(self, i=2):
         """
         Pretty prints th current tree
@@ -139,14 +530,15 @@ class Tree:
         if i == 2 and self.abs() != self._name:
             s += f" ({self.abs()})"
         s += "\n"
-        for al, f in self.files.items():
+        data = self._cow_data()  # pending copies are not materialized
+        for al, f in data.files.items():
             kk = ""
             if al != os.path.splitext(f)[0]:
                 kk = f" [{al}]"
             s += f"{' '*i}\u2514{kk} {f}\n"
-        for d in self.dirs:
+        for d in data.dirs:
             s += f"{' '*i}\u2514 {d.__repr__(i+2)}\n"
-        for al, d in self.ndirs.items():
+        for al, d in data.ndirs.items():
             s += f"{' '*i}\u2514 [{al}] {d.__repr__(i+2)}\n"
         return s.rstrip()
 
@@ -160,10 +552,21 @@ class Tree:
         :param names: folder names
         :return: instance of the last child created
         """
+        self._before_change()
+        entries = []
         for name in names:
-            self.dirs.append(type(self)(name, parent=self))
+            d = type(self)(name, parent=self)
+            self.dirs.append(d)
+            entries.append((d.root, d, False))
         for alias, name in named_dirs.items():
-            self.ndirs[alias] = type(self)(name, parent=self)
+            d = type(self)(name, parent=self)
+            if alias in self.ndirs:
+                # Descendants of the replaced directory may be indexed
+                self.ndirs[alias]._detach()
+                self._invalidate_alias_index()
+            self.ndirs[alias] = d
+            entries.append((alias, d, False))
+        self._update_alias_index(entries)
         if len(names) > 0:
             return self.dirs[-1]
         if len(named_dirs) > 0:
@@ -191,11 +594,16 @@ class Tree:
         :param args: filenames, attributes are the files basename
         :param kwargs: filenames, attributes are the kwargs key
         """
+        self._before_change()
+        entries = []
         for arg in args:
             name, _ = os.path.splitext(arg)
             self.files[name] = arg
+            entries.append((name, self, True))
         for k, v in kwargs.items():
             self.files[k] = v
+            entries.append((k, self, True))
+        self._update_alias_index(entries)
         return self
 
     def path(self, *args: str) -> S:
@@ -207,54 +615,89 @@ class Tree:
         """
         return Str(os.path.join(self.abs(), *args))
 
-    def dump(self, clean: bool = False) -> T:
+    def dump(self, clean: bool = False, workers: int = None) -> T:
         """
         Create tree as root (create folder and children)
 
         :param clean: remove root before recreating it if exists
+        :param workers: number of threads creating (and removing) directories,
+            see `treefiles.tree_fs.dump`
         :return: root instance
         """
-        if clean and os.path.isdir(self.abs()):
-            shutil.rmtree(self.abs())
+        from treefiles.tree_fs import dump
 
-        for d in self.dirs:
-            d.dump()
-        for d in self.ndirs.values():
-            d.dump()
-        os.makedirs(self.abs(), exist_ok=True)
+        dump(self, clean=clean, workers=workers)
         return self
 
     def remove_empty(self):
         """
-        Deletes empty children
+        Deletes empty children, deepest first
         """
-        for d in self.dirs:
-            d.remove_empty()
-
-        if os.path.isdir(self.abs()) and len(os.listdir(self.abs())) == 0:
-            os.rmdir(self.abs())
+        for e in self._walk(True, False, read_only=True):
+            try:
+                os.rmdir(e.path)
+            except OSError as err:
+                # Not empty, missing or not a directory
+                if err.errno not in (
+                    errno.ENOTEMPTY,
+                    errno.EEXIST,
+                    errno.ENOENT,
+                    errno.ENOTDIR,
+                ):
+                    raise
 
     def __getstate__(self):
         """
         Pickles an object.
 
-        Because of recursion on __getstate__, only the absolute path is saved when pickling for the moment.
-        You can override this method if it does not meet your needs, PR are welcomed.
+        The tree is stored as a flat table of its nodes, parents first, so that deep
+        trees do not hit the recursion limit. The root is saved with its absolute
+        path, parents of the pickled node are left out.
         """
-
-        # if self.parent is not None:
-        #     d.update({"parent": self.parent.__getstate__()})
-        # d.update({"dirs": [x.__getstate__() for x in self.dirs]})
-
-        return {"_name": self.abs()}
+        names, parents, aliases, files = [str(self.abs())], array("i", [0]), [None], []
+        queue = [self]
+        for k, node in enumerate(queue):
+            data = node._cow_data()  # pending copies are not materialized
+            files.append(data.files)
+            for al, d in [(None, x) for x in data.dirs] + list(data.ndirs.items()):
+                names.append(str(d._name))
+                parents.append(k)
+                aliases.append(al)
+                queue.append(d)
+        return {"names": names, "parents": parents, "aliases": aliases, "files": files}
 
     def __setstate__(self, state):
         """
         Unpickles an object.
         """
-        self.__dict__.update(
-            {"_name": state.get("_name"), "parent": None, "dirs": [], "files": {}}
-        )
+        names = state.get("names")
+        if names is None:
+            # Path only, as pickled by previous versions
+            names, parents, aliases, files = [state.get("_name")], [0], [None], [{}]
+        else:
+            parents, aliases, files = state["parents"], state["aliases"], state["files"]
+
+        cls, nodes = type(self), [self]
+        for k in range(len(names)):
+            node = self if k == 0 else cls.__new__(cls)
+            parent = nodes[parents[k]] if k > 0 else None
+            node.__dict__.update(
+                {
+                    "_name": Str(names[k]),
+                    "_parent": parent,
+                    "dirs": [],
+                    "ndirs": {},
+                    "files": dict(files[k]),
+                    "_alias_index": None,
+                }
+            )
+            if k == 0:
+                continue
+            nodes.append(node)
+            if aliases[k] is None:
+                parent.dirs.append(node)
+            else:
+                parent.ndirs[aliases[k]] = node
 
     def glob(self, pattern: str) -> List[S]:
         """
@@ -264,6 +707,32 @@ class Tree:
 
         return [Str(x) for x in natural_sort(glob.glob(self.path(pattern)))]
 
+    def iglob(self, pattern: str, sort: bool = False) -> Iterator[S]:
+        """
+        Yields the paths matching a pathname pattern as they are found, see
+        <glob.iglob>
+
+        :param sort: sort naturally directory by directory, each matching directory
+            being listed once when reached, see `treefiles.tree_fs.iglob_sorted`
+        """
+        if sort:
+            from treefiles.tree_fs import iglob_sorted
+
+            return iglob_sorted(self.path(pattern))
+        return map(Str, glob.iglob(self.path(pattern)))
+
+    def frame_index(self, pat: str = "frame", pattern: str = None):
+        """
+        Index of the files of the directory numbered as `<pat>_<int>`, cached until
+        the directory changes, see `treefiles.tree_frames.FrameIndex`
+
+        :param pat: prefix of the number, as in `Str.re`
+        :param pattern: glob pattern the names must match too (e.g. "*.vtk")
+        """
+        from treefiles.tree_frames import FrameIndex
+
+        return FrameIndex.of(self.abs(), pat, pattern)
+
     @property
     def ls(self):
         """
@@ -278,24 +747,55 @@ class Tree:
         return os.path.basename(self.abs())
 
     def to_dict(self) -> dict:
-        return dict(
-            name=self._name,
-            dirs=[x.to_dict() for x in self.dirs],
-            ndirs={al: x.to_dict() for al, x in self.ndirs.items()},
-            files={al: x for al, x in self.files.items()},
-        )
+        stack = []  # dicts of the parents of the current node
+        for e in self._walk(False, False, read_only=True):
+            del stack[e.depth :]
+            node = e.node
+            # The source of a pending copy may have another name, not its children
+            name = node._name if stack else self._name
+            d = {"name": name, "dirs": [], "ndirs": {}, "files": dict(node.files)}
+            if stack:
+                if e.alias is None:
+                    stack[-1]["dirs"].append(d)
+                else:
+                    stack[-1]["ndirs"][e.alias] = d
+            stack.append(d)
+        return stack[0]
 
     @classmethod
     def from_dict(cls, d: dict, parent: T = None):
-        c = cls(d["name"])
-        c.parent = parent
-        c.files = d.get("files", [])
-        c.dirs = [cls.from_dict(x, c) for x in d.get("dirs", [])]
-        c.ndirs = {al: cls.from_dict(x, c) for al, x in d.get("ndirs", {}).items()}
-        return c
+        root = cls(d["name"], parent)
+        stack = [(root, d)]
+        while stack:
+            c, d = stack.pop()
+            c.files = d.get("files", {})
+            dirs, ndirs = d.get("dirs"), d.get("ndirs")
+            if dirs:
+                c.dirs = [cls(x["name"], c) for x in dirs]
+                stack.extend(zip(c.dirs, dirs))
+            if ndirs:
+                c.ndirs = {al: cls(x["name"], c) for al, x in ndirs.items()}
+                stack.extend(zip(c.ndirs.values(), ndirs.values()))
+        if parent is not None:
+            parent._invalidate_alias_index()
+        return root
 
     @classmethod
-    def from_str(cls, lines: Union[str, List[str]], fname: str = None, **envs):
+    def from_str(
+        cls,
+        lines: Union[str, List[str]],
+        fname: str = None,
+        include_cache: IncludeCache = None,
+        **envs,
+    ):
+        """
+        Builds a tree from the lines of a `.tree` file
+
+        :param fname: path of the file, to find included files
+        :param include_cache: reuse included files parsed by previous loads, see
+            `IncludeCache`. Each included file is parsed once per load anyway.
+        :param envs: environment variables to set
+        """
         for k, v in envs.items():
             os.environ[k] = str(v)
 
@@ -304,9 +804,26 @@ class Tree:
 
         dn = os.path.dirname(fname) if fname else ""
 
-        l = parse_lines(lines, dirname=dn)
+        cache = IncludeCache() if include_cache is None else include_cache
+        parsed, reused = cache.parsed, cache.reused
+        l = cache.parse(lines, fname)
         set_parents(l)
+        if cache.parsed > parsed or cache.reused > reused:
+            log.debug(
+                f"Loaded {fname or 'tree'}: {cache.parsed - parsed} included files "
+                f"parsed, {cache.reused - reused} reused"
+            )
+
+        return cls._from_lines(l, dn)
+
+    @classmethod
+    def _from_lines(cls, l: list, dn: str) -> T:
+        """
+        Builds a tree from parsed lines, whose parents are set
 
+        Nodes are filled as `dir` and `file` would, without maintaining alias
+        indexes since none of them exists yet.
+        """
         # If root absolute path is different from the given root,
         # the dirname is considered parent
         c0 = cls(l[0].value)
@@ -316,15 +833,77 @@ class Tree:
         objs = [c0]
         for x in l[1:]:
             parent = objs[x.parent_line]
-            parent = x.callback(parent)
-            objs.append(parent)
+            if x.entry_type == "dir":
+                node = cls(x.value, parent=parent)
+                if not x.name:
+                    parent.dirs.append(node)
+                else:
+                    if x.name in parent.ndirs:
+                        parent.ndirs[x.name]._detach()
+                        parent._invalidate_alias_index()
+                    parent.ndirs[x.name] = node
+                objs.append(node)
+            else:
+                alias = x.name or os.path.splitext(x.value)[0]
+                parent.files[alias] = x.value
+                objs.append(parent)
 
         return objs[0]
 
     @classmethod
-    def from_file(cls, *args: str, ensure_ext: bool = True, **envs):
-        lines, fname = get_lines(*args, ensure_ext=ensure_ext)
-        return cls.from_str(lines, fname=fname, **envs)
+    def from_file(
+        cls,
+        *args: str,
+        ensure_ext: bool = True,
+        include_cache: IncludeCache = None,
+        compiled: Union[bool, str] = False,
+        **envs,
+    ):
+        """
+        Builds a tree from a `.tree` file
+
+        :param include_cache: see `from_str`
+        :param compiled: keep the parsed file in a binary `.treec` file, next to the
+            file if True or in this directory. It is reused as long as the file, its
+            includes and the environment variables they reference are unchanged.
+        :param envs: environment variables to set
+        """
+        if not compiled:
+            lines, fname = get_lines(*args, ensure_ext=ensure_ext)
+            return cls.from_str(lines, fname=fname, include_cache=include_cache, **envs)
+
+        from treefiles.tree_format import tree_fname, load_compiled, compile_file
+
+        for k, v in envs.items():
+            os.environ[k] = str(v)
+        fname = tree_fname(*args, ensure_ext=ensure_ext)
+        l = load_compiled(fname, compiled)
+        if l is None:
+            log.debug(f"Compiling {fname}")
+            l = compile_file(fname, compiled, include_cache)
+        return cls._from_lines(l, os.path.dirname(fname))
+
+    @classmethod
+    def scan(
+        cls,
+        path: TS,
+        pattern: str = None,
+        max_depth: int = None,
+        follow_symlinks: bool = False,
+        workers: int = None,
+    ) -> T:
+        """
+        Builds a tree mirroring an existing directory, see `treefiles.tree_fs.scan`
+
+        :param path: directory to scan
+        :param pattern: glob pattern for file names
+        :param max_depth: maximal depth of directories scanned, 0 for `path` only
+        :param follow_symlinks: descend into links to directories
+        :param workers: number of threads listing directories
+        """
+        from treefiles.tree_fs import scan
+
+        return scan(path, pattern, max_depth, follow_symlinks, workers, cls=cls)
 
     @classmethod
     def from_dir(cls, path, **kw):
@@ -348,74 +927,227 @@ class Tree:
 
             fname = ee(fname, "tree")
 
-        with open(fname, "w") as f:
-            f.write(self.pprint(**pp_kws))
+        pp_kws.pop("i", None)
+        with open(fname, "w", buffering=2**16) as f:
+            lines = self.iter_lines(**pp_kws)
+            f.write(next(lines))
+            for line in lines:
+                f.write("\n")
+                f.write(line)
 
     def pprint(self, *, comment=None, i=2, oie: bool = False):
         """
         Export the current tree to file with the `tree` format
 
         comment: File header
-        i: recursion parameter
+        i: unused, kept for compatibility
         oie: only_if_exists
         """
-        s = ""
-        if i == 2:
-            # s += f"# File generated by the treefiles package, see https://github.com/GaetanDesrues/TreeFiles\n"
-            if comment:
-                for x in comment.split("\n"):
-                    s += f"# {x}\n"
-            s += ". "
-        else:
-            if oie and not os.path.isdir(self.abs()):
-                return None
-        s += f"{self.root}\n"
-        for d in self.dirs:
-            if not oie or os.path.isdir(d.abs()):
-                s += f"{' '*i}. {d.pprint(i=i+2, oie=oie)}\n"
-        for al, d in self.ndirs.items():
-            if not oie or os.path.isdir(d.abs()):
-                s += f"{' '*i}. {al}: {d.pprint(i=i+2, oie=oie)}\n"
-        for al, f in self.files.items():
-            if not oie or os.path.isfile(self.path(f)):
-                s += f"{' '*i}- {al}: {f}\n"
-        return s.strip()
-
-    def prune(self):
-        """
-        Return a copy of self with only existing files remaining
-        """
-        c = Tree.from_str(self.pprint(oie=True))
-        c.copy_init_(self)
-        return self
+        return "\n".join(self.iter_lines(comment=comment, oie=oie))
+
+    def iter_lines(self, *, comment=None, oie: bool = False) -> Iterator[str]:
+        """
+        Yields the lines of the `tree` format one by one, see `pprint`
+
+        comment: File header
+        oie: only_if_exists, directories are listed once to check their entries
+        """
+        from treefiles.tree_format import iter_lines
+
+        return iter_lines(self, comment=comment, oie=oie)
+
+    def prune(self, workers: int = None) -> T:
+        """
+        Return a copy of self with only existing files remaining, see
+        `treefiles.tree_fs.prune`
+
+        :param workers: number of threads listing directories
+        """
+        from treefiles.tree_fs import prune
+
+        return prune(self, workers)
+
+    def walk(
+        self, order: str = "pre", include_files: bool = True
+    ) -> Iterator[WalkEntry]:
+        """
+        Yields the directories of the tree, and their files, as `WalkEntry`
+
+        The traversal is iterative and lazy, depth-first, directories of `dirs`
+        coming before those of `ndirs`. Paths are joined from the path of the
+        parent directory.
+
+        :param order: "pre" for a directory before its content, its files coming
+            first, or "post" for a directory after its content, its files coming
+            last
+        :param include_files: also yield the files
+        """
+        if order not in ("pre", "post"):
+            raise ValueError(f"Unknown order {order!r}, expected 'pre' or 'post'")
+        return self._walk(order == "post", include_files)
+
+    def _walk(
+        self, post: bool, include_files: bool, read_only: bool = False
+    ) -> Iterator[WalkEntry]:
+        """
+        `walk`, yielding the sources of the pending copy-on-write copies instead of
+        materializing them if `read_only`, for traversals changing nothing
+        """
+        sep, new = os.sep, tuple.__new__  # skips the checks of `WalkEntry.__new__`
+        stack = [WalkEntry(self.abs(), self, None, 0)]
+        while stack:
+            entry = stack.pop()
+            if type(entry) is list:
+                # Files and directory of a level, reached once its content is walked
+                yield from entry
+                continue
+            path, node, al, depth, _ = entry
+            if read_only and "files" not in node.__dict__:
+                node = node._cow_data()
+                entry = new(WalkEntry, (path, node, al, depth, False))
+            if not post:
+                yield entry
+            # Same as `os.path.join(path, name)`
+            prefix = path if path[-1:] == sep else path + sep
+            if include_files and node.files:
+                files = [
+                    new(
+                        WalkEntry,
+                        (
+                            f if f is None or f[:1] == sep else prefix + f,
+                            node,
+                            al,
+                            depth,
+                            True,
+                        ),
+                    )
+                    for al, f in node.files.items()
+                ]
+                if post:
+                    files.append(entry)
+                    stack.append(files)
+                else:
+                    yield from files
+            elif post:
+                stack.append([entry])
+            depth += 1
+            for al, d in reversed(node.ndirs.items()):
+                name = d._name
+                path = name if name[:1] == sep else prefix + name
+                stack.append(new(WalkEntry, (path, d, al, depth, False)))
+            for d in reversed(node.dirs):
+                name = d._name
+                path = name if name[:1] == sep else prefix + name
+                stack.append(new(WalkEntry, (path, d, None, depth, False)))
 
     def get_files(self) -> List[str]:
         """
-        Get a list of all files in the tree
+        Get a list of all files in the tree, files set to None left out
         """
-        all_files = []
-        for x in self.files.values():
-            all_files.append(self.path(x))
-        for x in self.dirs:
-            all_files.extend(x.get_files())
-        for x in self.ndirs.values():
-            all_files.extend(x.get_files())
-        return all_files
+        return list(self.iter_files())
+
+    def iter_files(self) -> Iterator[S]:
+        """
+        Yields the files of the tree one by one, in the order of `get_files`
+        """
+        for e in self._walk(False, False, read_only=True):
+            path = e.path
+            for f in e.node.files.values():
+                if f is not None:
+                    yield Str(os.path.join(path, f))
 
     def get_file_keys(self) -> List[str]:
         """
         Get a list of all file keys in the tree
         """
-        all_files = list(self.files.keys())
-        for x in self.dirs:
-            all_files.extend(x.get_file_keys())
-        for x in self.ndirs.values():
-            all_files.extend(x.get_file_keys())
-        return all_files
+        # Same order as `walk`, without computing the paths
+        all_keys, stack = [], [self]
+        pop, push = stack.pop, stack.extend
+        while stack:
+            node = pop()
+            if "files" not in node.__dict__:
+                node = node._cow_data()  # pending copies are not materialized
+            all_keys.extend(node.files)
+            if node.ndirs:
+                push(reversed(node.ndirs.values()))
+            if node.dirs:
+                push(reversed(node.dirs))
+        return all_keys
 
     def __truediv__(self, other):
         return self.path(other)
 
+    def snapshot(self, ignore=()):
+        """
+        Records the stats of the tree directories and of their files, and attaches
+        the snapshot to the tree, see `refresh`
+
+        :param ignore: file names to leave out
+        """
+        from treefiles.tree_snapshot import Snapshot
+
+        self._snapshot = Snapshot.take(self, ignore=ignore)
+        return self._snapshot
+
+    def diff_since(self, snapshot):
+        """
+        Returns the files added, removed or modified since a snapshot, see
+        `treefiles.tree_snapshot.compare`
+        """
+        from treefiles.tree_snapshot import compare
+
+        return compare(self, snapshot)[0]
+
+    def refresh(self, snapshot=None):
+        """
+        Updates the tree with the changes on disk since a snapshot (defaults to the
+        attached one) and attaches a new snapshot. Only directories whose mtime
+        changed are listed again.
+
+        :return: the files added, removed or modified
+        """
+        from treefiles.tree_snapshot import refresh
+
+        return refresh(self, snapshot)
+
+    def watch(self, timeout: float = None, **kw):
+        """
+        Yields changes of the declared files (`WatchEvent`), using inotify when
+        available, see `treefiles.tree_watch.watch`
+
+        :param timeout: stop after this many seconds, never if None
+        """
+        from treefiles.tree_watch import watch
+
+        return watch(self, timeout=timeout, **kw)
+
+    def awatch(self, timeout: float = None, **kw):
+        """
+        Asynchronous iterator over changes of the declared files, see `watch`
+        """
+        from treefiles.tree_watch import awatch
+
+        return awatch(self, timeout=timeout, **kw)
+
+    def wait_for(self, *aliases: str, timeout: float = None, **kw) -> List[S]:
+        """
+        Blocks until the files of the given aliases (all declared files if none) exist
+
+        :param timeout: seconds, raises `TimeoutError` when exceeded
+        :return: the paths of the files
+        """
+        from treefiles.tree_watch import wait_for
+
+        return wait_for(self, *aliases, timeout=timeout, **kw)
+
+    def compact(self):
+        """
+        Returns a read-only, memory efficient copy of the tree, see `CompactTree`
+        """
+        from treefiles.tree_compact import CompactTree
+
+        return CompactTree.from_tree(self)
+
     def ct(self, ct_path, clean=False):
         return Container(self / ct_path, clean=clean)
 
@@ -430,34 +1162,267 @@ def fTree(file: str, *args: str, dump: bool = False, clean: bool = False) -> T:
     return Tree.new(file, *args, dump=dump, clean=clean)
 
 
+# Marks a directory found by `Tree._lookup`
+_DIR = object()
+
+
 class Container(Tree):
-    def __init__(self, *a, clean=False, **kw):
+    """
+    Tree of the outputs of a process, registered with `/` and saved in `infos.tree`
+
+    Registrations are logged to `infos.journal` as they happen (see
+    `treefiles.tree_journal.Journal`) and replayed when the container is opened
+    again, so that they survive a crash. The journal is compacted into
+    `infos.tree` by `save`, and every `compact_every` registrations.
+
+    Several processes may register files in a container, the ones given it by a
+    pool or opening it too, in this process or others: they log to shards of the
+    journal, merged by the container owning it (see `merge`). Only the owner writes `infos.tree`, `save`
+    waits for the shard to be on disk in the others. The owner releases the journal
+    once saved, the next process saving taking it over.
+
+    Outputs identical across containers can be stored once in a shared
+    `treefiles.tree_store.BlobStore`, given as `store` (or its directory), and
+    linked into each container, see `put` and `dedup`.
+    """
+
+    # Registrations logged before `infos.tree` is rewritten
+    compact_every = 10000
+    _journal = None
+    _store = None
+    _nodes = None  # directory nodes by relative path, see `_dir_node`
+    _made = None  # directories created, see `_makedirs`
+
+    def __init__(self, *a, clean=False, store=None, **kw):
         super().__init__(*a, **kw)
         self.dump(clean=clean)
+        if store is not None:
+            from treefiles.tree_store import BlobStore
+
+            self._store = store if isinstance(store, BlobStore) else BlobStore(store)
         # self.infos = {}
         fname = os.path.join(self.root / "infos.tree")
         if os.path.isfile(fname):
             obj = Tree.from_file(fname)
             obj.copy_init_(self)
         self.root = os.path.dirname(fname)
+        if os.path.isfile(self.path("infos.snapshot")):
+            from treefiles.tree_snapshot import Snapshot
+
+            self._snapshot = Snapshot.from_file(self.path("infos.snapshot"), self.abs())
+
+        if self.parent is None:
+            # Sub directories register in the journal of their root
+            from treefiles.tree_journal import Journal
+
+            self._journal = Journal(self.path("infos.journal"))
+            if not clean:
+                self._apply(self._journal.replay())
+            elif not self._journal.is_shard:
+                self._journal.discard()
 
     def __truediv__(self, other):
+        self._check_file(other)
+        if self._register(other):
+            self._log([other])
+        return super().__truediv__(other)
+
+    def register_many(self, paths: Iterable[str]) -> List[S]:
+        """
+        Registers files as `/` does, in bulk: each directory gets its files at once
+        and the journal is written once
+
+        :param paths: file paths relative to the container
+        :return: the absolute paths
+        """
+        paths = list(paths)
+        for x in paths:
+            self._check_file(x)
+        self._log(self._register_many(paths))
+        return [self.path(x) for x in paths]
+
+    @staticmethod
+    def _check_file(other: str):
         ds = other.split(os.path.sep)
         if len(ds) == 1 and os.path.splitext(ds[0])[1] == "":
             raise RuntimeError(
                 "You cannot use '/' for directories in containers, use sep in strings: out / 'smth/fname.p'"
             )
-        else:
-            aze = os.path.splitext(ds[-1])[0]
-            if hasattr(self, aze) and getattr(self, aze) == self.path(other):
-                return super().__truediv__(other)
-            o = self
-            for x in ds[:-1]:
-                o = o.dir(x)
-            o.dump()
-            # self.infos[ds[-1]] = other
-            o.file(ds[-1])
-        return super().__truediv__(other)
+
+    def _register(self, other: str) -> bool:
+        """
+        Registers a file path relative to the container, and creates its directory
+
+        :return: False if already registered
+        """
+        dirname, name = os.path.split(other)
+        o = self._dir_node(dirname)
+        if o.files.get(os.path.splitext(name)[0]) == name:
+            return False
+        self._makedirs(o)
+        o.file(name)
+        return True
+
+    def unregister(self, *others: str) -> int:
+        """
+        Removes files from the container, the files themselves are left untouched
+
+        :param others: file paths relative to the container
+        :return: number of files removed
+        """
+        removed = self._unregister(others)
+        self._log(removed, kind="r")
+        return len(removed)
+
+    def _unregister(self, paths: Iterable[str]) -> List[str]:
+        removed = []
+        for x in paths:
+            dirname, name = os.path.split(x)
+            o = self._dir_node(dirname, create=False)
+            alias = os.path.splitext(name)[0]
+            if o is not None and o.files.get(alias) == name:
+                # Aliases indexed for this file are dropped on lookup
+                o._before_change()
+                del o.files[alias]
+                removed.append(x)
+        return removed
+
+    def _apply(self, records: Iterable[Tuple[str, str]]):
+        """
+        Applies journal records in order: "f" registers a file, "r" removes it
+        """
+        for kind, group in groupby(records, key=itemgetter(0)):
+            paths = [path for _, path in group]
+            if kind == "r":
+                self._unregister(paths)
+            else:
+                self._register_many(paths)
+
+    def _register_many(self, paths: List[str]) -> List[str]:
+        """
+        Registers file paths relative to the container, directory by directory
+
+        :return: the paths not registered already
+        """
+        groups = {}
+        for x in paths:
+            dirname, name = os.path.split(x)
+            groups.setdefault(dirname, []).append(name)
+        new = []
+        for dirname, names in groups.items():
+            o = self._dir_node(dirname)
+            files = o.files
+            names = [
+                x
+                for x in dict.fromkeys(names)
+                if files.get(os.path.splitext(x)[0]) != x
+            ]
+            if names:
+                self._makedirs(o)
+                o.file(*names)
+                new.extend(os.path.join(dirname, x) for x in names)
+        return new
+
+    def _dir_node(self, dirname: str, create: bool = True) -> Optional[T]:
+        """
+        Directory of the tree at a path relative to the container, added if missing.
+        Nodes are cached by path, as long as they are in the tree.
+
+        :param create: add missing directories, None is returned otherwise
+        :raises RuntimeError: for absolute paths and paths leaving the container
+        """
+        if self._nodes is None:
+            self._nodes = {"": self}
+        o = self._nodes.get(dirname)
+        if o is not None and self._in_tree(o):
+            return o
+
+        names = [x for x in dirname.split(os.sep) if x not in ("", ".")]
+        if os.path.isabs(dirname) or ".." in names:
+            raise RuntimeError(
+                f"Paths in containers are relative to the container, got {dirname!r}"
+            )
+        o, path = self, ""
+        for name in names:
+            path = os.path.join(path, name)
+            d = self._nodes.get(path)
+            if d is None or d._parent is not o or d.__dict__.get("_detached"):
+                # Reuse the directory if registered already
+                d = next((d for d in reversed(o.dirs) if d.root == name), None)
+                if d is None:
+                    if not create:
+                        return
+                    d = o.dir(name)
+                self._nodes[path] = d
+            o = d
+        self._nodes[dirname] = o
+        return o
+
+    def _in_tree(self, o: T) -> bool:
+        """
+        Whether a node is still reached from the container, not removed or replaced
+        """
+        while o is not self:
+            if o.__dict__.get("_detached") or o._parent is None:
+                return False
+            o = o._parent
+        return True
+
+    def _makedirs(self, o: T):
+        """
+        Creates a directory once per container, removing it with anything else
+        than `dump(clean=True)`, `refresh` or `remove_empty` is not noticed
+        """
+        if self._made is None:
+            self._made = set()
+        path = o.abs()
+        if path not in self._made:
+            os.makedirs(path, exist_ok=True)
+            self._made.add(path)
+
+    def _log(self, paths: List[str], kind: str = "f"):
+        """
+        Appends registered (or removed, with kind "r") paths, relative to the
+        container, to the journal of its root
+        """
+        top = self
+        while top.parent is not None:
+            top = top.parent
+        journal = top._journal
+        if journal is None or not paths:
+            return
+        if top is not self or journal.root != top.abs():
+            base = self.abs()
+            paths = [
+                os.path.relpath(os.path.join(base, x), journal.root) for x in paths
+            ]
+        journal.extend(kind, paths)
+        if journal.count >= top.compact_every and not journal.is_shard:
+            top.compact()
+
+    def dump(self, clean: bool = False, workers: int = None) -> T:
+        """
+        Creates the directories of the container. `clean` leaves the journal in
+        place, its writers keeping it open.
+        """
+        if not clean:
+            return super().dump(workers=workers)
+        from treefiles.tree_fs import dump
+        from treefiles.tree_journal import is_journal_file
+
+        self._made = None
+        journal = self.path("infos.journal")
+        dump(self, True, workers, keep=lambda x: is_journal_file(x, journal))
+        return self
+
+    def remove_empty(self):
+        self._made = None
+        super().remove_empty()
+
+    def refresh(self, snapshot=None):
+        # Removed directories are dropped from the tree
+        self._nodes = self._made = None
+        return super().refresh(snapshot)
 
     def __enter__(self):
         return self
@@ -466,7 +1431,137 @@ class Container(Tree):
         self.save()
 
     def save(self):
-        self.to_file("infos")
+        """
+        Writes the manifests and releases the journal, see `compact`
+        """
+        journal = self._journal
+        if journal is not None:
+            self.compact()
+            if journal.is_shard:
+                return  # manifests are written by the owner
+        else:
+            self.to_file("infos")
+        if self._snapshot is not None:
+            self._snapshot.to_file(self.path("infos.snapshot"))
+        if journal is not None:
+            journal.close()
+
+    def compact(self):
+        """
+        Rewrites `infos.tree` atomically with the registered files, the shards
+        merged, then empties the journal. A process not owning the journal takes it
+        over if it was released, or only syncs its shard.
+        """
+        from treefiles.tree_journal import write_atomic
+
+        if self._journal.is_shard:
+            if not self._journal.take_over():
+                self._journal.flush()
+                return
+            self._reload()
+        self.merge()
+        write_atomic(self, self.path("infos.tree"))
+        self._journal.reset()
+
+    def _reload(self):
+        """
+        Registers the files saved by the previous owners of the journal since the
+        container was opened, from `infos.tree` and the journal
+        """
+        fname = self.path("infos.tree")
+        if os.path.isfile(fname):
+            saved = Tree.from_file(fname, ensure_ext=False)
+            base = saved.abs()
+            self._register_many([os.path.relpath(x, base) for x in saved.iter_files()])
+        self._apply(self._journal.replay())
+
+    def merge(self) -> int:
+        """
+        Registers the files logged to the shards of the journal by other processes,
+        e.g. once the workers of a pool are done
+
+        :return: number of records merged
+        """
+        records = self._journal.merge()
+        self._apply(records)
+        return len(records)
+
+    def __getstate__(self):
+        """
+        Pickles a container with the journal of its root, the process unpickling it
+        logging to a shard
+        """
+        state = super().__getstate__()
+        top = self
+        while top.parent is not None:
+            top = top.parent
+        state["journal"] = top._journal
+        state["store"] = top._store
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._journal = state.get("journal")
+        self._store = state.get("store")
+
+    def put(self, src: str, other: str) -> S:
+        """
+        Registers a file as `/` does, linked to the stored copy of `src`, see
+        `BlobStore.put`
+
+        :return: the path of the file
+        """
+        path = self / other
+        self._blob_store().put(src, path)
+        return path
+
+    def dedup(self, *paths: str) -> int:
+        """
+        Replaces files written in the container by links to the store, see
+        `BlobStore.dedup`
+
+        :param paths: file paths relative to the container, or absolute. All the
+            registered files not linked already by default.
+        :return: number of files whose content was stored already
+        """
+        store = self._blob_store()
+        if paths:
+            paths = [self.path(x) for x in paths]
+        else:
+            paths = []
+            for x in self.iter_files():
+                try:
+                    st = os.lstat(x)
+                except FileNotFoundError:
+                    continue
+                if stat.S_ISREG(st.st_mode) and st.st_nlink == 1:
+                    paths.append(x)
+        return sum(store.dedup(x) for x in paths)
+
+    def _blob_store(self):
+        top = self
+        while top.parent is not None:
+            top = top.parent
+        if top._store is None:
+            raise RuntimeError(f"No blob store given to the container {top.abs()}")
+        return top._store
+
+    def snapshot(self, ignore=()):
+        """
+        Records the stats of the container, its manifests left out, see `Tree.refresh`.
+        The snapshot is saved next to `infos.tree`.
+        """
+        from treefiles.tree_journal import SHARDS
+
+        manifests = {
+            "infos.tree",
+            "infos.snapshot",
+            "infos.journal",
+            "infos.journal.lock",
+            "infos.journal" + SHARDS,
+            "infos.tree.tmp",
+        }
+        return super().snapshot(ignore={*manifests, *ignore})
 
 
 @dataclass
@@ -480,6 +1575,43 @@ class StrReResult:
         return Str(self.preffix + self.match + self.suffix) / other
 
 
+@dataclass
+class StrReResults:
+    """
+    Results of `Str.re_many` as columns, one row per path. Rows of the paths not
+    matching have `found` False, `idx` -1 and None strings.
+    """
+
+    found: "np.ndarray"  # bool
+    idx: "np.ndarray"  # int64
+    preffix: "np.ndarray"  # object
+    match: "np.ndarray"  # object
+    suffix: "np.ndarray"  # object
+
+    def __len__(self) -> int:
+        return len(self.idx)
+
+    def __getitem__(self, i: int) -> Optional[StrReResult]:
+        """
+        Row of a path, as `Str.re` returns it
+        """
+        if self.found[i]:
+            idx = int(self.idx[i])
+            return StrReResult(idx, self.preffix[i], self.match[i], self.suffix[i])
+
+
+@lru_cache(maxsize=256)
+def _re_pattern(pat: str, lines: bool = False) -> re.Pattern:
+    """
+    Compiled pattern of `Str.re`
+
+    :param lines: match every line of a text, lines not matching giving empty groups
+    """
+    if lines:
+        return re.compile(rf"^(?:(.*){pat}_(\d+)(.*)|.*)$", re.MULTILINE)
+    return re.compile(rf"(.+)?{pat}_(\d+)(.+)?")
+
+
 class Str(str):
     def __new__(cls, value):
         if isinstance(value, Tree):
@@ -517,11 +1649,51 @@ class Str(str):
     def glob(self, pattern: str) -> List[S]:
         return Tree(self).glob(pattern)
 
+    def iglob(self, pattern: str, sort: bool = False) -> Iterator[S]:
+        return Tree(self).iglob(pattern, sort=sort)
+
+    def frame_index(self, pat: str = "frame", pattern: str = None):
+        return Tree(self).frame_index(pat, pattern)
+
     def dump(self) -> Tree:
         return Tree(self).dump()
 
     def re(self, pat) -> StrReResult:
-        m = re.search(rf"(.+)?{pat}_(\d+)(.+)?", self)
+        m = _re_pattern(pat).search(self)
         if m:
             a, b, c = m[1], f"{pat}_{m[2]}", m[3]
             return StrReResult(int(m[2]), a, b, c)
+
+    @staticmethod
+    def re_many(paths: Iterable[str], pat: str) -> StrReResults:
+        """
+        `re` over many paths, the pattern being compiled once and the paths matched
+        in a single pass
+
+        :return: columns of the results, see `StrReResults`
+        """
+        import numpy as np
+
+        paths = list(paths)
+        text = "\n".join(paths)
+        if paths and text.count("\n") == len(paths) - 1:
+            # One pass over all paths, groups `re` leaves to None are empty
+            groups = _re_pattern(pat, lines=True).findall(text)
+        else:
+            search, none = _re_pattern(pat).search, ("", "", "")
+            groups = [m.groups() if m else none for m in map(search, paths)]
+        a, digits, c = (list(map(itemgetter(i), groups)) for i in range(3))
+
+        def column(x):
+            col = np.empty(len(x), dtype=object)
+            col[:] = x
+            return col
+
+        idx = np.array(list(map(int, [x or "-1" for x in digits])), np.int64)
+        found = idx >= 0
+        a, c = [x or None for x in a], [x or None for x in c]
+        match = [f"{pat}_{x}" if x else None for x in digits]
+        return StrReResults(found, idx, column(a), column(match), column(c))
+
+
+log = logging.getLogger(__name__)
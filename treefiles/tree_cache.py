@@ -0,0 +1,387 @@
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Union
+
+from treefiles.commons import (
+    dump_json,
+    dump_pickle,
+    dump_str,
+    get_timestamp,
+    load_json,
+    load_pickle,
+    load_str,
+)
+from treefiles.tree import Container, Tree
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from treefiles.baseio_.baseio_ import BaseIO
+except ImportError:
+    BaseIO = None
+
+
+def cached(
+    container: Union[Container, str],
+    key: Union[Callable, Iterable[str]] = None,
+    name: str = None,
+    version: str = None,
+    max_entries: int = None,
+    max_bytes: int = None,
+):
+    """
+    Stores the results of a function in a container, and loads them instead of
+    calling the function again with the same arguments
+
+    .. code-block:: python
+
+        @tf.cached(tf.Container("out/cache"), key=["mesh", "params"], max_bytes=10**10)
+        def simulate(mesh, params, verbose=False):
+            ...
+
+    Arguments are hashed with `hash_args`, defaults included. Results are saved in
+    `<container>/<name>/<hash>.<ext>`: NumPy arrays as `.npy`, strings as `.txt`,
+    JSON values as `.json`, anything else pickled. Each result is registered in the
+    container along with `<hash>.prov.json`, its provenance (function, arguments,
+    time and duration of the call), so that `infos.tree` lists them. Results are
+    evicted least recently used first beyond `max_entries` results or `max_bytes`.
+    The cache is reachable as `func.cache`.
+
+    :param container: the container or its directory, opened on first call
+    :param key: names of the arguments to hash, or a function of the arguments
+        returning the values to hash. All arguments by default.
+    :param name: directory of the results, the function name by default
+    :param version: changed when the function changes, to drop previous results
+    :param max_entries: results kept
+    :param max_bytes: total size of the results kept
+    """
+
+    def decorator(func):
+        sig = inspect.signature(func)
+        fname = f"{func.__module__}.{func.__qualname__}"
+        cache = Cache(
+            container,
+            name or func.__name__,
+            max_entries,
+            max_bytes,
+        )
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            if key is None:
+                values = bound.arguments
+            elif callable(key):
+                values = key(*args, **kwargs)
+            else:
+                values = {x: bound.arguments[x] for x in key}
+            digest = hash_args(fname, version, values)
+
+            value = cache.get(digest)
+            if value is not _MISS:
+                return value
+            t0 = time.perf_counter()
+            value = func(*args, **kwargs)
+            provenance = dict(
+                function=fname,
+                version=version,
+                arguments={k: _describe(v) for k, v in bound.arguments.items()},
+                created=get_timestamp("%Y-%m-%d %H:%M:%S"),
+                duration=time.perf_counter() - t0,
+            )
+            cache.put(digest, value, provenance)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+class Cache:
+    """
+    Results of a function stored in a directory of a container, see `cached`
+
+    Results are indexed by hash in memory, least recently used first, the
+    directory being listed on first use. A result missing from the index is looked
+    for on disk, in case another process stored it. A hit touches the result, the
+    order of the results surviving in their mtimes.
+
+    :param container: the container or its directory
+    :param name: directory of the results in the container
+    :param max_entries: results kept
+    :param max_bytes: total size of the results kept
+    """
+
+    def __init__(
+        self,
+        container: Union[Container, str],
+        name: str,
+        max_entries: int = None,
+        max_bytes: int = None,
+    ):
+        self._container = container
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0  # bytes of the results
+        self._entries = None  # hash: (file name, size)
+
+    @property
+    def container(self) -> Container:
+        if not isinstance(self._container, Container):
+            # Caches given the same directory share their container
+            path = os.path.abspath(self._container)
+            if path not in _containers:
+                _containers[path] = Container(path)
+            self._container = _containers[path]
+        return self._container
+
+    def _scan(self):
+        entries = []
+        path = self.container.path(self.name)
+        if os.path.isdir(path):
+            with os.scandir(path) as it:
+                for x in it:
+                    digest, _, ext = x.name.partition(".")
+                    if ext in _FORMATS and x.is_file():
+                        st = x.stat()
+                        entries.append((st.st_mtime_ns, digest, x.name, st.st_size))
+        entries.sort()
+        self._entries = OrderedDict((x[1], x[2:]) for x in entries)
+        self.size = sum(x[3] for x in entries)
+
+    def get(self, digest: str) -> Any:
+        """
+        Result stored for a hash, `_MISS` if there is none
+        """
+        if self._entries is None:
+            self._scan()
+        entry = self._entries.get(digest)
+        if entry is None:
+            entry = self._find(digest)
+        if entry is not None:
+            fname = self.container.path(self.name, entry[0])
+            try:
+                value = _FORMATS[entry[0].partition(".")[2]][1](fname)
+                os.utime(fname)
+            except FileNotFoundError:  # evicted by another process
+                self._pop(digest)
+            else:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return _MISS
+
+    def _find(self, digest: str):
+        """
+        Indexes the result of a hash stored meanwhile by another process
+        """
+        for ext in _FORMATS:
+            fname = f"{digest}.{ext}"
+            try:
+                size = os.path.getsize(self.container.path(self.name, fname))
+            except FileNotFoundError:
+                continue
+            self._entries[digest] = fname, size
+            self.size += size
+            return fname, size
+
+    def put(self, digest: str, value: Any, provenance: dict):
+        """
+        Stores a result and its provenance, then evicts the least recently used
+        results beyond the limits
+        """
+        if self._entries is None:
+            self._scan()
+        ext = _format(value)
+        ct = self.container
+        path = ct / f"{self.name}/{digest}.{ext}"
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        _FORMATS[ext][0](tmp, value)
+        os.replace(tmp, path)  # readers never see a partial result
+        size = os.path.getsize(path)
+        dump_json(
+            ct / f"{self.name}/{digest}.prov.json",
+            dict(provenance, format=ext, size=size),
+            force_ext=False,
+        )
+        self._pop(digest)
+        self._entries[digest] = f"{digest}.{ext}", size
+        self.size += size
+        self.evict()
+
+    def _pop(self, digest: str):
+        entry = self._entries.pop(digest, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def evict(self):
+        """
+        Removes the least recently used results beyond the limits, the last one
+        being always kept
+        """
+        if self._entries is None:
+            self._scan()
+        removed = []
+        while len(self._entries) > 1 and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self.size > self.max_bytes)
+        ):
+            digest, (fname, size) = self._entries.popitem(last=False)
+            self.size -= size
+            removed.extend([fname, f"{digest}.prov.json"])
+        self._remove(removed)
+
+    def clear(self):
+        """
+        Removes all the results
+        """
+        if self._entries is None:
+            self._scan()
+        removed = []
+        for digest, (fname, _) in self._entries.items():
+            removed.extend([fname, f"{digest}.prov.json"])
+        self._entries.clear()
+        self.size = 0
+        self._remove(removed)
+
+    def _remove(self, fnames):
+        if not fnames:
+            return
+        for x in fnames:
+            try:
+                os.remove(self.container.path(self.name, x))
+            except FileNotFoundError:
+                pass
+        self.container.unregister(*[f"{self.name}/{x}" for x in fnames])
+        log.debug(f"Evicted {len(fnames) // 2} results from {self.name}")
+
+    def __len__(self) -> int:
+        if self._entries is None:
+            self._scan()
+        return len(self._entries)
+
+    def __repr__(self):
+        return (
+            f"<{type(self).__name__} {self.container.path(self.name)}: "
+            f"{self.hits} hits, {self.misses} misses>"
+        )
+
+
+def hash_args(*values) -> str:
+    """
+    Hash of values, stable across processes and runs
+
+    Containers are hashed item by item, dicts whatever their order, NumPy arrays by
+    dtype, shape and data, `BaseIO` values (e.g. `Param`) by their registered
+    attributes and trees by their paths and files. String subclasses (`Str`) and
+    path objects hash as plain strings. Other values are pickled.
+    """
+    h = hashlib.sha256()
+    _feed(h, values)
+    return h.hexdigest()
+
+
+def _feed(h, x):
+    if isinstance(x, os.PathLike):
+        x = os.fspath(x)  # same hash as the path string
+    if x is None or isinstance(x, (bool, int, float, complex)):
+        h.update(f"{type(x).__name__}:{x!r};".encode())
+    elif isinstance(x, (str, bytes)):
+        # Subclasses such as `Str` hash as their value
+        b = x.encode() if isinstance(x, str) else bytes(x)
+        h.update(f"{'str' if isinstance(x, str) else 'bytes'}:{len(b)}:".encode())
+        h.update(b)
+    elif np is not None and isinstance(x, (np.ndarray, np.generic)):
+        h.update(f"ndarray:{x.dtype.str}:{x.shape}:".encode())
+        if x.dtype.hasobject:
+            _feed(h, x.tolist())
+        else:
+            h.update(np.ascontiguousarray(x).data)
+    elif BaseIO is not None and isinstance(x, BaseIO):
+        h.update(f"{type(x).__qualname__}:".encode())
+        _feed(h, x.to_dict())
+    elif isinstance(x, Tree):
+        h.update(b"Tree:")
+        _feed(h, (x.abs(), x.to_dict()))
+    elif isinstance(x, dict):
+        h.update(f"{type(x).__qualname__}:{len(x)}:".encode())
+        for k in sorted(x, key=_sort_key):
+            _feed(h, k)
+            _feed(h, x[k])
+    elif isinstance(x, (list, tuple)):
+        h.update(f"{type(x).__qualname__}:{len(x)}:".encode())
+        for y in x:
+            _feed(h, y)
+    elif isinstance(x, (set, frozenset)):
+        h.update(f"{type(x).__qualname__}:".encode())
+        _feed(h, sorted(hash_args(y) for y in x))
+    else:
+        h.update(f"pickle:{type(x).__qualname__}:".encode())
+        h.update(pickle.dumps(x, protocol=4))
+
+
+def _sort_key(x) -> str:
+    return repr(os.fspath(x) if isinstance(x, os.PathLike) else x)
+
+
+def _describe(x) -> str:
+    """
+    Short description of an argument, for the provenance
+    """
+    if np is not None and isinstance(x, np.ndarray):
+        return f"ndarray{x.shape} {x.dtype}"
+    r = repr(x)
+    return r if len(r) <= 200 else r[:197] + "..."
+
+
+def _format(value) -> str:
+    if np is not None and isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        return "npy"
+    if type(value) is str:
+        return "txt"
+    if type(value) in (dict, list, int, float, bool, type(None)):
+        try:
+            if json.loads(json.dumps(value)) == value:
+                return "json"
+        except (TypeError, ValueError):
+            pass
+    return "pkl"
+
+
+def _dump_npy(fname: str, value):
+    with open(fname, "wb") as f:
+        np.save(f, value)
+
+
+# Dump and load of the results by extension
+_FORMATS = {
+    "npy": (_dump_npy, lambda f: np.load(f)),
+    "txt": (dump_str, load_str),
+    "json": (
+        lambda f, x: dump_json(f, x, force_ext=False),
+        lambda f: load_json(f, force_ext=False),
+    ),
+    "pkl": (dump_pickle, load_pickle),
+}
+_MISS = object()
+# Containers opened by the caches given a directory, by path
+_containers = {}
+
+log = logging.getLogger(__name__)
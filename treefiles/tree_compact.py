@@ -0,0 +1,345 @@
+import logging
+import os
+from array import array
+from typing import List, Optional, Union
+
+from treefiles.tree import Tree, Str, S, T
+
+
+class _Store:
+    """
+    Flat tables describing a whole tree
+
+    Nodes are numbered in breadth-first order, so that the children of a node
+    (dirs, then named dirs) and its files are contiguous ranges. Names and aliases
+    are ids into a pool of unique strings, an alias of -1 stands for a plain dir
+    or for a file whose alias is derived from its name, as in `Tree.file`.
+    """
+
+    __slots__ = (
+        "pool",
+        "root_abs",
+        "parent",
+        "name",
+        "alias",
+        "first_child",
+        "n_children",
+        "first_file",
+        "n_files",
+        "file_alias",
+        "file_name",
+        "indexes",
+    )
+
+    def __init__(self):
+        self.pool: List[str] = []
+        self.root_abs: str = ""
+        self.parent = array("i")
+        self.name = array("i")
+        self.alias = array("i")
+        self.first_child = array("i")
+        self.n_children = array("i")
+        self.first_file = array("i")
+        self.n_files = array("i")
+        self.file_alias = array("i")
+        self.file_name = array("i")
+        self.indexes = {}
+
+
+class CompactTree:
+    """
+    Read-only, memory efficient copy of a `Tree`
+
+    Build it with `CompactTree.from_tree(tree)` or `tree.compact()`. Each instance
+    is a view on one node of the shared tables, it exposes the read API of `Tree`:
+    `abs`, `path`, attribute lookup, `get_files`, `get_file_keys`, `pprint` and
+    `to_dict`. Use `to_tree` to get back a mutable `Tree`.
+    """
+
+    __slots__ = ("_store", "_idx")
+
+    def __init__(self, store: _Store, idx: int = 0):
+        self._store = store
+        self._idx = idx
+
+    @classmethod
+    def from_tree(cls, tree: T) -> "CompactTree":
+        st, ids = _Store(), {}
+
+        def intern(x) -> int:
+            x = str(x)
+            i = ids.get(x)
+            if i is None:
+                i = ids[x] = len(st.pool)
+                st.pool.append(x)
+            return i
+
+        st.root_abs = str(tree.abs())
+        queue, k = [(tree, -1, None)], 0
+        while k < len(queue):
+            node, parent, alias = queue[k]
+            queue[k] = None
+            st.parent.append(parent)
+            st.name.append(intern(node.root))
+            st.alias.append(-1 if alias is None else intern(alias))
+            st.first_child.append(len(queue))
+            st.n_children.append(len(node.dirs) + len(node.ndirs))
+            queue.extend((d, k, None) for d in node.dirs)
+            queue.extend((d, k, al) for al, d in node.ndirs.items())
+            st.first_file.append(len(st.file_name))
+            st.n_files.append(len(node.files))
+            for al, f in node.files.items():
+                if f is None:
+                    st.file_alias.append(intern(al))
+                    st.file_name.append(-1)
+                    continue
+                derived = os.path.splitext(f)[0] == al
+                st.file_alias.append(-1 if derived else intern(al))
+                st.file_name.append(intern(f))
+            k += 1
+        return cls(st)
+
+    def to_tree(self, cls=Tree) -> T:
+        """
+        Returns a mutable copy of the current node and its children
+        """
+        st = self._store
+        top = cls(self.abs())
+        trees = {self._idx: top}
+        for i in self._subtree():
+            t = trees[i]
+            t.file(**self._node_files(i))
+            for c in self._children(i):
+                name, al = st.pool[st.name[c]], st.alias[c]
+                if al < 0:
+                    trees[c] = t.dir(name)
+                else:
+                    trees[c] = t.dir(**{st.pool[al]: name})
+        return top
+
+    # Tables access
+
+    def _children(self, i: int) -> range:
+        st = self._store
+        return range(st.first_child[i], st.first_child[i] + st.n_children[i])
+
+    def _file_items(self, i: int):
+        """Yields `(alias, filename)` of node i, filename is None if not set"""
+        st = self._store
+        pool = st.pool
+        for j in range(st.first_file[i], st.first_file[i] + st.n_files[i]):
+            f = st.file_name[j]
+            name = None if f < 0 else pool[f]
+            al = st.file_alias[j]
+            yield (os.path.splitext(name)[0] if al < 0 else pool[al]), name
+
+    def _node_files(self, i: int) -> dict:
+        return dict(self._file_items(i))
+
+    def _subtree(self):
+        """Node ids of the current subtree, parents first"""
+        stack = [self._idx]
+        while stack:
+            i = stack.pop()
+            yield i
+            stack.extend(reversed(self._children(i)))
+
+    def _abs(self, i: int) -> str:
+        st, names = self._store, []
+        while i > 0:
+            names.append(st.pool[st.name[i]])
+            i = st.parent[i]
+        return os.path.join(st.root_abs, *reversed(names))
+
+    # Tree read API
+
+    @property
+    def root(self) -> S:
+        return Str(self._store.pool[self._store.name[self._idx]])
+
+    @property
+    def parent(self) -> Optional["CompactTree"]:
+        p = self._store.parent[self._idx]
+        return None if p < 0 else CompactTree(self._store, p)
+
+    @property
+    def dirs(self) -> List["CompactTree"]:
+        st = self._store
+        return [
+            CompactTree(st, c) for c in self._children(self._idx) if st.alias[c] < 0
+        ]
+
+    @property
+    def ndirs(self) -> dict:
+        st = self._store
+        return {
+            st.pool[st.alias[c]]: CompactTree(st, c)
+            for c in self._children(self._idx)
+            if st.alias[c] >= 0
+        }
+
+    @property
+    def files(self) -> dict:
+        return self._node_files(self._idx)
+
+    def abs(self) -> S:
+        return Str(self._abs(self._idx))
+
+    def path(self, *args: str) -> S:
+        return Str(os.path.join(self._abs(self._idx), *args))
+
+    def __truediv__(self, other):
+        return self.path(other)
+
+    def __len__(self):
+        """Number of dirs of the subtree, including the current one"""
+        return sum(1 for _ in self._subtree())
+
+    def __getattr__(self, att) -> Optional[Union[S, "CompactTree"]]:
+        """
+        Finds an attribute, with the same order of preferences as `Tree.__getattr__`
+        """
+        if att.startswith("__") or att in CompactTree.__slots__:
+            raise AttributeError(att)
+        st = self._store
+        index = st.indexes.get(self._idx)
+        if index is None:
+            index = st.indexes[self._idx] = self._build_alias_index()
+        entry = index.get(att)
+        if entry is not None:
+            i, fname = entry
+            if fname is None:
+                return CompactTree(st, i)
+            if fname is _NONE:
+                return
+            return Str(os.path.join(self._abs(i), fname))
+        if self._idx == 0:
+            raise AttributeError(f"Attribute {att!r} not found in {self.root}")
+
+    def _build_alias_index(self) -> dict:
+        """
+        Maps aliases to `(node, filename)`, filename is None for dirs
+        """
+        st = self._store
+        index = {
+            al: (self._idx, _NONE if f is None else f)
+            for al, f in self._file_items(self._idx)
+        }
+        stack = [(self._idx, frozenset())]
+        while stack:
+            i, hidden = stack.pop()
+            if isinstance(i, list):
+                for c in i:
+                    al = st.pool[st.alias[c]]
+                    if al not in hidden:
+                        index.setdefault(al, (c, None))
+                continue
+            children = self._children(i)
+            named = [c for c in children if st.alias[c] >= 0]
+            plain = [c for c in children if st.alias[c] < 0]
+            if i != self._idx:
+                files = list(self._file_items(i))
+                nones = [al for al, f in files if f is None]
+                if nones:
+                    hidden = hidden.union(nones)
+                for al, f in files:
+                    if f is not None and al not in hidden:
+                        index.setdefault(al, (i, f))
+            for c in plain:
+                name = st.pool[st.name[c]]
+                if name not in hidden:
+                    index.setdefault(name, (c, None))
+            stack.extend((c, hidden) for c in reversed(named))
+            stack.append((named, hidden))
+            stack.extend((c, hidden) for c in reversed(plain))
+        return index
+
+    def get_files(self) -> List[str]:
+        """
+        Get a list of all files in the tree, in the order of `Tree.get_files`,
+        files set to None left out
+        """
+        all_files = []
+        stack = [(self._idx, self._abs(self._idx))]
+        st = self._store
+        while stack:
+            i, path = stack.pop()
+            all_files.extend(
+                Str(os.path.join(path, f))
+                for _, f in self._file_items(i)
+                if f is not None
+            )
+            stack.extend(
+                (c, os.path.join(path, st.pool[st.name[c]]))
+                for c in reversed(self._children(i))
+            )
+        return all_files
+
+    def get_file_keys(self) -> List[str]:
+        """
+        Get a list of all file keys in the tree
+        """
+        return [al for i in self._subtree() for al, _ in self._file_items(i)]
+
+    def to_dict(self) -> dict:
+        st = self._store
+        nodes = list(self._subtree())
+        dicts = {}
+        # Children come after their parent in breadth-first order
+        for i in sorted(nodes, reverse=True):
+            children = self._children(i)
+            dicts[i] = dict(
+                name=st.pool[st.name[i]],
+                dirs=[dicts.pop(c) for c in children if st.alias[c] < 0],
+                ndirs={
+                    st.pool[st.alias[c]]: dicts.pop(c)
+                    for c in children
+                    if st.alias[c] >= 0
+                },
+                files=self._node_files(i),
+            )
+        return dicts[self._idx]
+
+    def pprint(self, *, comment=None, oie: bool = False) -> str:
+        """
+        Export the current tree with the `tree` format, see `Tree.pprint`
+
+        comment: File header
+        oie: only_if_exists
+        """
+        st, lines = self._store, []
+        if comment:
+            lines.extend(f"# {x}" for x in comment.split("\n"))
+        lines.append(f". {self.root}")
+        stack = [(self._idx, self._abs(self._idx), 2)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                lines.append(item)
+                continue
+            i, path, k = item
+            todo = []
+            for c in self._children(i):
+                name = st.pool[st.name[c]]
+                c_path = os.path.join(path, name)
+                if oie and not os.path.isdir(c_path):
+                    continue
+                if st.alias[c] >= 0:
+                    name = f"{st.pool[st.alias[c]]}: {name}"
+                todo.append(f"{' ' * k}. {name}")
+                todo.append((c, c_path, k + 2))
+            for al, f in self._file_items(i):
+                if not oie or os.path.isfile(os.path.join(path, f)):
+                    todo.append(f"{' ' * k}- {al}: {f}")
+            stack.extend(reversed(todo))
+        return "\n".join(lines).strip()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.abs()}: {len(self)} dirs>"
+
+
+# Marks an alias registered with no filename
+_NONE = object()
+
+
+log = logging.getLogger(__name__)
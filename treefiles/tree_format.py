@@ -1,8 +1,10 @@
+import hashlib
 import logging
+import marshal
 import os
 import re
 from dataclasses import dataclass
-from typing import List
+from typing import List, Dict, Optional, Tuple, Union, Iterator
 
 
 @dataclass
@@ -15,11 +17,11 @@ class Line:
     parent_line: int = None
 
     def callback(self, parent):
-        m = getattr(parent, self.entry_type)
+        add = parent.dir if self.entry_type == "dir" else parent.file
         if self.name:
-            return m(**{self.name: self.value})
+            return add(**{self.name: self.value})
         else:
-            return m(self.value)
+            return add(self.value)
 
     def __repr__(self):
         s = f"[{self.name}]" if self.name else ""
@@ -29,6 +31,115 @@ class Line:
         )
 
 
+_ENV_VAR = re.compile(r"\${(\w+)}")
+_ENTRY_TYPES = {".": "dir", "-": "file"}
+
+
+def _env_value(m) -> str:
+    return os.environ.get(m.group(1), f"{m.group(1)!r}NotFound")
+
+
+class IncludeCycleError(RuntimeError):
+    """
+    A `.tree` file includes itself, directly or through other files
+    """
+
+
+@dataclass
+class _Include:
+    lines: List[Line]
+    deps: Dict[str, Tuple[int, int]]  # stats of the file and of its includes
+    env: Dict[str, Optional[str]]  # values of the variables they reference
+
+    def is_valid(self) -> bool:
+        try:
+            if any(_stat_key(p) != tuple(k) for p, k in self.deps.items()):
+                return False
+        except OSError:
+            return False
+        return all(os.environ.get(k) == v for k, v in self.env.items())
+
+
+def _stat_key(fname: str) -> Tuple[int, int]:
+    st = os.stat(fname)
+    return st.st_mtime_ns, st.st_size
+
+
+class IncludeCache:
+    """
+    Parsed `.tree` files included with `<`, by resolved path
+
+    An entry is reused as long as the file, the files it includes and the
+    environment variables they reference are unchanged. Keep an instance to reuse
+    entries across loads.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, _Include] = {}
+        self.parsed = 0  # files parsed
+        self.reused = 0  # includes resolved from the cache
+        self._stack: List[Tuple[str, _Include]] = []  # files being parsed
+
+    def parse(self, lines, fname: str = None) -> List[Line]:
+        """
+        Parses the lines of a `.tree` file, includes are resolved with the cache
+        """
+        if fname is None:
+            return parse_lines(lines, dirname="", cache=self)
+        self._stack.append((os.path.realpath(fname), _Include([], {}, {})))
+        try:
+            return parse_lines(lines, dirname=os.path.dirname(fname), cache=self)
+        finally:
+            self._stack.pop()
+
+    def include(self, value: str, dirname: str = None) -> List[Line]:
+        """
+        Returns the parsed lines of an included file, shared with the cache
+        """
+        return self.entry(tree_fname(value, dirname=dirname)).lines
+
+    def entry(self, fname: str) -> _Include:
+        """
+        Returns the parsed file, with the files and variables it depends on
+        """
+        fname = os.path.realpath(fname)
+        names = [x for x, _ in self._stack]
+        if fname in names:
+            chain = " -> ".join(names[names.index(fname) :] + [fname])
+            raise IncludeCycleError(f"Include cycle: {chain}")
+
+        entry = self.entries.get(fname)
+        if entry is not None and entry.is_valid():
+            self.reused += 1
+        else:
+            entry = self._parse(fname)
+        for _, parent in self._stack:
+            parent.deps.update(entry.deps)
+            parent.env.update(entry.env)
+        return entry
+
+    def _parse(self, fname: str) -> _Include:
+        key = _stat_key(fname)
+        with open(fname) as f:
+            lines = f.readlines()
+        self.parsed += 1
+        names = set(_ENV_VAR.findall("".join(lines)))
+        entry = _Include([], {fname: key}, {k: os.environ.get(k) for k in names})
+        self._stack.append((fname, entry))
+        try:
+            entry.lines = parse_lines(lines, os.path.dirname(fname), cache=self)
+        finally:
+            self._stack.pop()
+        self.entries[fname] = entry
+        return entry
+
+    def __repr__(self):
+        return (
+            f"<{type(self).__name__}: {len(self.entries)} files, "
+            f"{self.parsed} parsed, {self.reused} reused>"
+        )
+
+
 def split_lin(x):
     name, value = None, None
     r = x.split(":")
@@ -42,76 +153,78 @@ def split_lin(x):
     return name, value
 
 
-def parse_lines(lines, dirname=None) -> List[Line]:
-    _lines = []
+def parse_lines(lines, dirname=None, cache: IncludeCache = None) -> List[Line]:
+    """
+    Parses the lines of a `.tree` file, in a single pass
 
-    def is_in(*x):
-        for i in x[:-1]:
-            if i in x[-1]:
-                return True
-        return False
+    Text after `#` is a comment, `${VAR}` are replaced by environment variables.
+    Lines starting with `.` are directories, `-` files and `<` includes of other
+    `.tree` files, indented at the level of the include. Other lines are skipped.
 
+    :param dirname: directory of the file, to find included files
+    :param cache: parsed included files, each file is parsed once if given
+    """
+    if cache is None:
+        cache = IncludeCache()
+    _lines = []
     for x in lines:
-        y = Line(len(x) - len(x.lstrip()))
-        x = x.strip()
-
-        # skip comments
-        if is_in("#", x):
-            s = x.split("#")
-            x = s[0]
-            if len(s) > 1:
-                y.comment = " ".join(s[1:]).strip()
-
-        # Replace env variables
-        while is_in("${", x):
-            m = re.search(r"\${(\w+)}", x)
-            d = f"{m.group(1)!r}NotFound"
-            x = x[: m.span()[0]] + os.environ.get(m.group(1), d) + x[m.span()[1] :]
-
-        # Read file or dir entry
-        if is_in(".", "-", ":", "<", x):
-            key, x = x[0], x[1:]
-            if key == ".":
-                y.entry_type = "dir"
-                y.name, y.value = split_lin(x)
-            elif key == "-":
-                y.entry_type = "file"
-                y.name, y.value = split_lin(x)
-            elif key == "<":
-                name, value = split_lin(x)
-                import_lines, _ = get_lines(value, dirname=dirname)
-                new_branch = parse_lines(import_lines)
-                for x in new_branch:
-                    x.indent += y.indent
-                if name:
-                    new_branch[0].value = name
-                _lines.extend(new_branch)
-
-        if y.entry_type:
-            _lines.append(y)
+        s = x.strip()
+        if not s:
+            continue
+        indent = len(x) - len(x.lstrip())
+
+        comment = None
+        if "#" in s:
+            s, *c = s.split("#")
+            comment = " ".join(c).strip()
+            if not s:
+                continue
+
+        # Replaced values holding variables are expanded too
+        while "${" in s:
+            s, n = _ENV_VAR.subn(_env_value, s)
+            if n == 0:
+                break
+
+        key = s[0]
+        entry_type = _ENTRY_TYPES.get(key)
+        if entry_type is not None:
+            name, value = split_lin(s[1:])
+            _lines.append(Line(indent, comment, name, value, entry_type))
+        elif key == "<":
+            name, value = split_lin(s[1:])
+            new_branch = [
+                Line(y.indent + indent, y.comment, y.name, y.value, y.entry_type)
+                for y in cache.include(value, dirname)
+            ]
+            if name:
+                new_branch[0].value = name
+            _lines.extend(new_branch)
 
     return _lines
 
 
 def set_parents(lines):
-    indents = [x.indent for x in lines]
-    assert indents[0] == 0
-    # assert indents[1] > 0
-    if len(indents) == 1:
+    """
+    Sets the parent of each line: the last line before it, indented one level less.
+    Indentation levels are given by the second line.
+    """
+    assert lines[0].indent == 0
+    if len(lines) == 1:
         return
-    di = indents[1]
+    di = lines[1].indent
 
+    last = {}  # indent -> last line with this indent
     for i, x in enumerate(lines):
         assert x.indent % di == 0
-        k = 0
-        for j, y in enumerate(lines[i::-1]):
-            if x.indent == y.indent + di:
-                k = i - j
-                break
-        x.parent_line = k
+        x.parent_line = last.get(x.indent - di, 0)
+        last[x.indent] = i
 
 
-def get_lines(*args, ensure_ext: bool = True, dirname=None):
+def tree_fname(*args, ensure_ext: bool = True, dirname=None) -> str:
+    """
+    Path of a `.tree` file, relative paths are searched in `dirname` too
+    """
     fname = args[0]
     if fname.endswith(".py"):
         fname = os.path.join(os.path.dirname(os.path.abspath(fname)), *args[1:])
@@ -125,7 +238,126 @@ def get_lines(*args, ensure_ext: bool = True, dirname=None):
         fname = os.path.join(dirname, fname)
         if not os.path.isfile(fname):
             log.error(f"File {fname} not found")
+    return fname
+
+
+def iter_lines(tree, comment: str = None, oie: bool = False) -> Iterator[str]:
+    """
+    Yields the lines of a tree in the `tree` format, see `Tree.pprint`
+
+    :param comment: file header
+    :param oie: only if exists, each directory is listed once with `os.scandir`
+        to check its entries
+    """
+    if comment:
+        for x in comment.split("\n"):
+            yield f"# {x}"
+    yield f". {tree.root}"
+    stack = [(_entry_lines(tree, tree.abs(), 2, oie), 4)]
+    while stack:
+        line, child = next(stack[-1][0], (None, None))
+        if line is None:
+            stack.pop()
+            continue
+        yield line
+        if child is not None:
+            i = stack[-1][1]
+            stack.append((_entry_lines(*child, i, oie), i + 2))
+
+
+def _entry_lines(node, path: str, i: int, oie: bool):
+    """
+    Yields the lines of the entries of a node, with the nodes of its directories
+    and their paths. Pending copy-on-write copies are read from their sources.
+    """
+    from treefiles.tree_fs import list_names, name_exists
+
+    node, pad = node._cow_data(), " " * i
+    listing = list_names(path) if oie else None
+    for d in node.dirs:
+        if not oie or name_exists(path, d.root, listing, True):
+            yield f"{pad}. {d.root}", (d, os.path.join(path, d.root))
+    for al, d in node.ndirs.items():
+        if not oie or name_exists(path, d.root, listing, True):
+            yield f"{pad}. {al}: {d.root}", (d, os.path.join(path, d.root))
+    for al, f in node.files.items():
+        if not oie or name_exists(path, f, listing, False):
+            yield f"{pad}- {al}: {f}", None
 
+
+COMPILED_VERSION = 1
+
+
+def compiled_fname(fname: str, location: Union[bool, str] = True) -> str:
+    """
+    Path of the compiled version of a `.tree` file: next to it if `location` is
+    True, or in the `location` directory
+    """
+    if location is True:
+        return f"{fname}c"
+    key = hashlib.sha1(os.fsencode(os.path.realpath(fname))).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(fname))[0]
+    return os.path.join(location, f"{name}-{key}.treec")
+
+
+def load_compiled(
+    fname: str, location: Union[bool, str] = True
+) -> Optional[List[Line]]:
+    """
+    Loads the compiled version of a `.tree` file, if it is up to date
+
+    :return: lines with their parents set, None if missing or outdated
+    """
+    try:
+        with open(compiled_fname(fname, location), "rb") as f:
+            data = marshal.loads(f.read())
+        if data["version"] != COMPILED_VERSION:
+            return None
+        if not _Include([], data["deps"], data["env"]).is_valid():
+            return None
+        columns = data["lines"]
+    except (OSError, EOFError, ValueError, TypeError, KeyError):
+        return None
+    return [Line(*x) for x in zip(*columns)]
+
+
+def compile_file(
+    fname: str, location: Union[bool, str] = True, cache: IncludeCache = None
+) -> List[Line]:
+    """
+    Parses a `.tree` file and saves it in a compact binary form (marshal), along
+    with the stats of the file and of its includes, and the values of the
+    environment variables they reference
+
+    :return: lines with their parents set
+    """
+    entry = (IncludeCache() if cache is None else cache).entry(fname)
+    lines = [
+        Line(x.indent, x.comment, x.name, x.value, x.entry_type) for x in entry.lines
+    ]
+    set_parents(lines)
+
+    fields = "indent", "comment", "name", "value", "entry_type", "parent_line"
+    data = dict(
+        version=COMPILED_VERSION,
+        deps=entry.deps,
+        env=entry.env,
+        lines=tuple([getattr(x, k) for x in lines] for k in fields),
+    )
+    out = compiled_fname(fname, location)
+    tmp = f"{out}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(marshal.dumps(data))
+        os.replace(tmp, out)  # atomic, concurrent loads read either version
+    except OSError as e:
+        log.debug(f"Cannot save compiled tree {out}: {e}")
+    return lines
+
+
+def get_lines(*args, ensure_ext: bool = True, dirname=None):
+    fname = tree_fname(*args, ensure_ext=ensure_ext, dirname=dirname)
     with open(fname) as f:
         lines = f.readlines()
 
@@ -0,0 +1,153 @@
+import fnmatch
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import List, Optional, Union
+
+import numpy as np
+
+from treefiles.tree import S, Str, _re_pattern
+from treefiles.tree_snapshot import RACY_NS
+
+
+class FrameIndex:
+    """
+    Files of a directory numbered as `<pat>_<int>`, sorted by number
+
+    Numbers are parsed once, as `Str.re` does, and kept in a NumPy array so that
+    range, last and nearest queries are binary searches. Files sharing a number
+    are sorted by name. An index is a snapshot of the directory, use `of` to get an
+    index kept up to date.
+
+    :param path: the directory
+    :param names: file names, in the order of `indices`
+    :param indices: sorted numbers of the files
+    :param mtime_ns: mtime of the directory when listed
+    :param time_ns: time of the listing
+    """
+
+    def __init__(
+        self,
+        path: str,
+        names: List[str],
+        indices: np.ndarray,
+        mtime_ns: int = None,
+        time_ns: int = None,
+    ):
+        self.path = Str(path)
+        self.names = names
+        self.indices = indices
+        self.mtime_ns = mtime_ns
+        self.time_ns = time_ns
+
+    @classmethod
+    def build(cls, path: str, pat: str = "frame", pattern: str = None) -> "FrameIndex":
+        """
+        Lists a directory and indexes its numbered files
+
+        :param pat: prefix of the number, a regular expression as in `Str.re`
+        :param pattern: glob pattern the names must match too (e.g. "*.vtk")
+        """
+        path = os.path.abspath(path)
+        time_ns = time.time_ns()
+        mtime_ns = os.stat(path).st_mtime_ns
+        with os.scandir(path) as it:
+            names = sorted(x.name for x in it if x.is_file())
+        if pattern is not None:
+            names = fnmatch.filter(names, pattern)
+
+        match = _re_pattern(pat).search
+        found = [(m, x) for m, x in zip(map(match, names), names) if m]
+        indices = np.fromiter((int(m[2]) for m, _ in found), np.int64, len(found))
+        order = np.argsort(indices, kind="stable")
+        names = [found[i][1] for i in order.tolist()]
+        return cls(path, names, indices[order], mtime_ns, time_ns)
+
+    @classmethod
+    def of(cls, path: str, pat: str = "frame", pattern: str = None) -> "FrameIndex":
+        """
+        Index of a directory, cached until the mtime of the directory changes
+        """
+        key = os.path.abspath(path), pat, pattern
+        index = _cache.pop(key, None)
+        if index is None or not index.is_valid():
+            index = cls.build(*key)
+        _cache[key] = index
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+        return index
+
+    def is_valid(self) -> bool:
+        """
+        Whether the directory is unchanged since it was listed. A listing close to
+        a change of the directory is never trusted, its mtime may not change again.
+        """
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        return mtime_ns == self.mtime_ns and mtime_ns < self.time_ns - RACY_NS
+
+    def _paths(self, start: int, stop: int) -> List[S]:
+        return [Str(os.path.join(self.path, x)) for x in self.names[start:stop]]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[S, List[S]]:
+        """
+        Paths by position, as `tree.glob("frame_*")[i]` would give
+        """
+        if isinstance(i, slice):
+            return [Str(os.path.join(self.path, x)) for x in self.names[i]]
+        return Str(os.path.join(self.path, self.names[i]))
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def range(self, start: int = None, stop: int = None) -> List[S]:
+        """
+        Paths of the files numbered from `start` included to `stop` excluded
+        """
+        lo = 0 if start is None else int(np.searchsorted(self.indices, start))
+        hi = len(self) if stop is None else int(np.searchsorted(self.indices, stop))
+        return self._paths(lo, hi)
+
+    def last(self, n: int = 1) -> List[S]:
+        """
+        Paths of the `n` files with the highest numbers
+        """
+        return self._paths(max(len(self) - n, 0), len(self))
+
+    def find(self, idx: int) -> Optional[S]:
+        """
+        Path of the file numbered `idx`, None if there is none
+        """
+        i = int(np.searchsorted(self.indices, idx))
+        if i < len(self) and self.indices[i] == idx:
+            return self[i]
+
+    def nearest(self, idx: int) -> Optional[S]:
+        """
+        Path of the file whose number is the closest to `idx`, the lowest one on a
+        tie. None if the index is empty.
+        """
+        if len(self) == 0:
+            return
+        i = int(np.searchsorted(self.indices, idx))
+        if i == len(self) or (
+            i > 0 and idx - self.indices[i - 1] <= self.indices[i] - idx
+        ):
+            i = int(np.searchsorted(self.indices, self.indices[i - 1]))
+        return self[i]
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.path}: {len(self)} files>"
+
+
+# Indexes returned by `FrameIndex.of`, least recently used first
+CACHE_SIZE = 256
+_cache = OrderedDict()
+
+log = logging.getLogger(__name__)
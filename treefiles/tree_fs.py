@@ -0,0 +1,355 @@
+import fnmatch
+import glob
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Callable, Iterable, Iterator, Tuple, Type, Optional, Set
+
+from treefiles.tree import T, S, TS, Tree, Str
+
+
+@dataclass
+class DumpReport:
+    """
+    Counts and timings of a `dump`
+    """
+
+    dirs: int = 0  # declared directories
+    created: int = 0  # directories created
+    removed_files: int = 0  # files removed by clean
+    removed_dirs: int = 0  # directories removed by clean
+    clean_time: float = 0  # seconds
+    mkdir_time: float = 0  # seconds
+
+    def __str__(self):
+        return (
+            f"{self.created}/{self.dirs} directories created in {self.mkdir_time:.3f}s, "
+            f"{self.removed_files} files and {self.removed_dirs} directories removed "
+            f"in {self.clean_time:.3f}s"
+        )
+
+
+def dump(
+    tree: T,
+    clean: bool = False,
+    workers: int = None,
+    keep: Callable[[str], bool] = None,
+) -> DumpReport:
+    """
+    Creates the directories of a tree
+
+    Each directory costs a single `mkdir` call, parents being created before their
+    children. With `workers`, directories of a same depth are created concurrently,
+    which pays off on high latency filesystems (NFS, Lustre).
+
+    :param tree: the tree to create
+    :param clean: remove the root before recreating it if it exists
+    :param workers: number of threads
+    :param keep: files left in place by `clean`, see `remove_tree`
+    """
+    report = DumpReport()
+    levels = dir_levels(tree)
+    report.dirs = sum(len(x) for x in levels)
+
+    if clean:
+        t0 = time.perf_counter()
+        report.removed_files, report.removed_dirs = remove_tree(
+            levels[0][0], workers, keep
+        )
+        report.clean_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    report.created = make_dirs(levels, workers)
+    report.mkdir_time = time.perf_counter() - t0
+    log.debug(f"Dumped {tree.abs()}: {report}")
+    return report
+
+
+def dir_levels(tree: T) -> List[List[str]]:
+    """
+    Absolute paths of the tree directories grouped by depth, without duplicates
+    """
+    levels, seen = [], set()
+    for e in tree._walk(False, False, read_only=True):
+        if e.path in seen:
+            continue
+        seen.add(e.path)
+        if e.depth == len(levels):
+            levels.append([])
+        levels[e.depth].append(e.path)
+    return levels
+
+
+def make_dirs(levels: List[List[str]], workers: int = None) -> int:
+    """
+    Creates directories level by level, parents first
+
+    :return: the number of directories created
+    """
+    return sum(sum(pmap(_mkdir, level, workers)) for level in levels)
+
+
+def _mkdir(path: str) -> bool:
+    try:
+        os.mkdir(path)
+    except FileExistsError:
+        if not os.path.isdir(path):
+            raise
+        return False
+    except FileNotFoundError:
+        # Parents of the root, or name holding separators
+        os.makedirs(path, exist_ok=True)
+    return True
+
+
+def remove_tree(
+    path: str, workers: int = None, keep: Callable[[str], bool] = None
+) -> Tuple[int, int]:
+    """
+    Removes a directory and its content, as `shutil.rmtree` does. With `workers`,
+    directories are listed, files unlinked and directories removed concurrently.
+
+    :param keep: whether a file, given its path, is left in place along with its
+        parent directories
+    :return: the numbers of files and directories removed
+    """
+    if os.path.islink(path):
+        raise OSError("Cannot call rmtree on a symbolic link")
+    if not os.path.isdir(path):
+        return 0, 0
+
+    levels, files, level = [], [], [path]
+    while level:
+        levels.append(level)
+        level = []
+        for sub_dirs, sub_files in pmap(_split_entries, levels[-1], workers):
+            level.extend(sub_dirs)
+            files.extend(sub_files)
+
+    kept = set()
+    if keep is not None:
+        for x in [x for x in files if keep(x)]:
+            while len(x) > len(path):
+                x = os.path.dirname(x)
+                kept.add(x)
+        files = [x for x in files if not keep(x)]
+        levels = [[x for x in level if x not in kept] for level in levels]
+
+    for _ in pmap(os.unlink, files, workers):
+        pass
+    for level in reversed(levels):
+        for _ in pmap(os.rmdir, level, workers):
+            pass
+    return len(files), sum(len(x) for x in levels)
+
+
+def _split_entries(path: str) -> Tuple[List[str], List[str]]:
+    """
+    Lists a directory, links to directories count as files
+    """
+    dirs, files = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.path)
+            else:
+                files.append(entry.path)
+    return dirs, files
+
+
+def scan(
+    path: TS,
+    pattern: str = None,
+    max_depth: int = None,
+    follow_symlinks: bool = False,
+    workers: int = None,
+    cls: Type[T] = Tree,
+) -> T:
+    """
+    Builds a tree mirroring a directory
+
+    Directories are listed once with `os.scandir`, using the entry types it reports.
+    Files are registered with `Tree.file`, aliases being their names without
+    extension. Entries are sorted with `natural_sort`.
+
+    :param path: directory to scan
+    :param pattern: glob pattern matched against file names (see `fnmatch`)
+    :param max_depth: maximal depth of directories scanned, 0 for `path` only.
+        Directories below are registered, but not scanned.
+    :param follow_symlinks: descend into links to directories, unless they point
+        to one of their parents
+    :param workers: number of threads listing directories of a same depth
+    :param cls: class of the tree
+    """
+    tree = cls(path)
+    scan_into(tree, pattern, max_depth, follow_symlinks, workers)
+    return tree
+
+
+def scan_into(
+    tree: T,
+    pattern: str = None,
+    max_depth: int = None,
+    follow_symlinks: bool = False,
+    workers: int = None,
+):
+    """
+    Registers the content of the directory of an existing tree, see `scan`
+    """
+    root_key = None
+    if follow_symlinks:
+        st = os.stat(tree.abs())
+        root_key = st.st_dev, st.st_ino
+
+    # Directories of a level, with the ids of their parents to detect link cycles
+    depth, level = 0, [(tree, frozenset([root_key]))]
+    while level:
+        scan_dir = lambda x: _scan_entries(x[0].abs(), pattern, follow_symlinks, x[1])
+        children = []
+        for (node, parents), (dirs, links, files) in zip(
+            level, pmap(scan_dir, level, workers)
+        ):
+            node.file(*files)
+            if max_depth is not None and depth >= max_depth:
+                node.dir(*dirs, *links)
+                continue
+            if dirs:
+                node.dir(*dirs)
+                children.extend(
+                    (d, parents | {dirs[d.root]}) for d in node.dirs[-len(dirs) :]
+                )
+            if links:
+                node.dir(*links)
+        depth, level = depth + 1, children
+
+
+def _scan_entries(path: str, pattern: str, follow_symlinks: bool, parents: frozenset):
+    """
+    Lists a directory for `scan`
+
+    :return: directories to scan (sorted dict name -> id), links to directories
+        not followed and files (sorted names)
+    """
+    from treefiles.commons import natural_sort
+
+    dirs, links, files = {}, [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                key = None
+                if follow_symlinks:
+                    st = entry.stat(follow_symlinks=False)
+                    key = st.st_dev, st.st_ino
+                dirs[entry.name] = key
+            elif entry.is_symlink() and entry.is_dir():
+                key = None
+                if follow_symlinks:
+                    st = entry.stat()
+                    key = st.st_dev, st.st_ino
+                if key is None or key in parents:
+                    links.append(entry.name)  # not followed, or cycle
+                else:
+                    dirs[entry.name] = key
+            elif pattern is None or fnmatch.fnmatch(entry.name, pattern):
+                files.append(entry.name)
+    dirs = {x: dirs[x] for x in natural_sort(list(dirs))}
+    return dirs, natural_sort(links), natural_sort(files)
+
+
+def prune(tree: T, workers: int = None) -> T:
+    """
+    Copy of a tree holding only its existing directories and files
+
+    Each directory is listed once with `os.scandir`, its declared entries being
+    checked against the listing. Missing directories are dropped with their
+    content. The copy is rooted at the absolute path of `tree`.
+
+    :param workers: number of threads listing directories of a same depth
+    """
+    copy = Tree(tree.abs())
+    level = [(tree, copy, tree.abs())]
+    while level:
+        paths = list(dict.fromkeys(path for _, _, path in level))
+        listings = dict(zip(paths, pmap(list_names, paths, workers)))
+        children = []
+        for src, dst, path in level:
+            listing = listings[path]
+            for al, d in [(None, x) for x in src.dirs] + list(src.ndirs.items()):
+                if not name_exists(path, d.root, listing, True):
+                    continue
+                node = Tree(d.root, parent=dst)
+                if al is None:
+                    dst.dirs.append(node)
+                else:
+                    dst.ndirs[al] = node
+                children.append((d, node, os.path.join(path, d.root)))
+            for al, f in src.files.items():
+                if f is not None and name_exists(path, f, listing, False):
+                    dst.files[al] = f
+        level = children
+    return copy
+
+
+def list_names(path: str) -> Optional[Tuple[Set[str], Set[str]]]:
+    """
+    Names of the directories and of the files in a directory, links followed
+
+    :return: empty sets if the directory does not exist, None if it cannot be listed
+    """
+    dirs, files = set(), set()
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    dirs.add(entry.name)
+                elif entry.is_file():
+                    files.add(entry.name)
+    except (FileNotFoundError, NotADirectoryError):
+        return set(), set()
+    except OSError:
+        return None
+    return dirs, files
+
+
+def name_exists(path: str, name: str, listing, is_dir: bool) -> bool:
+    """
+    Whether `path/name` is an existing directory (or file), using the listing of
+    `path` when `name` is a direct child, as `os.path.isdir` (or `isfile`) would
+    """
+    if listing is None or name in ("", ".", "..") or os.path.basename(name) != name:
+        check = os.path.isdir if is_dir else os.path.isfile
+        return check(os.path.join(path, name))
+    return name in listing[0 if is_dir else 1]
+
+
+def iglob_sorted(pattern: str) -> Iterator[S]:
+    """
+    Yields the paths matching a pattern, as `glob.iglob`, sorted with `natural_sort`
+    directory by directory: matching directories come in natural order and each is
+    globbed and sorted when reached, so that only one listing is held at a time
+    """
+    from treefiles.commons import natural_sort
+
+    dirname, basename = os.path.split(pattern)
+    if glob.has_magic(dirname):
+        dirs = (x for x in iglob_sorted(dirname) if os.path.isdir(x))
+    else:
+        dirs = [dirname]
+    for d in dirs:
+        names = glob.glob(os.path.join(glob.escape(d), basename))
+        yield from map(Str, natural_sort(names))
+
+
+def pmap(func: Callable, items: List, workers: int = None) -> Iterable:
+    """
+    `map` running on a thread pool if `workers` > 1 and there is more than one item
+    """
+    if workers is None or workers <= 1 or len(items) <= 1:
+        return map(func, items)
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(func, items))
+
+
+log = logging.getLogger(__name__)
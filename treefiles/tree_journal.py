@@ -0,0 +1,359 @@
+import glob
+import json
+import logging
+import os
+import time
+import weakref
+from typing import Dict, Iterator, List, Tuple
+
+from treefiles.tree import T
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, every process writes to the journal
+    fcntl = None
+
+
+class Journal:
+    """
+    Append-only log of the files registered in a container since its manifest
+    (`infos.tree`) was last written, see `Container`
+
+    Records are lines `<kind> <json path>`, kind "f" for a file registered with
+    `/` and "r" for a file removed with `unregister`, paths relative to the
+    directory of the journal. A record is written as soon as it is appended, and
+    the journal is fsync'ed in batches, so that a crash of the process loses
+    nothing and a crash of the system at most the records of the last batch. A
+    record torn by a crash is dropped on replay.
+
+    The journal is written by the first `Journal` opened on it, its owner, until it
+    is closed. The others, such as those of pool workers given the container or
+    opening it too, append to the shard `<fname>.<pid>` of their process without
+    waiting for the other processes. The owner moves the shards into the journal with `merge`, and a
+    shard process takes the journal over with `take_over` once it is released. A
+    shard is locked with `fcntl.flock` while written or merged, its writer starting
+    a new shard once it has been merged.
+
+    :param fname: path of the journal
+    :param batch: records written per fsync
+    :param interval: a record appended this many seconds after the last fsync is
+        fsync'ed at once, with the previous ones
+    """
+
+    def __init__(self, fname: str, batch: int = 64, interval: float = 1.0):
+        self.fname = os.path.abspath(fname)
+        self.root = os.path.dirname(self.fname)
+        self.batch = batch
+        self.interval = interval
+        self.count = 0  # records since the manifest was written
+        self._pid = os.getpid()
+        self.is_shard = not _own(self)
+        self._f = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    @property
+    def path(self) -> str:
+        """
+        File written by this process
+        """
+        return f"{self.fname}.{self._pid}" if self.is_shard else self.fname
+
+    def shards(self) -> List[str]:
+        """
+        Shards written by the other processes
+        """
+        return [
+            x
+            for x in glob.glob(glob.escape(self.fname) + SHARDS)
+            if is_journal_file(x, self.fname)
+        ]
+
+    def replay(self) -> Iterator[Tuple[str, str]]:
+        """
+        Yields the `(kind, path)` records of the journal, then of its shards. A
+        torn last record is removed from the journal.
+        """
+        for fname in [self.fname, *self.shards()]:
+            try:
+                with open(fname, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                log.warning(f"Dropping a torn record of {fname}")
+                if fname == self.fname and not self.is_shard:
+                    os.truncate(fname, end)
+            for kind, path in _parse(data[:end]):
+                self.count += 1
+                yield kind, path
+
+    def append(self, kind: str, path: str):
+        self._write(f"{kind} {json.dumps(path)}\n".encode(), 1)
+
+    def extend(self, kind: str, paths: List[str]):
+        data = "".join(f"{kind} {json.dumps(x)}\n" for x in paths)
+        self._write(data.encode(), len(paths))
+
+    def _write(self, data: bytes, n: int):
+        self._check_process()
+        f = self._open()
+        try:
+            view = memoryview(data)
+            while view:
+                # Raw files may write part of the data only
+                view = view[f.write(view) :]
+        finally:
+            if self.is_shard and fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self.count += n
+        self._unsynced += n
+        if (
+            self._unsynced >= self.batch
+            or time.monotonic() - self._last_sync >= self.interval
+        ):
+            self.flush()
+
+    def _open(self):
+        """
+        File of this process, a shard being locked. A shard removed by a merge
+        while waiting for the lock is created again.
+        """
+        while True:
+            if self._f is None:
+                self._f = open(self.path, "ab", buffering=0)
+            if not self.is_shard or fcntl is None:
+                return self._f
+            fcntl.flock(self._f, fcntl.LOCK_EX)
+            if os.fstat(self._f.fileno()).st_nlink > 0:
+                return self._f
+            self.close()
+
+    def _check_process(self):
+        """
+        Turns a copy of the journal made by `fork` or `pickle` into a shard of the
+        new process
+        """
+        pid = os.getpid()
+        if pid != self._pid:
+            if self._f is not None:
+                self._f.close()  # the copy inherited by fork
+            self._f, self._pid, self.is_shard = None, pid, True
+            self.count = self._unsynced = 0
+
+    def flush(self):
+        """
+        Waits for the records written to reach the disk
+        """
+        self._check_process()
+        if self._unsynced and self._f is not None:
+            os.fsync(self._f.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def take_over(self) -> bool:
+        """
+        Makes this process the owner of the journal if no other process owns it, its
+        shard being then merged as the others
+
+        :return: whether this process owns the journal
+        """
+        self._check_process()
+        if self.is_shard and _own(self):
+            self.flush()
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+            self.is_shard = False
+        return not self.is_shard
+
+    def merge(self) -> List[Tuple[str, str]]:
+        """
+        Moves the records of the shards into the journal. A shard is removed once
+        its records are on disk in the journal.
+
+        :return: the records moved
+        """
+        records = []
+        for fname in self.shards():
+            try:
+                f = open(fname, "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                if os.fstat(f.fileno()).st_nlink == 0:
+                    continue  # merged by another process while waiting
+                data = f.read()
+                data = data[: data.rfind(b"\n") + 1]
+                shard = _parse(data)
+                if shard:
+                    self._write(data, len(shard))
+                    self.flush()
+                os.unlink(fname)
+            records.extend(shard)
+        return records
+
+    def reset(self):
+        """
+        Empties the journal, once its records are in the manifest
+        """
+        self.count = self._unsynced = 0
+        if self._f is not None:
+            self._f.truncate(0)
+        elif os.path.exists(self.fname):
+            os.truncate(self.fname, 0)
+
+    def discard(self):
+        """
+        Empties the journal and removes its shards, their writers starting new ones
+        """
+        self.reset()
+        for fname in self.shards():
+            try:
+                f = open(fname, "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                if os.fstat(f.fileno()).st_nlink > 0:
+                    os.unlink(fname)
+
+    def close(self):
+        """
+        Closes the file of this process and releases the journal if owned, the next
+        records going to a shard
+        """
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        if not self.is_shard and self._pid == os.getpid():
+            _disown(self)
+            self.is_shard = True
+
+    def __getstate__(self):
+        return {**self.__dict__, "_f": None}
+
+
+def is_journal_file(path: str, fname: str) -> bool:
+    """
+    Whether `path` is the journal `fname`, its lock or one of its shards
+    """
+    if path in (fname, f"{fname}.lock"):
+        return True
+    base, _, pid = path.rpartition(".")
+    return base == fname and pid.isdigit()
+
+
+def _parse(data: bytes) -> List[Tuple[str, str]]:
+    records = []
+    for x in data.decode().splitlines():
+        kind, path = x.split(" ", 1)
+        records.append((kind, json.loads(path)))
+    return records
+
+
+def _own(journal: "Journal") -> bool:
+    """
+    Whether a journal is the owner of its file, taking it if no other journal,
+    of this process or another one, does. The owner holds a lock on
+    `<fname>.lock` until it is closed, see `_disown`.
+    """
+    if fcntl is None:
+        return True
+    fname = journal.fname
+    lock = f"{fname}.lock"
+    f, ref = _owned.get(fname, (None, None))
+    owner = None if ref is None else ref()
+    if f is not None:
+        try:
+            if not os.path.samestat(os.fstat(f.fileno()), os.stat(lock)):
+                raise FileNotFoundError
+        except FileNotFoundError:
+            f.close()  # the lock file was removed, taken again below
+            del _owned[fname]
+            f = None
+    if f is None:
+        f = _lock(lock)
+        if f is None:
+            return False
+        owner = owner or journal
+    elif owner is None:
+        owner = journal  # previous owner collected without being closed
+    _owned[fname] = f, weakref.ref(owner)
+    return owner is journal
+
+
+def _lock(fname: str):
+    """
+    Opens and locks a file, None if another process holds the lock
+    """
+    f = open(fname, "ab")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def _disown(journal: "Journal"):
+    """
+    Releases the lock of a journal owning its file
+    """
+    f, ref = _owned.get(journal.fname, (None, None))
+    if ref is not None and ref() is journal:
+        f.close()
+        del _owned[journal.fname]
+
+
+def _forget_owned():
+    """
+    Drops the locks inherited by a forked process, which would keep the journals
+    of its parent owned once released
+    """
+    for f, _ in _owned.values():
+        f.close()
+    _owned.clear()
+
+
+def write_atomic(tree: T, fname: str):
+    """
+    Writes a tree with `Tree.to_file` to a temporary file renamed over `fname`
+    once on disk, so that `fname` always holds a complete tree
+    """
+    tmp = f"{fname}.tmp"
+    tree.to_file(tmp, ensure_ext=False)
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, fname)
+    fsync_dir(os.path.dirname(fname))
+
+
+def fsync_dir(path: str):
+    """
+    Makes the renames in a directory durable, where directories can be opened
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# Glob pattern of the shards of a journal, following its name
+SHARDS = ".[0-9]*"
+# Locks held on the journals owned by this process, by path: (file, owner)
+_owned: Dict[str, tuple] = {}
+if fcntl is not None:
+    os.register_at_fork(after_in_child=_forget_owned)
+
+log = logging.getLogger(__name__)
@@ -0,0 +1,288 @@
+import fnmatch
+import functools
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Set, Tuple, Iterable
+
+from treefiles.tree import T, Str
+
+# (size, mtime_ns, inode)
+FileStat = Tuple[int, int, int]
+# (mtime_ns, files stats by name, sub directories names)
+DirStat = Tuple[int, Dict[str, FileStat], List[str]]
+
+# A directory modified shortly before a snapshot is listed again on the next
+# comparison, a change in the same timestamp tick may leave its mtime unchanged
+RACY_NS = 2 * 10**9
+
+
+class Snapshot:
+    """
+    Stats of the directories of a tree and of the files they contain
+
+    :param root: absolute path of the tree
+    :param dirs: stats of each directory, by absolute path
+    :param time_ns: time the snapshot was taken at
+    :param ignore: file names left out, or glob patterns of them
+    """
+
+    def __init__(
+        self,
+        root: str,
+        dirs: Dict[str, DirStat],
+        time_ns: int,
+        ignore: Iterable[str] = (),
+    ):
+        self.root = root
+        self.dirs = dirs
+        self.time_ns = time_ns
+        self.ignore = set(ignore)
+        self._ignored = _ignore_rule(self.ignore)
+
+    @classmethod
+    def take(cls, tree: T, ignore: Iterable[str] = ()) -> "Snapshot":
+        """
+        Lists the existing directories of a tree
+        """
+        snap = cls(tree.abs(), {}, time.time_ns(), ignore)
+        for path in tree_dirs(tree):
+            try:
+                snap.dirs[path] = list_dir(path, snap._ignored)
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+        return snap
+
+    @property
+    def files(self) -> Dict[str, FileStat]:
+        """
+        Stats of all files, by absolute path
+        """
+        return {
+            os.path.join(path, name): st
+            for path, (_, files, _) in self.dirs.items()
+            for name, st in files.items()
+        }
+
+    def is_racy(self, mtime_ns: int) -> bool:
+        return mtime_ns >= self.time_ns - RACY_NS
+
+    def to_file(self, fname: str):
+        """
+        Saves the snapshot to json, paths are relative to the root
+        """
+        d = dict(
+            root=self.root,
+            time_ns=self.time_ns,
+            ignore=sorted(self.ignore),
+            dirs={os.path.relpath(k, self.root): v for k, v in self.dirs.items()},
+        )
+        with open(fname, "w") as f:
+            json.dump(d, f)
+
+    @classmethod
+    def from_file(cls, fname: str, root: str = None) -> "Snapshot":
+        """
+        Loads a snapshot
+
+        :param root: new root of the paths, defaults to the saved one
+        """
+        with open(fname) as f:
+            d = json.load(f)
+        root = d["root"] if root is None else os.path.abspath(root)
+        dirs = {
+            os.path.normpath(os.path.join(root, k)): (
+                mtime,
+                {name: tuple(st) for name, st in files.items()},
+                subdirs,
+            )
+            for k, (mtime, files, subdirs) in d["dirs"].items()
+        }
+        return cls(root, dirs, d["time_ns"], d["ignore"])
+
+    def __repr__(self):
+        n = sum(len(x[1]) for x in self.dirs.values())
+        return f"<{type(self).__name__} {self.root}: {len(self.dirs)} dirs, {n} files>"
+
+
+@dataclass
+class TreeDiff:
+    """
+    Files added, removed or modified since a snapshot, absolute paths
+    """
+
+    added: List[Str] = field(default_factory=list)
+    removed: List[Str] = field(default_factory=list)
+    modified: List[Str] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified)
+
+
+def tree_dirs(tree: T) -> List[str]:
+    """
+    Absolute paths of the directories of a tree, parents first
+    """
+    from treefiles.tree_fs import dir_levels
+
+    return [x for level in dir_levels(tree) for x in level]
+
+
+def _ignore_rule(ignore: Set[str]) -> Callable[[str], bool]:
+    """
+    Whether a file name is one of `ignore` or matches one of its glob patterns
+    """
+    patterns = [fnmatch.translate(x) for x in ignore if re.search(r"[*?[]", x)]
+    if not patterns:
+        return ignore.__contains__
+    return functools.partial(_is_ignored, ignore, re.compile("|".join(patterns)))
+
+
+def _is_ignored(names: Set[str], pattern: re.Pattern, name: str) -> bool:
+    return name in names or pattern.match(name) is not None
+
+
+def list_dir(path: str, ignore=(), mtime: int = None) -> DirStat:
+    """
+    Lists a directory with `os.scandir`, files stats are taken from the entries
+
+    :param ignore: file names left out, or a function telling whether a name is
+    """
+    ignored = ignore if callable(ignore) else ignore.__contains__
+    if mtime is None:
+        mtime = os.stat(path).st_mtime_ns
+    files, subdirs = {}, []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            elif not ignored(entry.name):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue  # dangling symlink, or removed since listed
+                files[entry.name] = st.st_size, st.st_mtime_ns, st.st_ino
+    return mtime, files, subdirs
+
+
+def _restat(path: str, old: DirStat) -> DirStat:
+    """
+    Stats again the files of a directory whose content did not change
+    """
+    files = {}
+    for name in old[1]:
+        try:
+            st = os.stat(os.path.join(path, name))
+        except FileNotFoundError:
+            continue
+        files[name] = st.st_size, st.st_mtime_ns, st.st_ino
+    return old[0], files, old[2]
+
+
+def compare(tree: T, snapshot: Snapshot) -> Tuple[TreeDiff, Snapshot]:
+    """
+    Compares the disk with a snapshot
+
+    The directories of the tree and of the snapshot are checked. Only those whose
+    mtime changed are listed again, files of the others are just stat'ed to detect
+    modifications. New sub directories found in listed directories are explored too.
+
+    :return: the differences and a new snapshot
+    """
+    new = Snapshot(snapshot.root, {}, time.time_ns(), snapshot.ignore)
+    diff = TreeDiff()
+
+    queue = tree_dirs(tree)
+    tracked = set(queue)
+    queue.extend(x for x in snapshot.dirs if x not in tracked)
+    tracked.update(queue)
+
+    for path in queue:
+        old = snapshot.dirs.get(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if old and old[0] == mtime and not snapshot.is_racy(mtime):
+                cur = _restat(path, old)
+            else:
+                cur = list_dir(path, snapshot._ignored, mtime)
+        except (FileNotFoundError, NotADirectoryError):
+            if old:
+                diff.removed.extend(Str(os.path.join(path, x)) for x in old[1])
+            continue
+        new.dirs[path] = cur
+
+        old_files, old_subdirs = (old[1], old[2]) if old else ({}, ())
+        for name, st in cur[1].items():
+            if name not in old_files:
+                diff.added.append(Str(os.path.join(path, name)))
+            elif st != old_files[name]:
+                diff.modified.append(Str(os.path.join(path, name)))
+        diff.removed.extend(
+            Str(os.path.join(path, x)) for x in old_files if x not in cur[1]
+        )
+        for name in cur[2]:
+            sub = os.path.join(path, name)
+            if name not in old_subdirs and sub not in tracked:
+                tracked.add(sub)
+                queue.append(sub)
+
+    return diff, new
+
+
+def refresh(tree: T, snapshot: Snapshot = None) -> TreeDiff:
+    """
+    Updates a tree with the changes on disk since a snapshot, as a scanned tree
+    would be: new files and directories are added, removed ones are dropped.
+    The new snapshot is attached to the tree.
+
+    :param snapshot: defaults to the snapshot attached to the tree
+    """
+    snapshot = snapshot or tree._snapshot
+    if snapshot is None:
+        tree.snapshot()  # with the ignores of containers
+        return TreeDiff()
+
+    from treefiles.commons import natural_sort
+
+    diff, new = compare(tree, snapshot)
+    nodes = {}
+    for e in tree.walk(include_files=False):
+        nodes.setdefault(e.path, e.node)
+
+    for path, (_, files, subdirs) in new.dirs.items():
+        node = nodes.get(path)
+        if node is None:
+            parent = nodes.get(os.path.dirname(path))
+            if parent is None:
+                continue
+            node = nodes[path] = parent.dir(os.path.basename(path))
+        registered = set(node.files.values())
+        node.file(*[x for x in natural_sort(list(files)) if x not in registered])
+
+    for path in diff.removed:
+        node, name = nodes.get(os.path.dirname(path)), os.path.basename(path)
+        if node is None:
+            continue
+        node._before_change()
+        for al in [al for al, f in node.files.items() if f == name]:
+            del node.files[al]
+    for path, node in nodes.items():
+        if path in snapshot.dirs and path not in new.dirs and node.parent is not None:
+            _remove_child(node.parent, node)
+
+    tree._invalidate_alias_index()
+    tree._snapshot = new
+    return diff
+
+
+def _remove_child(parent: T, child: T):
+    parent._before_change()
+    parent.dirs = [x for x in parent.dirs if x is not child]
+    parent.ndirs = {k: x for k, x in parent.ndirs.items() if x is not child}
+    child._detach()
+
+
+log = logging.getLogger(__name__)
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+from treefiles.commons import link, reflink
+from treefiles.tree import S, Str, Tree
+from treefiles.tree_snapshot import RACY_NS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class BlobStore:
+    """
+    Content-addressed store of files, shared by containers so that identical
+    outputs are stored once, see `Container.put` and `Container.dedup`
+
+    A file is stored as `<root>/<hash[:2]>/<hash[2:]>`, read-only, and linked where
+    it is used. Hard links cost nothing but need the store on the filesystem of the
+    containers, and a file written in place changes every copy (blobs being
+    read-only, such writes fail). Symbolic links work across filesystems. Reflinks
+    are independent copies sharing their data blocks (Btrfs, XFS), plain copies
+    elsewhere.
+
+    Blobs linked with hard links are in use while their link count is above 1.
+    Symbolic links and reflinks are recorded in `<root>/refs`, `gc` checks them.
+
+    :param root: directory of the store, e.g. `.objects` next to the containers
+    :param mode: "hardlink", "symlink" or "reflink"
+    """
+
+    def __init__(self, root: str, mode: str = "hardlink"):
+        if mode not in ("hardlink", "symlink", "reflink"):
+            raise ValueError(f"Unknown link mode {mode!r}")
+        self.root = Str(os.path.abspath(root))
+        self.mode = mode
+        os.makedirs(self.root, exist_ok=True)
+        self._digests = {}  # hashes of the sources of `put`, by stat
+
+    @staticmethod
+    def hash(fname: str) -> str:
+        h = hashlib.sha256()
+        with open(fname, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def blob(self, digest: str) -> S:
+        """
+        Path of the blob of a hash
+        """
+        return self.root / digest[:2] / digest[2:]
+
+    def put(self, src: str, dst: str) -> S:
+        """
+        Links `dst` to the blob of `src`, storing a copy of `src` first if its
+        content is new. `src` is left untouched.
+
+        :return: `dst`
+        """
+        digest = self._source_hash(src)
+        with self._lock():
+            blob = self.blob(digest)
+            if not os.path.exists(blob):
+                tmp = _tmp(blob)
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                reflink(src, tmp)
+                try:
+                    self._add(tmp, blob)
+                except FileExistsError:
+                    pass  # stored meanwhile by another process
+                finally:
+                    os.remove(tmp)
+            return self._link(digest, dst)
+
+    def _source_hash(self, src: str) -> str:
+        """
+        Hash of a file, cached while its stats are unchanged. Files changed too
+        recently for their mtime to tell a new change are hashed again.
+        """
+        st = os.stat(src)
+        key = os.path.abspath(src), st.st_ino, st.st_size, st.st_mtime_ns
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = self.hash(src)
+            if st.st_mtime_ns < time.time_ns() - RACY_NS:
+                self._digests[key] = digest
+        return digest
+
+    def dedup(self, fname: str) -> bool:
+        """
+        Replaces a file by a link to the blob of its content, the file becoming the
+        blob if its content is new
+
+        :return: whether the content was stored already
+        """
+        digest = self.hash(fname)
+        with self._lock():
+            blob = self.blob(digest)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            try:
+                self._add(fname, blob)
+            except FileExistsError:
+                if not os.path.samefile(fname, blob):
+                    self._link(digest, fname)
+                return True
+            if self.mode != "hardlink":
+                self._link(digest, fname)
+            return False
+
+    def _add(self, fname: str, blob: str):
+        """
+        Makes `fname` read-only and links it as `blob`, copying it if the store is
+        on another filesystem. Raises FileExistsError if the blob exists.
+        """
+        os.chmod(fname, stat.S_IMODE(os.stat(fname).st_mode) & ~0o222)
+        try:
+            os.link(fname, blob)
+        except OSError as e:
+            if isinstance(e, FileExistsError):
+                raise
+            tmp = _tmp(blob)
+            shutil.copy2(fname, tmp)
+            try:
+                os.link(tmp, blob)
+            finally:
+                os.remove(tmp)
+
+    def _link(self, digest: str, dst: str) -> S:
+        blob = self.blob(digest)
+        if self._linked(blob, dst):
+            return Str(dst)
+        dst = link(blob, Tree(os.path.dirname(dst)), os.path.basename(dst), self.mode)
+        if self.mode != "hardlink":
+            with open(self.root / "refs", "a") as f:
+                f.write(f"{digest} {json.dumps(dst)}\n")
+        return Str(dst)
+
+    def _linked(self, blob: str, dst: str) -> bool:
+        """
+        Whether `dst` is a hard or symbolic link to the blob already
+        """
+        try:
+            if self.mode == "symlink":
+                return os.readlink(dst) == blob
+            if self.mode == "hardlink":
+                return os.path.samestat(os.lstat(dst), os.stat(blob))
+        except OSError:
+            pass
+        return False
+
+    def blobs(self) -> Iterator[Tuple[str, S]]:
+        """
+        Yields the `(hash, path)` of the blobs
+        """
+        for d in sorted(os.listdir(self.root)):
+            if len(d) == 2 and os.path.isdir(self.root / d):
+                for x in sorted(os.listdir(self.root / d)):
+                    if not x.endswith(".tmp"):
+                        yield d + x, self.root / d / x
+
+    def _referenced(self, digest: str, path: str) -> bool:
+        """
+        Whether a link recorded in `refs` still uses its blob
+        """
+        blob = self.blob(digest)
+        try:
+            if os.path.islink(path):
+                return os.path.realpath(path) == os.path.realpath(blob)
+            return os.path.getsize(path) == os.path.getsize(blob)  # reflink
+        except OSError:
+            return False
+
+    def gc(self) -> Tuple[int, int]:
+        """
+        Removes the blobs no longer linked anywhere, while no file is being stored
+
+        :return: number of blobs removed, bytes freed
+        """
+        with self._lock(exclusive=True):
+            refs, used = [], set()
+            if os.path.isfile(self.root / "refs"):
+                with open(self.root / "refs") as f:
+                    for line in f:
+                        digest, path = line.split(" ", 1)
+                        if self._referenced(digest, json.loads(path)):
+                            refs.append(line)
+                            used.add(digest)
+
+            n, size = 0, 0
+            for digest, path in self.blobs():
+                st = os.stat(path)
+                if st.st_nlink == 1 and digest not in used:
+                    os.remove(path)
+                    n, size = n + 1, size + st.st_size
+
+            with open(self.root / "refs.tmp", "w") as f:
+                f.writelines(refs)
+            os.replace(self.root / "refs.tmp", self.root / "refs")
+        log.debug(f"Removed {n} blobs ({size} bytes) from {self.root}")
+        return n, size
+
+    @contextmanager
+    def _lock(self, exclusive: bool = False):
+        """
+        Files are stored under a shared lock, `gc` runs under an exclusive one
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self.root / "lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.root} ({self.mode})>"
+
+
+def _tmp(path: str) -> str:
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+log = logging.getLogger(__name__)
@@ -0,0 +1,121 @@
+import logging
+import os
+import time
+from typing import List, Iterable, Sequence, Union, Iterator
+
+from treefiles.tree import T, S, Str
+
+
+class TreeViews(Sequence):
+    """
+    Copies of a template tree whose root is formatted with an index, see `Tree.expand`
+
+    Only the formatted roots are stored. Trees are created on access, as
+    copy-on-write copies of the template, and paths are computed from the relative
+    paths of the template.
+
+    :param template: tree whose root is a format string
+    :param roots: absolute formatted roots
+    """
+
+    def __init__(self, template: T, roots: List[str]):
+        self.template = template
+        self.roots = [Str(x) for x in roots]
+
+    @classmethod
+    def expand(cls, template: T, indices: Iterable) -> "TreeViews":
+        """
+        Formats the root of a template for each index, as `Tree.f` does. Indices
+        may be tuples of positional arguments or dicts of keyword arguments.
+        """
+        fmt = template.abs().format
+        roots = []
+        for idx in indices:
+            if isinstance(idx, dict):
+                roots.append(fmt(**idx))
+            elif isinstance(idx, tuple):
+                roots.append(fmt(*idx))
+            else:
+                roots.append(fmt(idx))
+        return cls(template, roots)
+
+    def __len__(self) -> int:
+        return len(self.roots)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[T, "TreeViews"]:
+        if isinstance(i, slice):
+            return type(self)(self.template, self.roots[i])
+        return self.template.copy(self.roots[i], cow=True)
+
+    def __iter__(self) -> Iterator[T]:
+        for root in self.roots:
+            yield self.template.copy(root, cow=True)
+
+    def _relative(self, paths: List[str]) -> List[str]:
+        """
+        Paths of the template relative to its root, "" for the root itself
+        """
+        root = self.template.abs()
+        rel = [os.path.relpath(x, root) for x in paths]
+        return ["" if x == os.curdir else x for x in rel]
+
+    def _join(self, rel: List[str]) -> List[S]:
+        """
+        Joins relative paths to every root, root by root
+        """
+        return [Str(os.path.join(r, x) if x else r) for r in self.roots for x in rel]
+
+    def path(self, *args: str) -> List[S]:
+        """
+        Joins a path to every root
+        """
+        return self._join([os.path.join(*args)] if args else [""])
+
+    def alias(self, att: str) -> List[S]:
+        """
+        Path of a file or directory alias of the template, for every root
+        """
+        x = getattr(self.template, att)
+        if x is None:
+            return [None] * len(self)
+        if not isinstance(x, str):
+            x = x.abs()
+        return self._join(self._relative([x]))
+
+    def get_files(self) -> List[S]:
+        """
+        Files of all trees, the files of the template being listed once
+        """
+        return self._join(self._relative(self.template.get_files()))
+
+    def dump(self, clean: bool = False, workers: int = None):
+        """
+        Creates the directories of all trees, one batch per depth for all of them
+
+        :param clean: remove the roots before recreating them if they exist
+        :param workers: number of threads
+        :return: a `DumpReport` summing all trees
+        """
+        from treefiles.tree_fs import DumpReport, dir_levels, make_dirs, remove_tree
+
+        levels = [self._join(self._relative(x)) for x in dir_levels(self.template)]
+        report = DumpReport(dirs=sum(len(x) for x in levels))
+        if clean:
+            t0 = time.perf_counter()
+            for root in self.roots:
+                n_files, n_dirs = remove_tree(root, workers)
+                report.removed_files += n_files
+                report.removed_dirs += n_dirs
+            report.clean_time = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        report.created = make_dirs(levels, workers)
+        report.mkdir_time = time.perf_counter() - t0
+        log.debug(f"Dumped {len(self)} trees: {report}")
+        return report
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.template.abs()}: {len(self)} trees>"
+
+
+log = logging.getLogger(__name__)
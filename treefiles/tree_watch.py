@@ -0,0 +1,434 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, AsyncIterator
+
+from treefiles.tree import T, Str
+
+# Kinds of events
+CREATED, WRITTEN, DELETED = "created", "written", "deleted"
+
+
+@dataclass
+class WatchEvent:
+    """
+    Change of a file declared in a tree
+
+    kind is one of "created", "written" (file closed after writing, or stats
+    changed when polling) and "deleted"
+    """
+
+    kind: str
+    path: Str
+    alias: str
+
+
+def declared_files(tree: T, aliases: Iterable[str] = ()) -> Dict[str, Dict[str, str]]:
+    """
+    Declared files of a tree, grouped by directory: {dir: {name: alias}}
+
+    :param aliases: only the files of these aliases, all files if empty
+    """
+    dirs = {}
+    if aliases:
+        for al in aliases:
+            d, name = os.path.split(getattr(tree, al))
+            dirs.setdefault(d, {}).setdefault(name, al)
+        return dirs
+    for e in tree._walk(False, True, read_only=True):
+        if e.is_file and e.path is not None:
+            d, name = os.path.split(e.path)
+            dirs.setdefault(d, {}).setdefault(name, e.alias)
+    return dirs
+
+
+def _stat(path: str) -> Optional[tuple]:
+    """
+    Stats telling a file changed, None if it does not exist
+    """
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def _changes(files: Dict[str, str], old: dict, new: dict) -> Iterator[WatchEvent]:
+    """
+    Events between two stats of files {path: alias}, see `_stat`
+    """
+    for path, al in files.items():
+        if path in new and path not in old:
+            yield WatchEvent(CREATED, Str(path), al)
+        elif path in old and path not in new:
+            yield WatchEvent(DELETED, Str(path), al)
+        elif path in new and new[path] != old[path]:
+            yield WatchEvent(WRITTEN, Str(path), al)
+
+
+class Inotify:
+    """
+    Minimal binding of the Linux inotify API
+    """
+
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_MASK_ADD = 0x20000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    _libc = None
+
+    def __init__(self):
+        if Inotify._libc is None:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [
+                ctypes.c_int,
+                ctypes.c_char_p,
+                ctypes.c_uint32,
+            ]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            Inotify._libc = libc
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    @classmethod
+    def available(cls) -> bool:
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            cls().close()
+        except (OSError, AttributeError):
+            return False
+        return True
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """
+        Watches a path, masks of successive calls on a same path are combined
+        """
+        mask |= self.IN_MASK_ADD
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read(
+        self, timeout: Optional[float], stop_fd: int = None
+    ) -> List[Tuple[int, int, str]]:
+        """
+        Waits for events
+
+        :param stop_fd: descriptor ending the wait when readable
+        :return: list of (watch descriptor, mask, name)
+        """
+        fds = [self.fd] if stop_fd is None else [self.fd, stop_fd]
+        r, _, _ = select.select(fds, [], [], timeout)
+        if self.fd not in r:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events, i = [], 0
+        while i < len(buf):
+            wd, mask, _, n = struct.unpack_from("iIII", buf, i)
+            name = buf[i + 16 : i + 16 + n].rstrip(b"\0")
+            events.append((wd, mask, os.fsdecode(name)))
+            i += 16 + n
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class _Stop:
+    """
+    Stop signal of a watch running in another thread, waking up its waits
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.fds = os.pipe()
+
+    def set(self):
+        self.event.set()
+        os.write(self.fds[1], b"x")
+
+    def is_set(self) -> bool:
+        return self.event.is_set()
+
+    def __del__(self):
+        for fd in self.fds:
+            os.close(fd)
+
+
+# Yielded by the watches once set up, when asked to
+_READY = object()
+
+
+def watch(
+    tree: T,
+    timeout: float = None,
+    poll_interval: float = 0.5,
+    use_inotify: bool = None,
+) -> Iterator[WatchEvent]:
+    """
+    Yields changes of the files declared in a tree
+
+    Only the directories holding declared files are watched. With inotify, a
+    directory not created yet is waited for through its closest existing parent.
+    Otherwise, declared files are stat'ed every `poll_interval` seconds.
+
+    :param tree: the tree to watch
+    :param timeout: stop after this many seconds, never if None
+    :param poll_interval: seconds between two polls, when polling
+    :param use_inotify: force or disable inotify, defaults to its availability
+    """
+    yield from _watch(tree, timeout, poll_interval, use_inotify)
+
+
+def _watch(
+    tree: T,
+    timeout: float = None,
+    poll_interval: float = 0.5,
+    use_inotify: bool = None,
+    ready: bool = False,
+    stop: _Stop = None,
+    aliases: Iterable[str] = (),
+) -> Iterator[WatchEvent]:
+    """
+    `watch`, yielding `_READY` once the changes are watched if `ready`, and
+    returning once `stop` is set
+
+    :param aliases: watch only the files of these aliases
+    """
+    if use_inotify is None:
+        use_inotify = Inotify.available()
+    end = None if timeout is None else time.monotonic() + timeout
+    dirs = declared_files(tree, aliases)
+    if use_inotify:
+        yield from _watch_inotify(dirs, end, ready, stop)
+    else:
+        yield from _watch_polling(dirs, end, poll_interval, ready, stop)
+
+
+def _remaining(end: Optional[float]) -> Optional[float]:
+    return None if end is None else max(0.0, end - time.monotonic())
+
+
+def _watch_polling(dirs, end, poll_interval, ready, stop) -> Iterator[WatchEvent]:
+    files = {
+        os.path.join(d, name): al
+        for d, names in dirs.items()
+        for name, al in names.items()
+    }
+
+    def stats():
+        res = {}
+        for path in files:
+            st = _stat(path)
+            if st is not None:
+                res[path] = st
+        return res
+
+    old = stats()
+    if ready:
+        yield _READY
+    while True:
+        remaining = _remaining(end)
+        if remaining == 0:
+            return
+        delay = poll_interval if remaining is None else min(remaining, poll_interval)
+        if stop is None:
+            time.sleep(delay)
+        elif stop.event.wait(delay):
+            return
+        new = stats()
+        yield from _changes(files, old, new)
+        old = new
+
+
+def _watch_inotify(dirs, end, ready, stop) -> Iterator[WatchEvent]:
+    ino = Inotify()
+    files_mask = (
+        Inotify.IN_CREATE
+        | Inotify.IN_MOVED_TO
+        | Inotify.IN_CLOSE_WRITE
+        | Inotify.IN_DELETE
+        | Inotify.IN_MOVED_FROM
+        | Inotify.IN_DELETE_SELF
+        | Inotify.IN_MOVE_SELF
+    )
+    parent_mask = Inotify.IN_CREATE | Inotify.IN_MOVED_TO | Inotify.IN_DELETE_SELF
+    watched: Dict[int, str] = {}  # wd -> directory
+    waiting = set(dirs)  # declared directories without watch
+    known = {}  # stats of the existing files in watched directories, see `_stat`
+
+    def add_watches() -> List[WatchEvent]:
+        """Watches declared directories, or their closest existing parent"""
+        found = []
+        for d in sorted(waiting):
+            try:
+                wd = ino.add_watch(d, files_mask)
+            except (FileNotFoundError, NotADirectoryError):
+                p = os.path.dirname(d)
+                while p != os.path.dirname(p) and not os.path.isdir(p):
+                    p = os.path.dirname(p)
+                try:
+                    watched[ino.add_watch(p, parent_mask)] = p
+                except OSError:
+                    pass
+                continue
+            watched[wd] = d
+            waiting.discard(d)
+            # Files created before the watch was set
+            for name, al in dirs[d].items():
+                path = os.path.join(d, name)
+                st = _stat(path)
+                if st is not None:
+                    known[path] = st
+                    found.append(WatchEvent(CREATED, Str(path), al))
+        return found
+
+    def recheck() -> Iterator[WatchEvent]:
+        """Changes of the files in watched directories, once events were lost"""
+        files = {
+            os.path.join(d, name): al
+            for d in set(watched.values()) & dirs.keys()
+            for name, al in dirs[d].items()
+        }
+        old = {path: known.pop(path) for path in files if path in known}
+        for path in files:
+            st = _stat(path)
+            if st is not None:
+                known[path] = st
+        yield from _changes(files, old, known)
+
+    try:
+        add_watches()  # existing files are not reported
+        if ready:
+            yield _READY
+        stop_fd = None if stop is None else stop.fds[0]
+        while True:
+            remaining = _remaining(end)
+            if remaining == 0 or (stop is not None and stop.is_set()):
+                return
+            rescan = overflow = False
+            for wd, mask, name in ino.read(remaining, stop_fd):
+                if mask & Inotify.IN_Q_OVERFLOW:
+                    # Events were dropped, directories may have been created too
+                    rescan = overflow = True
+                    continue
+                d = watched.get(wd)
+                if d is None:
+                    continue
+                if mask & Inotify.IN_IGNORED:
+                    # Directory removed, wait for it again
+                    del watched[wd]
+                    if d in dirs:
+                        waiting.add(d)
+                    rescan = True
+                    continue
+                if mask & Inotify.IN_ISDIR or d not in dirs:
+                    rescan = rescan or bool(
+                        mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO)
+                    )
+                    continue
+                al = dirs[d].get(name)
+                if al is None:
+                    continue
+                path = Str(os.path.join(d, name))
+                st = None
+                if not mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                    st = _stat(path)
+                if st is None:
+                    known.pop(path, None)
+                else:
+                    known[path] = st
+                if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                    yield WatchEvent(CREATED, path, al)
+                if mask & Inotify.IN_CLOSE_WRITE:
+                    yield WatchEvent(WRITTEN, path, al)
+                if mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                    yield WatchEvent(DELETED, path, al)
+            if rescan and waiting:
+                yield from add_watches()
+            if overflow:
+                yield from recheck()
+    finally:
+        ino.close()
+
+
+def wait_for(tree: T, *aliases: str, timeout: float = None, **kw) -> List[Str]:
+    """
+    Blocks until the files of the given aliases exist, only their directories are
+    watched
+
+    :param aliases: file aliases of the tree, all declared files if none is given
+    :param timeout: seconds, raises `TimeoutError` when exceeded
+    :param kw: see `watch`
+    :return: the paths of the files
+    """
+    paths = [getattr(tree, al) for al in aliases] or tree.get_files()
+    missing = {p for p in paths if not os.path.isfile(p)}
+    if missing:
+        watched = _watch(tree, timeout=timeout, ready=True, aliases=aliases, **kw)
+        for ev in watched:
+            if ev is _READY:
+                # Files created before the watch was set are not reported
+                missing = {p for p in missing if not os.path.isfile(p)}
+            elif ev.kind != DELETED and ev.path in missing:
+                missing.discard(ev.path)
+            elif ev.kind == DELETED and ev.path in paths:
+                missing.add(ev.path)
+            if not missing:
+                break
+        else:
+            raise TimeoutError(f"Files not found after {timeout}s: {sorted(missing)}")
+    return paths
+
+
+async def awatch(tree: T, timeout: float = None, **kw) -> AsyncIterator[WatchEvent]:
+    """
+    Asynchronous version of `watch`, the blocking waits run in a thread
+    """
+    stop = _Stop()
+    events = _watch(tree, timeout=timeout, stop=stop, **kw)
+    loop, done = asyncio.get_running_loop(), object()
+    try:
+        while True:
+            ev = await loop.run_in_executor(None, next, events, done)
+            if ev is done:
+                return
+            yield ev
+    finally:
+        stop.set()  # ends a wait still running in the executor
+        try:
+            events.close()
+        except ValueError:
+            pass  # closed when collected, once `next` returns
+
+
+log = logging.getLogger(__name__)